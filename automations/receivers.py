@@ -6,6 +6,7 @@ from automations.const import TriggerType
 from automations.models import Automation
 from core.models import QuizRecord
 from shop.models import Order
+from shop.signals import checkout_completed
 from users.models import ShopUser
 
 
@@ -25,32 +26,33 @@ def new_user_created(sender, instance, created, **kwargs):
                 )
 
 
-@receiver(post_save, sender=Order)
-def new_order_created(sender, instance, created, **kwargs):
-    # We have to assure there are some items already in order to have data to use
-    if instance.items.exists() and not instance.post_save_triggered:
-        new_order_automations = Automation.objects.filter(
-            Q(trigger__trigger_type=TriggerType.NEW_ORDER)
-            & (
-                (Q(trigger__products=None))
-                | Q(
-                    trigger__products__in=[
-                        item.product for item in instance.items.all()
-                    ]
-                )
+@receiver(checkout_completed)
+def new_order_created(sender, order, **kwargs):
+    # Claiming the order first, automations must not run twice for the same order
+    if not Order.objects.filter(pk=order.pk, post_save_triggered=False).update(
+        post_save_triggered=True
+    ):
+        return
+
+    new_order_automations = Automation.objects.filter(
+        Q(trigger__trigger_type=TriggerType.NEW_ORDER)
+        & (
+            (Q(trigger__products=None))
+            | Q(
+                trigger__products__in=[
+                    item.product_id for item in order.items.all()
+                ]
             )
         )
-        for automation in new_order_automations:
-            for action in automation.actions.filter(is_active=True):
-                action.run(
-                    trigger_data={
-                        "order": instance,
-                        "recipients": [instance.billing_address.email],
-                    }
-                )
-
-        instance.post_save_triggered = True
-        instance.save()
+    )
+    for automation in new_order_automations:
+        for action in automation.actions.filter(is_active=True):
+            action.run(
+                trigger_data={
+                    "order": order,
+                    "recipients": [order.billing_address.email],
+                }
+            )
 
 
 @receiver(post_save, sender=QuizRecord)
@@ -8,6 +8,7 @@ from solo.admin import SingletonModelAdmin
 from core.models import (
     SiteConfiguration,
     Button,
+    OutboxJob,
 )
 from core.models.fonts import GoogleFontVariant, GoogleFontSubset, GoogleFont
 
@@ -24,3 +25,10 @@ class ButtonAdmin(admin.ModelAdmin):
 @admin.register(SiteConfiguration)
 class SiteConfigurationAdmin(SingletonModelAdmin, admin.ModelAdmin):
     pass
+
+
+@admin.register(OutboxJob)
+class OutboxJobAdmin(admin.ModelAdmin):
+    list_display = ("task", "status", "attempts", "run_after", "created_at")
+    list_filter = ("status", "task")
+    readonly_fields = ("created_at", "updated_at")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import requeue_stalled_jobs, run_next_job
+
+
+class Command(BaseCommand):
+    help = "Runs pending outbox jobs. Several workers can run side by side."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no due jobs instead of polling for new ones.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2,
+            help="Seconds to wait before checking for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            requeue_stalled_jobs()
+            processed = 0
+            while run_next_job():
+                processed += 1
+
+            if processed:
+                self.stdout.write(f"Processed {processed} outbox jobs.")
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_controlcenter_pickup_point_enabled_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=128, verbose_name='Task')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Payload')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Run After')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Outbox Job',
+                'verbose_name_plural': 'Outbox Jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxjob',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['run_after'], name='outbox_pending_idx'),
+        ),
+    ]
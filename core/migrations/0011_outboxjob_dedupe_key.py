@@ -0,0 +1,22 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_outboxjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxjob',
+            name='dedupe_key',
+            field=models.CharField(blank=True, help_text='Only one pending job can have the same key.', max_length=255, null=True, verbose_name='Dedupe Key'),
+        ),
+        migrations.AddConstraint(
+            model_name='outboxjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('dedupe_key',), name='outbox_pending_dedupe_key'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_outboxjob_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='Status'),
+        ),
+    ]
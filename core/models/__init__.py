@@ -10,3 +10,5 @@ from .pages import HomePage, SimplePage
 from .site_settings import ContactSettings, BrandSettings, ControlCenter
 
 from .fonts import GoogleFont
+
+from .outbox import OutboxJob
@@ -0,0 +1,61 @@
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class OutboxJob(models.Model):
+    """
+    Side effect (email, third-party API call, ...) recorded in the same transaction
+    as the data it belongs to and executed later by the outbox worker.
+    For usage see `core/outbox.py`.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    task = models.CharField(_("Task"), max_length=128)
+    payload = models.JSONField(_("Payload"), default=dict, blank=True)
+    status = models.CharField(
+        _("Status"),
+        choices=Status.choices,
+        default=Status.PENDING,
+        max_length=16,
+    )
+    attempts = models.PositiveIntegerField(_("Attempts"), default=0)
+    run_after = models.DateTimeField(_("Run After"), default=timezone.now)
+    last_error = models.TextField(_("Last Error"), blank=True, default="")
+    dedupe_key = models.CharField(
+        _("Dedupe Key"),
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text=_("Only one pending job can have the same key."),
+    )
+
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+    class Meta:
+        verbose_name = _("Outbox Job")
+        verbose_name_plural = _("Outbox Jobs")
+        indexes = [
+            models.Index(
+                fields=["run_after"],
+                condition=Q(status="pending"),
+                name="outbox_pending_idx",
+            )
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedupe_key"],
+                condition=Q(status="pending"),
+                name="outbox_pending_dedupe_key",
+            )
+        ]
@@ -0,0 +1,166 @@
+"""
+Transactional outbox.
+
+Side effects are registered as tasks and enqueued as OutboxJob rows in the same
+transaction as the data they need, so they are never lost nor run for rolled back
+data. Jobs are executed by `manage.py run_outbox_worker`.
+
+    @outbox.task("shop.create_packet")
+    def create_packet(order_id):
+        ...
+
+    outbox.enqueue("shop.create_packet", order_id=order.pk)
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from core.models import OutboxJob
+
+logger = logging.getLogger("django")
+
+TASKS = {}
+
+
+def task(name: str):
+    """Registers the decorated function as an outbox task under the given name."""
+
+    def register(func):
+        TASKS[name] = func
+        return func
+
+    return register
+
+
+def enqueue(
+    task_name: str, delay: timedelta = None, dedupe_key: str = None, **payload
+) -> OutboxJob:
+    """
+    Records a new job. Call it inside the transaction that writes the job's data.
+
+    :param task_name: Name the task was registered with.
+    :param delay: Postpone the first run.
+    :param dedupe_key: Coalesces jobs, nothing is recorded while a pending job
+        with the same key exists. Combined with delay, all jobs enqueued within
+        the delay run once. Jobs that already started running don't coalesce,
+        they might have read the data before the change the new job is for.
+    :param payload: JSON serializable keyword arguments passed to the task.
+    :return: The job, without a primary key if it was coalesced.
+    """
+    job = OutboxJob(
+        task=task_name,
+        payload=payload,
+        run_after=timezone.now() + (delay or timedelta()),
+        dedupe_key=dedupe_key,
+    )
+    if dedupe_key:
+        # The conflict with the pending job's unique key is silently skipped
+        OutboxJob.objects.bulk_create([job], ignore_conflicts=True)
+    else:
+        job.save()
+
+    return job
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff, doubles the delay with every failed attempt."""
+    return timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def requeue_stalled_jobs() -> int:
+    """
+    Returns jobs running for more than settings.OUTBOX_RUNNING_TIMEOUT seconds,
+    whose worker must have died, to the pending ones. Jobs superseded by a newer
+    pending job with the same dedupe key fail instead.
+
+    :return: Number of requeued jobs.
+    """
+    stalled = OutboxJob.objects.filter(
+        status=OutboxJob.Status.RUNNING,
+        updated_at__lt=timezone.now() - timedelta(seconds=settings.OUTBOX_RUNNING_TIMEOUT),
+    )
+    superseded = Exists(
+        OutboxJob.objects.filter(
+            status=OutboxJob.Status.PENDING, dedupe_key=OuterRef("dedupe_key")
+        )
+    )
+    stalled.filter(superseded).update(
+        status=OutboxJob.Status.FAILED, last_error="Stalled, superseded by a newer job."
+    )
+    requeued = stalled.update(
+        status=OutboxJob.Status.PENDING, run_after=timezone.now()
+    )
+    if requeued:
+        logger.warning(f"Requeued {requeued} stalled outbox jobs.")
+    return requeued
+
+
+def run_next_job() -> bool:
+    """
+    Claims a single due job and runs it.
+
+    The job is marked as running in its own short transaction, so new jobs with the
+    same dedupe key are recorded from then on. The task then runs in a transaction
+    together with the job's status update, task's own writes are rolled back if it fails.
+
+    :return: False if there was no job to run.
+    """
+    with transaction.atomic():
+        job = (
+            OutboxJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=OutboxJob.Status.PENDING, run_after__lte=timezone.now()
+            )
+            .order_by("run_after")
+            .first()
+        )
+        if not job:
+            return False
+
+        job.status = OutboxJob.Status.RUNNING
+        job.attempts += 1
+        job.save(update_fields=["status", "attempts", "updated_at"])
+
+    try:
+        with transaction.atomic():
+            TASKS[job.task](**job.payload)
+            job.status = OutboxJob.Status.DONE
+            job.last_error = ""
+            job.save()
+        return True
+    except Exception as e:
+        logger.warning(f"Outbox job {job.pk} failed.", exc_info=True)
+        job.last_error = repr(e)
+
+    # A superseded job isn't retried, the newer one does the same work. Checked in the
+    # same statement as the status is written, a new job might be recorded meanwhile.
+    superseded = Exists(
+        OutboxJob.objects.filter(
+            status=OutboxJob.Status.PENDING, dedupe_key=OuterRef("dedupe_key")
+        )
+    )
+    failed = Q(superseded) | Q(attempts__gte=settings.OUTBOX_MAX_ATTEMPTS)
+    try:
+        with transaction.atomic():
+            OutboxJob.objects.filter(pk=job.pk).update(
+                status=Case(
+                    When(failed, then=Value(OutboxJob.Status.FAILED)),
+                    default=Value(OutboxJob.Status.PENDING),
+                ),
+                run_after=timezone.now() + retry_delay(job.attempts),
+                last_error=job.last_error,
+                updated_at=timezone.now(),
+            )
+    except IntegrityError:
+        # The newer job was committed only after the statement started
+        OutboxJob.objects.filter(pk=job.pk).update(
+            status=OutboxJob.Status.FAILED,
+            last_error=job.last_error,
+            updated_at=timezone.now(),
+        )
+
+    return True
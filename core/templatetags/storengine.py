@@ -4,7 +4,12 @@ from django import template
 from django.db.models import QuerySet
 from wagtail.models import Page, Locale
 
-from shop.models import Cart
+from shop.cart import (
+    get_cart_summary,
+    get_reservation_holder,
+    prefetch_available_variants,
+)
+from shop.models import Product
 
 register = template.Library()
 
@@ -30,11 +35,7 @@ def filter_by_locale(
 
 @register.simple_tag(takes_context=True)
 def cart(context):
-    cart_pk = context["request"].session.get("cart")
-    try:
-        return Cart.objects.get(pk=cart_pk)
-    except Cart.DoesNotExist:
-        return Cart.objects.none()
+    return get_cart_summary(context["request"])
 
 
 @register.filter
@@ -50,6 +51,24 @@ def filter_active(queryset: QuerySet):
         return queryset
 
 
+@register.filter
+def with_availability(queryset: QuerySet, request):
+    """
+    Return queryset of products (or of objects with a product) with their variants
+    prefetched along with pieces available to the visitor of the request
+    :param queryset: queryset of products to list
+    :param request: current request
+    :return: Queryset with prefetched variants
+    """
+    try:
+        lookup = "variants" if queryset.model is Product else "product__variants"
+        return queryset.prefetch_related(
+            prefetch_available_variants(lookup, get_reservation_holder(request))
+        )
+    except AttributeError:
+        return queryset
+
+
 numeric_test = re.compile(r"^\d+$")
 
 
@@ -1,3 +1,137 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from core import outbox
+from core.models import OutboxJob
+
+CALLS = []
+
+
+@outbox.task("tests.record")
+def record(**payload):
+    CALLS.append(payload)
+
+
+@outbox.task("tests.fail")
+def fail():
+    raise RuntimeError("Failed")
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_due_jobs_run_in_order(self):
+        outbox.enqueue("tests.record", delay=timedelta(hours=1), value="later")
+        outbox.enqueue("tests.record", value="first")
+        outbox.enqueue("tests.record", value="second")
+
+        self.assertTrue(outbox.run_next_job())
+        self.assertTrue(outbox.run_next_job())
+        self.assertFalse(outbox.run_next_job())
+
+        self.assertEqual(CALLS, [{"value": "first"}, {"value": "second"}])
+        self.assertEqual(OutboxJob.objects.filter(status=OutboxJob.Status.DONE).count(), 2)
+
+    def test_failed_job_is_retried_later(self):
+        job = outbox.enqueue("tests.fail")
+
+        self.assertTrue(outbox.run_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, OutboxJob.Status.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("Failed", job.last_error)
+
+    def test_job_fails_after_max_attempts(self):
+        job = outbox.enqueue("tests.fail")
+        OutboxJob.objects.filter(pk=job.pk).update(attempts=7)
+
+        with self.settings(OUTBOX_MAX_ATTEMPTS=8):
+            outbox.run_next_job()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, OutboxJob.Status.FAILED)
+
+    def test_pending_jobs_with_the_same_key_are_coalesced(self):
+        outbox.enqueue("tests.record", dedupe_key="payment:1", value=1)
+        coalesced = outbox.enqueue("tests.record", dedupe_key="payment:1", value=2)
+        outbox.enqueue("tests.record", dedupe_key="payment:2", value=3)
+
+        self.assertIsNone(coalesced.pk)
+        while outbox.run_next_job():
+            pass
+        self.assertEqual(CALLS, [{"value": 1}, {"value": 3}])
+
+    def test_jobs_dont_coalesce_into_a_running_job(self):
+        outbox.enqueue("tests.record", dedupe_key="payment:1")
+        OutboxJob.objects.update(status=OutboxJob.Status.RUNNING)
+
+        outbox.enqueue("tests.record", dedupe_key="payment:1")
+
+        self.assertEqual(
+            OutboxJob.objects.filter(
+                status=OutboxJob.Status.PENDING, dedupe_key="payment:1"
+            ).count(),
+            1,
+        )
+
+    def test_stalled_superseded_job_fails(self):
+        outbox.enqueue("tests.record", dedupe_key="payment:1")
+        OutboxJob.objects.update(status=OutboxJob.Status.RUNNING)
+        outbox.enqueue("tests.record", dedupe_key="payment:1")
+
+        with self.settings(OUTBOX_RUNNING_TIMEOUT=-60):
+            self.assertEqual(outbox.requeue_stalled_jobs(), 0)
+
+        self.assertEqual(
+            OutboxJob.objects.filter(status=OutboxJob.Status.FAILED).count(), 1
+        )
+
+    def test_stalled_jobs_are_requeued(self):
+        job = outbox.enqueue("tests.record")
+        OutboxJob.objects.filter(pk=job.pk).update(status=OutboxJob.Status.RUNNING)
+
+        with self.settings(OUTBOX_RUNNING_TIMEOUT=-60):
+            self.assertEqual(outbox.requeue_stalled_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, OutboxJob.Status.PENDING)
+
+
+class OutboxSupersededJobTests(TransactionTestCase):
+    # Restores the data of migrations that the flush after each test deletes
+    serialized_rollback = True
+
+    def test_failed_job_superseded_while_running_isnt_retried(self):
+        @outbox.task("tests.fail_superseded")
+        def fail_superseded():
+            def enqueue_newer():
+                try:
+                    outbox.enqueue("tests.record", dedupe_key="key")
+                finally:
+                    connection.close()
+
+            # A newer job with the same key is committed while this one runs
+            thread = threading.Thread(target=enqueue_newer)
+            thread.start()
+            thread.join()
+            raise RuntimeError("Failed")
+
+        outbox.enqueue("tests.fail_superseded", dedupe_key="key")
+
+        outbox.run_next_job()
+
+        job = OutboxJob.objects.get(task="tests.fail_superseded")
+        self.assertEqual(job.status, OutboxJob.Status.FAILED)
+        self.assertEqual(
+            OutboxJob.objects.filter(
+                status=OutboxJob.Status.PENDING, dedupe_key="key"
+            ).count(),
+            1,
+        )
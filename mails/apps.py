@@ -6,3 +6,6 @@ class MailsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mails'
     verbose_name = _("Mails")
+
+    def ready(self):
+        import mails.receivers  # Allow signal receivers to be run in a separate file
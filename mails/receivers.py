@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mails.utils import clear_internal_mailing_list
+from users.models import ShopUser
+
+
+@receiver(post_save, sender=ShopUser)
+@receiver(post_delete, sender=ShopUser)
+def shop_user_changed(sender, instance, **kwargs):
+    # Staff flags or emails might have changed
+    clear_internal_mailing_list()
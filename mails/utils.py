@@ -3,8 +3,8 @@ import mimetypes
 from smtplib import SMTPSenderRefused
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.db import ProgrammingError
+from django.core.cache import caches
+from django.core.mail import EmailMultiAlternatives, get_connection
 
 from core.utils import textify_html
 from mails.models import Email
@@ -12,14 +12,33 @@ from users.models import ShopUser
 
 logger = logging.getLogger("django")
 
-try:
-    INTERNAL_NOTIFICATIONS_MAILING_LIST = list(
-        ShopUser.objects.filter(
-            is_staff=True, send_internal_notifications=True
-        ).values_list("email", flat=True)
-    )
-except ProgrammingError:
-    INTERNAL_NOTIFICATIONS_MAILING_LIST = []
+INTERNAL_MAILING_LIST_CACHE_KEY = "mails:internal_notifications_mailing_list"
+
+
+def get_internal_mailing_list() -> list:
+    """
+    Returns emails of staff users receiving internal notifications.
+    Kept in the cache shared by all processes, so the outbox worker sending the mails
+    sees it cleared whenever a ShopUser is saved or deleted (see mails.receivers).
+    """
+    cache = caches["shared"]
+    mailing_list = cache.get(INTERNAL_MAILING_LIST_CACHE_KEY)
+    if mailing_list is None:
+        mailing_list = list(
+            ShopUser.objects.filter(
+                is_staff=True, send_internal_notifications=True
+            ).values_list("email", flat=True)
+        )
+        cache.set(
+            INTERNAL_MAILING_LIST_CACHE_KEY,
+            mailing_list,
+            settings.INTERNAL_MAILING_LIST_CACHE_TIMEOUT,
+        )
+    return mailing_list
+
+
+def clear_internal_mailing_list():
+    caches["shared"].delete(INTERNAL_MAILING_LIST_CACHE_KEY)
 
 
 def send_notification(
@@ -29,7 +48,7 @@ def send_notification(
     body: str = None,
 ) -> bool:
     """
-    Sends a notification email.
+    Sends a notification email, one message per recipient over a single SMTP connection.
 
     :param email: Email object that already includes all email data.
     :param recipients: List of recipients
@@ -38,44 +57,54 @@ def send_notification(
     """
     if type(recipients) is str:
         recipients = [recipients]  # Convert to list for Django Emails
-    for recipient in recipients:
-        if email:
-            text_body = textify_html(email.body)
+
+    if email:
+        # Rendered and read once, shared by the messages of all recipients
+        text_body = textify_html(email.body)
+        attachments = [
+            (
+                attachment.file_name,
+                attachment.file.file.read(),
+                mimetypes.guess_type(attachment.file.file.name)[0],
+            )
+            for attachment in email.email_attachments.all()
+        ]
+        messages = []
+        for recipient in recipients:
             msg = EmailMultiAlternatives(
                 email.subject,
                 text_body,
                 settings.ADMIN_EMAIL,
                 to=[recipient],
                 reply_to=[settings.SUPPORT_EMAIL],
-                attachments=[
-                    (
-                        attachment.file_name,
-                        attachment.file.file.read(),
-                        mimetypes.guess_type(attachment.file.file.name)[0],
-                    )
-                    for attachment in email.email_attachments.all()
-                ],
+                attachments=attachments,
             )
             msg.attach_alternative(email.body, "text/html")
-            try:
-                msg.send()
-            except SMTPSenderRefused:
-                logger.warning(
-                    "SMTP Error while sending notification.", exc_info=True
-                )
-        elif subject and body:
-            try:
-                EmailMultiAlternatives(
-                    subject,
-                    body,
-                    settings.ADMIN_EMAIL,
-                    to=[recipient],
-                    reply_to=[settings.SUPPORT_EMAIL],
-                ).send()
-            except SMTPSenderRefused:
-                logger.warning(
-                    "SMTP Error while sending notification.", exc_info=True
-                )
+            messages.append(msg)
+    elif subject and body:
+        messages = [
+            EmailMultiAlternatives(
+                subject,
+                body,
+                settings.ADMIN_EMAIL,
+                to=[recipient],
+                reply_to=[settings.SUPPORT_EMAIL],
+            )
+            for recipient in recipients
+        ]
+    else:
+        messages = []
+
+    if messages:
+        with get_connection() as connection:
+            for msg in messages:
+                # Sent one by one, so a refused message doesn't stop the others
+                try:
+                    connection.send_messages([msg])
+                except SMTPSenderRefused:
+                    logger.warning(
+                        "SMTP Error while sending notification.", exc_info=True
+                    )
 
     return True  # TODO: return message status
 
@@ -86,7 +115,7 @@ def send_internal_notification(
     """Same as send_notification(), but automatically sets the recipients to internal addresses."""
     return send_notification(
         email=email,
-        recipients=INTERNAL_NOTIFICATIONS_MAILING_LIST,
+        recipients=get_internal_mailing_list(),
         subject=subject,
         body=body,
     )
@@ -1,6 +1,8 @@
 import json
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.files.storage import default_storage
+from django.http import FileResponse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
@@ -10,6 +12,8 @@ from pygments.formatters.html import HtmlFormatter
 from pygments.lexers.data import JsonLexer
 
 from core.utils import is_admin_logged_in
+from shop.api.packeta_api import Packeta
+from shop.forms import AddressAdminForm
 from shop.models import (
     Product,
     ShippingAddress,
@@ -17,7 +21,10 @@ from shop.models import (
     BillingType,
     GopayPayment,
     Category, Order, Invoice, OrderItem, Cart, CartItem,
+    InventoryMovement,
 )
+from shop.inventory import adjust_stock
+from shop.packeta_labels import get_packet_labels
 
 admin.site.register(Cart)
 admin.site.register(CartItem)
@@ -53,6 +60,33 @@ class GopayPaymentAdmin(admin.ModelAdmin):
     pretty_data.short_description = _("Payment Data")
 
 
+@admin.register(InventoryMovement)
+class InventoryMovementAdmin(admin.ModelAdmin):
+    """Movements can't be changed, stock is adjusted by adding adjustment movements."""
+
+    list_display = ("variant", "quantity", "reason", "order", "created_at")
+    list_filter = ("reason", "created_at")
+    search_fields = ("variant__name", "variant__variant_id", "note")
+    fields = ("variant", "quantity", "note")
+    readonly_fields = ("variant", "quantity", "reason", "order", "note", "created_at")
+
+    def get_fields(self, request, obj=None):
+        return self.fields if obj is None else self.readonly_fields
+
+    def get_readonly_fields(self, request, obj=None):
+        return () if obj is None else self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        movement = adjust_stock(obj.variant, obj.quantity, obj.note)
+        obj.pk = movement.pk
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ("name", "is_active")
@@ -84,6 +118,7 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(ShippingAddress)
 class ShippingAddressAdmin(admin.ModelAdmin):
+    form = AddressAdminForm
     list_display = ("full_name", "address1", "city", "zip_code", "country")
     list_display_links = ("full_name", "address1")
     readonly_fields = ("created_by", "created_at", "updated_at")
@@ -96,6 +131,7 @@ class ShippingAddressAdmin(admin.ModelAdmin):
 
 @admin.register(BillingAddress)
 class BillingAddressAdmin(admin.ModelAdmin):
+    form = AddressAdminForm
     list_display = ("full_name", "address1", "city", "zip_code", "country")
     list_display_links = ("full_name", "address1")
     readonly_fields = ("created_by", "created_at", "updated_at")
@@ -171,6 +207,7 @@ class OrderAdmin(admin.ModelAdmin):
         "created_by",
         "confirmation_email_sent",
         "internal_notification_sent",
+        "packet",
         "created_at",
         "updated_at",
     )
@@ -179,6 +216,40 @@ class OrderAdmin(admin.ModelAdmin):
         "billing_address__first_name",
         "billing_address__last_name",
     )
+    actions = ("create_packets_and_labels",)
+
+    @admin.action(description=_("Create Packeta packets and print labels"))
+    def create_packets_and_labels(self, request, queryset):
+        """
+        Creates missing packets of the selected Packeta orders in one batch
+        and responds with the labels PDF of all of them.
+        """
+        orders = list(
+            queryset.exclude(packeta_point_id__isnull=True)
+            .exclude(packeta_point_id="")
+            .select_related("shipping_address", "packet")
+        )
+        _created, failed = Packeta().create_packets_from_orders(
+            [order for order in orders if not order.packet_id]
+        )
+        if failed:
+            self.message_user(
+                request,
+                _("Packets of these orders couldn't be created: %(orders)s")
+                % {"orders": ", ".join(str(order) for order in failed)},
+                messages.WARNING,
+            )
+
+        packet_ids = [order.packet.packet_id for order in orders if order.packet]
+        if not packet_ids:
+            self.message_user(request, _("No packets to print."), messages.ERROR)
+            return None
+
+        return FileResponse(
+            default_storage.open(get_packet_labels(packet_ids)),
+            as_attachment=True,
+            filename="packeta-labels.pdf",
+        )
 
 
 @admin.register(Invoice)
@@ -1,25 +1,33 @@
-import base64
+import io
 import logging
-from xml.dom.minidom import parseString
 
-import requests
-import xmltodict
-from dicttoxml import dicttoxml
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
 from shop import models
+from shop.api.packeta_transport import (
+    CREATE_PACKET_TEMPLATE,
+    PACKET_STATUS_TEMPLATE,
+    PACKETS_LABELS_PDF_TEMPLATE,
+    PacketaError,
+    get_transport,
+    render,
+    render_packet_ids,
+)
+from shop.utils import fetch_concurrently
 
 logger = logging.getLogger("django")
 
 
 class Packeta:
     """
-    Class for Packeta API requests
+    Class for Packeta API requests, sent through the shared PacketaTransport.
     """
 
-    def __init__(self):
-        self.base_url = settings.PACKETA_BASE_URL
+    def __init__(self, transport=None):
         self.api_password = settings.PACKETA_API_PASSWORD
+        self.transport = transport or get_transport()
 
     def _generate_packet_xml(
             self,
@@ -33,24 +41,8 @@ class Packeta:
             cod_amount,
             weight_kg,
     ):
-
-        return """
-        <createPacket>
-            <apiPassword>{api_password}</apiPassword>
-            <packetAttributes>
-                <number>{order_number}</number>
-                <name>{first_name}</name>
-                <surname>{last_name}</surname>
-                <email>{email}</email>
-                <addressId>{packeta_point_id}</addressId>
-                <cod>{cod_amount}</cod>
-                <value>{price}</value>
-                <currency>{currency}</currency>
-                <weight>{weight_kg}</weight>
-                <eshop>{sender_id}</eshop>
-            </packetAttributes>
-        </createPacket>
-        """.format(
+        return render(
+            CREATE_PACKET_TEMPLATE,
             api_password=self.api_password,
             order_number=order_number,
             first_name=first_name,
@@ -64,26 +56,14 @@ class Packeta:
             sender_id=settings.PACKETA_SENDER_ID,
         )
 
-    def _xml_id_func(self, parent):
-        return "id"
-
     def _generate_packet_labels_xml(self, packet_ids):
-        orders = []
-        for number in packet_ids:
-            orders.append(number)
-
-        data = {
-            "packetsLabelsPdf": {
-                "apiPassword": self.api_password,
-                "packetIds": orders,
-                "format": "A7 on A4",
-                "offset": 0,
-            }
-        }
-        xml = dicttoxml(
-            data, attr_type=False, root=False, item_func=self._xml_id_func
+        return render(
+            PACKETS_LABELS_PDF_TEMPLATE,
+            markup={"packet_ids": render_packet_ids(packet_ids)},
+            api_password=self.api_password,
+            label_format="A7 on A4",
+            offset=0,
         )
-        return parseString(xml).toprettyxml().split("\n", 1)[-1]
 
     def create_packet(
             self,
@@ -97,46 +77,42 @@ class Packeta:
             cod_amount,
             weight_kg,
     ):
-        response = requests.post(
-            self.base_url,
-            headers={"Content-Type": "application/xml"},
-            data=self._generate_packet_xml(
-                order_number,
-                first_name,
-                last_name,
-                email,
-                packeta_point_id,
-                price,
-                currency,
-                cod_amount,
-                weight_kg,
-            ).encode("utf-8"),
-        )
-
-        logger.info(response.text)
-
         try:
-            tree = xmltodict.parse(response.text)
-            packet_id = tree["response"]["result"]["id"]
-            packet_barcode = tree["response"]["result"]["barcode"]
-            packet_barcode_text = tree["response"]["result"]["barcodeText"]
-            new_packet = models.Packet(
-                packet_id=packet_id,
-                barcode=packet_barcode,
-                barcode_text=packet_barcode_text,
+            response = self.transport.post(
+                self._generate_packet_xml(
+                    order_number,
+                    first_name,
+                    last_name,
+                    email,
+                    packeta_point_id,
+                    price,
+                    currency,
+                    cod_amount,
+                    weight_kg,
+                ),
+                idempotent=False,
             )
-            new_packet.save()
+        except PacketaError:
+            logger.info("Unable to create a Packet.", exc_info=True)
+            raise
+
+        logger.info(response)
 
-            order = models.Order.objects.get(order_number=order_number)
-            order.packet = new_packet
-            order.save()
-        except KeyError:
-            logger.info("Unable to create a Packet.")
+        new_packet = models.Packet(
+            packet_id=response["result"]["id"],
+            barcode=response["result"]["barcode"],
+            barcode_text=response["result"]["barcodeText"],
+        )
+        new_packet.save()
 
-        return response.text
+        order = models.Order.objects.get(order_number=order_number)
+        order.packet = new_packet
+        order.save()
 
-    def create_packet_from_order(self, order):
-        return self.create_packet(
+        return response
+
+    def _order_packet_attributes(self, order):
+        return (
             order.order_number,
             order.shipping_address.first_name,
             order.shipping_address.last_name,
@@ -148,44 +124,73 @@ class Packeta:
             order.total_weight_kg,
         )
 
-    def get_packet_labels_pdf(self, packet_ids):
-        response = requests.post(
-            self.base_url,
-            headers={"Content-Type": "application/xml"},
-            data=self._generate_packet_labels_xml(packet_ids),
+    def create_packet_from_order(self, order):
+        return self.create_packet(*self._order_packet_attributes(order))
+
+    def create_packets_from_orders(self, orders, max_workers=None):
+        """
+        Creates packets of the orders with concurrent requests, at most max_workers
+        (settings.PACKETA_CREATE_CONCURRENCY) at a time. Packets are saved and linked
+        to their orders with one bulk insert and one bulk update.
+
+        :param orders: Orders with shipping_address loaded.
+        :return: Tuple of orders with a new packet and orders whose packet creation failed.
+        """
+        responses = fetch_concurrently(
+            lambda order: self.transport.post(
+                self._generate_packet_xml(*self._order_packet_attributes(order)),
+                idempotent=False,
+            ),
+            list(orders),
+            max_workers or settings.PACKETA_CREATE_CONCURRENCY,
         )
-        tree = xmltodict.parse(response.text)
-        encoded_file = tree["response"]["result"]
-        decoded_file = base64.b64decode(encoded_file)
-        return decoded_file
 
-    def get_packet_status(self, packet_id):
-        data = """
-        <packetStatus>
-            <apiPassword>{api_password}</apiPassword>
-            <packetId>{packet_id}</packetId>
-        </packetStatus>
-        """.format(
-            api_password=self.api_password, packet_id=packet_id
-        )
-        response = requests.post(
-            self.base_url,
-            headers={"Content-Type": "application/xml"},
-            data=data,
-        )
-        if response.status_code == 200:
-            tree = xmltodict.parse(response.text)
-            if tree.get("response").get("status") == "ok":
-                status_code = int(
-                    tree.get("response").get("result").get("statusCode")
-                )
-                status_name = (
-                    tree.get("response").get("result").get("codeText")
-                )
-                status_display_name = (
-                    tree.get("response").get("result").get("statusText")
-                )
+        packets, failed = {}, []
+        for order, response in responses.items():
+            if isinstance(response, Exception):
+                logger.warning(f"Unable to create a Packet of order {order}: {response}")
+                failed.append(order)
+                continue
+            packets[order] = models.Packet(
+                packet_id=response["result"]["id"],
+                barcode=response["result"]["barcode"],
+                barcode_text=response["result"]["barcodeText"],
+            )
+
+        now = timezone.now()
+        with transaction.atomic():
+            models.Packet.objects.bulk_create(packets.values())
+            for order, packet in packets.items():
+                order.packet = packet
+                order.updated_at = now
+            models.Order.objects.bulk_update(packets, ["packet", "updated_at"])
+
+        return list(packets), failed
 
-                return status_code, status_name, status_display_name
+    def write_packet_labels_pdf(self, packet_ids, output):
+        """Downloads the labels PDF of the packets into output, decoding it while it's being read."""
+        self.transport.post(self._generate_packet_labels_xml(packet_ids), output=output)
 
-        return None, None, None
+    def get_packet_labels_pdf(self, packet_ids):
+        pdf = io.BytesIO()
+        self.write_packet_labels_pdf(packet_ids, pdf)
+        return pdf.getvalue()
+
+    def get_packet_status(self, packet_id):
+        try:
+            response = self.transport.post(
+                render(
+                    PACKET_STATUS_TEMPLATE,
+                    api_password=self.api_password,
+                    packet_id=packet_id,
+                )
+            )
+        except PacketaError:
+            logger.info(f"Unable to get status of Packet {packet_id}.", exc_info=True)
+            return None, None, None
+
+        return (
+            int(response["result"]["statusCode"]),
+            response["result"]["codeText"],
+            response["result"]["statusText"],
+        )
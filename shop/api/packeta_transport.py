@@ -0,0 +1,231 @@
+"""
+HTTP transport and XML codec for the Packeta REST/XML API.
+
+All requests of the process share keep-alive sessions with connect/read timeouts
+and a retry policy. Request bodies are rendered from precompiled templates with
+escaped values and responses are parsed incrementally with iterparse while they
+are read from the connection.
+"""
+import base64
+import logging
+import threading
+from xml.etree.ElementTree import iterparse
+from xml.parsers.expat import ExpatError, ParserCreate
+from xml.sax.saxutils import escape
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("django")
+
+CHUNK_SIZE = 64 * 1024
+
+CREATE_PACKET_TEMPLATE = (
+    "<createPacket>"
+    "<apiPassword>{api_password}</apiPassword>"
+    "<packetAttributes>"
+    "<number>{order_number}</number>"
+    "<name>{first_name}</name>"
+    "<surname>{last_name}</surname>"
+    "<email>{email}</email>"
+    "<addressId>{packeta_point_id}</addressId>"
+    "<cod>{cod_amount}</cod>"
+    "<value>{price}</value>"
+    "<currency>{currency}</currency>"
+    "<weight>{weight_kg}</weight>"
+    "<eshop>{sender_id}</eshop>"
+    "</packetAttributes>"
+    "</createPacket>"
+)
+
+PACKET_STATUS_TEMPLATE = (
+    "<packetStatus>"
+    "<apiPassword>{api_password}</apiPassword>"
+    "<packetId>{packet_id}</packetId>"
+    "</packetStatus>"
+)
+
+PACKETS_LABELS_PDF_TEMPLATE = (
+    "<packetsLabelsPdf>"
+    "<apiPassword>{api_password}</apiPassword>"
+    "<packetIds>{packet_ids}</packetIds>"
+    "<format>{label_format}</format>"
+    "<offset>{offset}</offset>"
+    "</packetsLabelsPdf>"
+)
+
+PACKET_ID_TEMPLATE = "<id>{}</id>"
+
+
+class PacketaError(Exception):
+    """Raised when Packeta can't be reached or responds with a fault."""
+
+
+def render(template: str, markup: dict = None, **values) -> bytes:
+    """
+    Renders a request template. All values are XML escaped,
+    except for already rendered XML fragments passed in markup.
+    """
+    return template.format(
+        **(markup or {}),
+        **{name: escape(str(value)) for name, value in values.items()},
+    ).encode("utf-8")
+
+
+def render_packet_ids(packet_ids) -> str:
+    """Renders <id> elements of packetIds, pass the result to render() in markup."""
+    return "".join(PACKET_ID_TEMPLATE.format(escape(str(pk))) for pk in packet_ids)
+
+
+def parse_response(source) -> dict:
+    """
+    Parses a Packeta response incrementally from a file-like object.
+
+    :return: Dict with "status", "fault", "string" (error message) and "result",
+        which is the text of <result> or a dict of its child elements' texts.
+    """
+    response = {"status": None, "fault": None, "string": None, "result": None}
+    path = []
+    result_fields = {}
+    for event, element in iterparse(source, events=("start", "end")):
+        if event == "start":
+            path.append(element.tag)
+            continue
+
+        path.pop()
+        if path == ["response"] and element.tag in ("status", "fault", "string"):
+            response[element.tag] = (element.text or "").strip()
+        elif path == ["response", "result"]:
+            result_fields[element.tag] = (element.text or "").strip()
+            element.clear()
+        elif path == ["response"] and element.tag == "result":
+            response["result"] = result_fields or (element.text or "").strip()
+            element.clear()
+
+    return response
+
+
+def decode_result(source, output) -> dict:
+    """
+    Parses a Packeta response whose <result> is base64 encoded data (e.g. a labels PDF)
+    from a file-like object, writing the decoded data to output while it's being read,
+    so the whole document is never held in memory.
+
+    :return: Dict like parse_response(), "result" is the number of bytes written.
+    """
+    response = {"status": None, "fault": None, "string": None, "result": 0}
+    path = []
+    texts = []
+    pending = bytearray()
+
+    def start_element(tag, attributes):
+        path.append(tag)
+        texts.clear()
+
+    def end_element(tag):
+        path.pop()
+        if path == ["response"] and tag in ("status", "fault", "string"):
+            response[tag] = "".join(texts).strip()
+        texts.clear()
+
+    def character_data(data):
+        if path != ["response", "result"]:
+            texts.append(data)
+            return
+
+        pending.extend(data.encode("ascii").translate(None, b" \t\r\n"))
+        complete = len(pending) - len(pending) % 4
+        if complete:
+            response["result"] += output.write(base64.b64decode(pending[:complete]))
+            del pending[:complete]
+
+    parser = ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    while chunk := source.read(CHUNK_SIZE):
+        parser.Parse(chunk, False)
+    parser.Parse(b"", True)
+
+    if pending:
+        raise ValueError("Incomplete base64 data in the Packeta response.")
+    return response
+
+
+def _session(retry: Retry) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=settings.PACKETA_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Content-Type"] = "application/xml"
+    return session
+
+
+class PacketaTransport:
+    """
+    Sends requests to the Packeta API, shared by the whole process, see get_transport().
+
+    Requests that don't change anything (statuses, labels) are retried on connection
+    errors, read errors and 502/503/504 responses. Requests that do (packet creation)
+    are retried only when the connection couldn't be established, so a packet is
+    never created twice.
+    """
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        backoff = {"backoff_factor": 0.5, "raise_on_status": False}
+        self.read_session = _session(
+            Retry(
+                total=3,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({"POST"}),
+                **backoff,
+            )
+        )
+        self.write_session = _session(Retry(total=3, connect=3, read=0, status=0, **backoff))
+
+    def post(self, body: bytes, idempotent: bool = True, output=None) -> dict:
+        """
+        Sends the request and parses the response while it's being downloaded.
+        With output, base64 encoded result is decoded into it, see decode_result().
+        """
+        session = self.read_session if idempotent else self.write_session
+        try:
+            with session.post(
+                self.base_url, data=body, timeout=self.timeout, stream=True
+            ) as response:
+                if response.status_code != 200:
+                    raise PacketaError(
+                        f"Packeta responded with {response.status_code}."
+                    )
+                response.raw.decode_content = True
+                if output is None:
+                    parsed = parse_response(response.raw)
+                else:
+                    parsed = decode_result(response.raw, output)
+        except (requests.RequestException, SyntaxError, ExpatError, ValueError) as e:
+            # ElementTree.ParseError is a SyntaxError, invalid base64 a ValueError
+            raise PacketaError(str(e)) from e
+
+        if parsed["status"] != "ok":
+            raise PacketaError(f"{parsed['fault']}: {parsed['string']}")
+        return parsed
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> PacketaTransport:
+    """Returns the process-wide PacketaTransport configured from settings."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = PacketaTransport(
+                settings.PACKETA_BASE_URL,
+                timeout=(settings.PACKETA_CONNECT_TIMEOUT, settings.PACKETA_READ_TIMEOUT),
+            )
+        return _transport
@@ -6,7 +6,5 @@ class ShopConfig(AppConfig):
     name = "shop"
     verbose_name = _("Shop")
 
-
-#    def ready(self):
-#        from shop import order_status_updater
-#        order_status_updater.start()
+    def ready(self):
+        import shop.tasks  # Register outbox tasks
@@ -0,0 +1,398 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Prefetch, Exists, OuterRef
+from django.utils.module_loading import import_string
+from djmoney.money import Money
+
+from shop.inventory import release_stock, reserve_stock, with_available_pieces
+from shop.models import Cart, Product, ProductVariant
+from shop.models.models import ProductImage
+
+SESSION_HOLDER_KEY = "stock_holder"
+SESSION_CART_CACHE_KEY = "session-cart:{}"
+
+
+def prefetch_product_images(lookup="images"):
+    """Prefetch of product images stored in `prefetched_images`, see CartSummary."""
+    return Prefetch(
+        lookup,
+        queryset=ProductImage.objects.select_related("image"),
+        to_attr="prefetched_images",
+    )
+
+
+def prefetch_available_variants(lookup="variants", holder=None):
+    """
+    Prefetch of product variants annotated with `available_pcs` for the holder,
+    ProductVariant.available() and Product.available() then don't hit the database.
+    """
+    return Prefetch(
+        lookup,
+        queryset=with_available_pieces(ProductVariant.objects.all(), holder),
+    )
+
+
+class CartSummary:
+    """
+    Everything the cart templates need, computed from already loaded cart lines.
+
+    Lines are expected to have `product` and `product_variant` loaded and product images
+    prefetched with prefetch_product_images(), so reading the summary never hits the database.
+    Pieces still available for every line (`item.can_increment`) are loaded in one query.
+    """
+
+    def __init__(self, items, holder=None):
+        self.items = list(items)
+        for item in self.items:
+            images = getattr(item.product, "prefetched_images", None) or [None]
+            item.image = images[0].image if images[0] else None
+
+        available_pieces = self._available_pieces(holder)
+        for item in self.items:
+            item.can_increment = bool(item.product_variant) and (
+                available_pieces.get(item.product_variant.pk) or 0
+            ) > item.amount
+
+    def _available_pieces(self, holder):
+        """Returns {variant pk: pieces not held by other carts} of tracked variants."""
+        variant_pks = {
+            item.product_variant.pk
+            for item in self.items
+            if item.product_variant and item.product_variant.pcs_in_stock is not None
+        }
+        if not variant_pks:
+            return {}
+
+        return dict(
+            with_available_pieces(
+                ProductVariant.objects.filter(pk__in=variant_pks), holder
+            ).values_list("pk", "available_pcs")
+        )
+
+    @property
+    def item_count(self):
+        return len(self.items)
+
+    @property
+    def total_price(self):
+        if self.items:
+            return Money(
+                sum([item.price.amount for item in self.items]),
+                currency=self.items[0].price.currency,
+            )
+
+        return Money(0, currency=settings.CURRENCIES[0])
+
+    @property
+    def must_be_paid_online(self):
+        return any(item.product.must_be_paid_online for item in self.items)
+
+    @property
+    def is_digital(self):
+        return any(item.product.is_digital for item in self.items)
+
+    @property
+    def needs_shipping(self):
+        return any(not item.product.is_digital for item in self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+class SessionCartItem:
+    """Single cart line living in the session. Mirrors the fields of CartItem used by templates."""
+
+    def __init__(self, product, product_variant, amount):
+        self.product = product
+        self.product_variant = product_variant
+        self.amount = amount
+
+    @property
+    def price(self):
+        return Money(
+            self.product.price.amount * self.amount,
+            self.product.price.currency,
+        )
+
+    def __str__(self):
+        return f"{self.amount}x {self.product.name}"
+
+
+class SessionCartItems:
+    """Minimal stand-in for the related manager returned by Cart.items."""
+
+    def __init__(self, items):
+        self._items = items
+
+    def all(self):
+        return self._items
+
+    def count(self):
+        return len(self._items)
+
+    def exists(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SessionCart:
+    """
+    Cart for anonymous visitors that is stored in the cache instead of the database.
+
+    Only primary keys and amounts are kept, in the "shared" cache under the random
+    token that also identifies the cart's stock reservations. The session only stores
+    the token, so it is written once per cart, not on every change. The cart gets
+    written to the database when the visitor logs in (see users.views.set_session_cart)
+    or checks out.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.lines = (
+            caches["shared"].get(self._cache_key, {})
+            if SESSION_HOLDER_KEY in session
+            else {}
+        )
+        self._items = None
+        self._summary = None
+
+    @classmethod
+    def from_request(cls, request, create=False):
+        return cls(request.session)
+
+    @staticmethod
+    def _line_key(product_pk, variant_pk):
+        return f"{product_pk}:{variant_pk or 0}"
+
+    @property
+    def reservation_holder(self):
+        """Identifies the cart's stock reservations, see shop.inventory."""
+        if SESSION_HOLDER_KEY not in self.session:
+            self.session[SESSION_HOLDER_KEY] = uuid4().hex
+        return f"session:{self.session[SESSION_HOLDER_KEY]}"
+
+    @property
+    def _cache_key(self):
+        # Accessing reservation_holder creates the token if needed
+        return SESSION_CART_CACHE_KEY.format(self.reservation_holder)
+
+    def hold_stock(self):
+        """Sets stock reservations of the cart to the amounts of its lines."""
+        reserve_stock(
+            self.reservation_holder,
+            {
+                item.product_variant.pk: item.amount
+                for item in self.items
+                if item.product_variant and item.product_variant.pcs_in_stock is not None
+            },
+        )
+
+    def add(self, item, variant, amount=1) -> bool:
+        """Adds amount pieces if the line's new amount is available."""
+        if amount > 0 and variant:
+            line_amount = self.lines.get(self._line_key(item.pk, variant.pk), 0)
+            if not variant.available(
+                holder=self.reservation_holder, pieces=line_amount + amount
+            ):
+                return False
+        elif not variant and item.variants.exists():
+            return False
+
+        self.add_many([(item, variant, amount)])
+        return True
+
+    def add_many(self, lines):
+        """
+        Applies (Product, ProductVariant, amount) lines and saves the session once.
+        Stock reservations of the changed variants follow the new amounts.
+        """
+        holds = {}
+        for product, variant, amount in lines:
+            key = self._line_key(product.pk, variant.pk if variant else None)
+            new_amount = self.lines.get(key, 0) + amount
+            if new_amount <= 0:
+                self.lines.pop(key, None)
+            else:
+                self.lines[key] = new_amount
+            if variant and variant.pcs_in_stock is not None:
+                holds[variant.pk] = max(new_amount, 0)
+
+        self._save()
+        reserve_stock(self.reservation_holder, holds)
+
+    def clear(self):
+        if SESSION_HOLDER_KEY in self.session:
+            release_stock(self.reservation_holder)
+            caches["shared"].delete(self._cache_key)
+        self.lines = {}
+        self._items = None
+        self._summary = None
+
+    def line_amounts(self):
+        """Returns the session lines as {(product pk, variant pk): amount}."""
+        amounts = {}
+        for key, amount in self.lines.items():
+            product_pk, variant_pk = (int(pk) for pk in key.split(":"))
+            amounts[(product_pk, variant_pk or None)] = amount
+        return amounts
+
+    def _save(self):
+        caches["shared"].set(self._cache_key, self.lines, settings.SESSION_COOKIE_AGE)
+        self._items = None
+        self._summary = None
+
+    def _load_items(self):
+        keys = [
+            tuple(int(pk) for pk in key.split(":")) for key in self.lines
+        ]
+        products = Product.objects.prefetch_related(
+            prefetch_product_images()
+        ).in_bulk({product_pk for product_pk, _variant_pk in keys})
+        variants = ProductVariant.objects.in_bulk(
+            {variant_pk for _product_pk, variant_pk in keys if variant_pk}
+        )
+
+        items = []
+        for (product_pk, variant_pk), amount in zip(keys, self.lines.values()):
+            product = products.get(product_pk)
+            if not product:  # Product was deleted since it was added
+                continue
+            items.append(
+                SessionCartItem(product, variants.get(variant_pk), amount)
+            )
+
+        return items
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = SessionCartItems(self._load_items())
+        return self._items
+
+    def summary(self):
+        """CartSummary of the cart, computed once until the cart changes."""
+        if self._summary is None:
+            self._summary = CartSummary(self.items, holder=self.reservation_holder)
+        return self._summary
+
+    @property
+    def total_price(self):
+        return self.summary().total_price
+
+    @property
+    def must_be_paid_online(self):
+        return self.summary().must_be_paid_online
+
+    @property
+    def is_digital(self):
+        return self.summary().is_digital
+
+    @property
+    def needs_shipping(self):
+        return self.summary().needs_shipping
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def __str__(self):
+        return f"Session cart ({len(self.lines)} lines)"
+
+
+def load_cart_lines(operations, holder=None, line_amounts=None):
+    """
+    Turns raw cart operations into (Product, ProductVariant, amount) lines,
+    loading all products and variants in two queries.
+
+    Additions are checked in order against the pieces available, counting the cart's
+    current amount of the variant and all accepted operations before them.
+    Additions of more pieces than are available and of products that require
+    a variant are dropped, removals are always allowed.
+
+    :param operations: Iterable of dicts with "item", "variant" and "amount" keys.
+    :param holder: Reservation holder of the cart, its own holds don't count.
+    :param line_amounts: Current {(product pk, variant pk): amount} of the cart.
+    :return: Tuple of valid lines and the number of rejected operations.
+    """
+    operations = [
+        (
+            int(operation["item"]),
+            int(operation.get("variant") or 0) or None,
+            int(operation.get("amount", 1)),
+        )
+        for operation in operations
+    ]
+    products = Product.objects.annotate(
+        has_variants=Exists(
+            ProductVariant.objects.filter(product=OuterRef("pk"))
+        )
+    ).in_bulk({product_pk for product_pk, _variant_pk, _amount in operations})
+    variants = with_available_pieces(ProductVariant.objects.all(), holder).in_bulk(
+        {variant_pk for _product_pk, variant_pk, _amount in operations if variant_pk}
+    )
+    # Amounts of the lines after the operations accepted so far
+    amounts = dict(line_amounts or {})
+
+    lines = []
+    for product_pk, variant_pk, amount in operations:
+        product = products.get(product_pk)
+        variant = variants.get(variant_pk)
+        if not product or (variant and variant.product_id != product.pk):
+            continue
+        key = (product.pk, variant.pk if variant else None)
+        new_amount = max(amounts.get(key, 0) + amount, 0)
+        if amount > 0 and (
+            (variant and new_amount > (variant.available_pcs or 0))
+            or (not variant and product.has_variants)
+        ):
+            continue
+        amounts[key] = new_amount
+        lines.append((product, variant, amount))
+
+    return lines, len(operations) - len(lines)
+
+
+def get_cart(request, create=False):
+    """
+    Returns the cart of the current visitor.
+
+    Logged-in users always get their database Cart, anonymous visitors get the storage
+    configured in settings.ANONYMOUS_CART_STORAGE.
+
+    :param request: Current request with session and user.
+    :param create: Create a new cart if there is none yet.
+    :return: Cart-like object or None.
+    """
+    if request.user.is_authenticated:
+        cart_class = Cart
+    else:
+        cart_class = import_string(settings.ANONYMOUS_CART_STORAGE)
+
+    return cart_class.from_request(request, create=create)
+
+
+def get_reservation_holder(request):
+    """Returns the reservation holder of the current visitor's cart, memoized on the request."""
+    if not hasattr(request, "_reservation_holder"):
+        cart = get_cart(request)
+        request._reservation_holder = cart.reservation_holder if cart else None
+
+    return request._reservation_holder
+
+
+def get_cart_summary(request):
+    """
+    Returns CartSummary of the current visitor's cart, memoized on the request
+    so every cart fragment rendered in one response shares the same queries.
+    """
+    if not hasattr(request, "_cart_summary"):
+        cart = get_cart(request)
+        request._cart_summary = cart.summary() if cart else CartSummary([])
+
+    return request._cart_summary
@@ -0,0 +1,135 @@
+import logging
+from collections import defaultdict
+from itertools import chain
+
+from django.db import connection, transaction
+
+from core import outbox
+from shop.inventory import CURRENT_STOCK_SQL, release_stock
+from shop.models import InventoryMovement, Order, OrderItem
+from shop.signals import send_after_commit
+from shop.utils import generate_order_number
+
+logger = logging.getLogger("django")
+
+# Serialises checkouts of the same variants, locks are taken in pk order to avoid deadlocks
+LOCK_VARIANTS_SQL = """
+    SELECT id FROM shop_productvariant
+    WHERE id = ANY(%s)
+    ORDER BY id
+    FOR UPDATE
+"""
+
+# Takes all ordered pieces off the stock at once by inserting ORDER movements to the
+# inventory ledger. Only variants with enough pieces not held by other carts get one,
+# so the number of inserted rows tells whether the whole order fits.
+# Run with the variants locked by LOCK_VARIANTS_SQL, the statement then sees
+# movements of all checkouts that held the locks before.
+ORDER_MOVEMENTS_SQL = """
+    INSERT INTO shop_inventorymovement (
+        variant_id, quantity, reason, order_id, note, compacted, created_at
+    )
+    SELECT ordered.variant_id, -ordered.quantity, %s, %s, '', FALSE, NOW()
+    FROM (VALUES {values}) AS ordered (variant_id, quantity)
+    WHERE {current_stock} - ordered.quantity >= (
+        SELECT COALESCE(SUM(reservation.quantity), 0)
+        FROM shop_stockreservation reservation
+        WHERE reservation.variant_id = ordered.variant_id
+            AND reservation.expires_at > NOW()
+            AND reservation.holder IS DISTINCT FROM %s::varchar
+    )
+"""
+
+
+class OutOfStockError(Exception):
+    """Raised when some of the ordered variants don't have enough pieces in stock."""
+
+
+def decrement_stock(order, quantities: dict, holder: str = None):
+    """
+    Records the ordered {variant pk: quantity} to the inventory ledger in a single INSERT.
+    Must run in a transaction, the variant rows stay locked until it ends, so concurrent
+    checkouts of the same variants can't both pass the stock check.
+
+    :param holder: Reservation holder of the ordering cart, its own holds don't count.
+    :raises OutOfStockError: If any of the variants doesn't have enough pieces.
+    """
+    if not quantities:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(LOCK_VARIANTS_SQL, [list(quantities)])
+        cursor.execute(
+            ORDER_MOVEMENTS_SQL.format(
+                values=", ".join(["(%s::integer, %s::integer)"] * len(quantities)),
+                current_stock=CURRENT_STOCK_SQL.format(variant="ordered.variant_id"),
+            ),
+            [
+                InventoryMovement.Reasons.ORDER,
+                order.pk,
+                *chain.from_iterable(quantities.items()),
+                holder,
+            ],
+        )
+        if cursor.rowcount != len(quantities):
+            raise OutOfStockError
+
+
+def place_order(summary, holder: str = None, **order_data) -> Order:
+    """
+    Creates an Order with all its items from a cart summary in a single transaction.
+
+    Order items are created with one bulk insert, stock of all ordered variants is
+    taken off with one conditional ledger INSERT and the order aggregates (total
+    price, weight, item count) are computed once.
+    The checkout_completed signal and the Packeta packet creation are enqueued
+    to the outbox within the same transaction.
+
+    :param summary: CartSummary of the cart being checked out.
+    :param holder: Reservation holder of the cart, its holds are released with the order.
+    :param order_data: Order fields, e.g. billing_address or billing_type.
+    :raises OutOfStockError: If the stock doesn't cover the order, nothing is created then.
+    :return: The new Order.
+    """
+    stock_quantities = defaultdict(int)
+    for item in summary.items:
+        # Variants without pcs_in_stock set are not tracked
+        if item.product_variant and item.product_variant.pcs_in_stock is not None:
+            stock_quantities[item.product_variant.pk] += item.amount
+
+    # Allocated in its own statement, so the counter row isn't locked for the whole checkout
+    order_number = generate_order_number()
+
+    with transaction.atomic():
+        order = Order.objects.create(
+            order_number=order_number,
+            total_price=summary.total_price,
+            total_weight_kg=sum(
+                item.product.weight_kg * item.amount for item in summary.items
+            ),
+            item_count=sum(item.amount for item in summary.items),
+            **order_data,
+        )
+        # bulk_create skips OrderItem.save(), stock and aggregates are handled here instead
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    quantity=item.amount,
+                    product=item.product,
+                    product_variant=item.product_variant,
+                    total_price=item.price,
+                )
+                for item in summary.items
+            ]
+        )
+        decrement_stock(order, stock_quantities, holder)
+        if holder:
+            release_stock(holder)
+
+        send_after_commit("checkout_completed", order.pk)
+        if order.packeta_point_id:
+            outbox.enqueue("shop.create_packet", order_id=order.pk)
+
+    logger.info(f"Order {order} placed with {len(summary.items)} items.")
+    return order
@@ -1,8 +1,10 @@
 from betterforms.multiform import MultiModelForm
 from django import forms
+from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.formfields import PhoneNumberField
 from phonenumber_field.widgets import PhoneNumberPrefixWidget
+from wagtail.admin.forms import WagtailAdminModelForm
 
 from shop.models import BillingAddress, Order, ShippingAddress
 
@@ -111,3 +113,27 @@ class AddressMultiForm(MultiModelForm):
         "billing_address": BillingAddressForm,
         "shipping_address": ShippingAddressForm,
     }
+
+
+class AddressAdminFormMixin:
+    """
+    Rejects an address that already exists with a form error,
+    saving it would violate the unique fingerprint.
+    """
+
+    def clean(self):
+        cleaned_data = super().clean()
+        address = self._meta.model(pk=self.instance.pk)
+        for field in address.FINGERPRINT_FIELDS:
+            setattr(address, field, cleaned_data.get(field, getattr(self.instance, field)))
+        if address.find_duplicate():
+            raise ValidationError(_("The same address already exists."))
+        return cleaned_data
+
+
+class AddressAdminForm(AddressAdminFormMixin, forms.ModelForm):
+    pass
+
+
+class AddressWagtailAdminForm(AddressAdminFormMixin, WagtailAdminModelForm):
+    pass
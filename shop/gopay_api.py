@@ -1,14 +1,21 @@
 import json
 import logging
+import threading
+import time
 from datetime import timedelta
 from decimal import Decimal
 from typing import Union
+from urllib.parse import urlsplit
 
-import gopay
+import requests
 from django.conf import settings
+from django.db import transaction
 from django.urls import reverse_lazy
 from django.utils import timezone
-from gopay import Language, Payments
+from gopay import Language
+from requests.adapters import HTTPAdapter
+
+from shop.utils import backoff_delay, fetch_concurrently
 
 logger = logging.getLogger("django")
 
@@ -19,21 +26,135 @@ class JSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def authenticate_api() -> Payments:
+class GopayError(Exception):
+    """Raised when GoPay API responds with an error."""
+
+
+class GopayClient:
     """
-    Creates GoPay Payment instance with credentials from settings.
+    GoPay REST API client meant to be shared by the whole process, see get_gopay_client().
 
-    :return: Payments instance that is capable of communicating with the GoPay API.
+    Keeps the HTTP connections alive in a pooled session and reuses the OAuth access token
+    until shortly before it expires, so a payment call is a single request.
+    Safe to use from multiple threads.
     """
-    return gopay.payments(
-        {
-            "goid": settings.GOPAY_GOID,
-            "clientId": settings.GOPAY_CLIENT_ID,
-            "clientSecret": settings.GOPAY_CLIENT_SECRET,
-            "gatewayUrl": settings.GOPAY_URL,
-            "isProductionMode": settings.GOPAY_IS_PRODUCTION,
-        }
-    )
+
+    # Token is refreshed this many seconds before it expires
+    TOKEN_EXPIRY_MARGIN = 60
+
+    def __init__(self, gateway_url, goid, client_id, client_secret, timeout, pool_size=10):
+        # The gateway URL might be configured with or without the /api path
+        gateway_url = urlsplit(gateway_url)
+        self.api_url = f"{gateway_url.scheme}://{gateway_url.netloc}/api"
+        self.goid = goid
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+        self.session.headers["Accept"] = "application/json"
+
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+    def _get_token(self) -> str:
+        with self._token_lock:
+            if self._token and time.monotonic() < self._token_expires_at:
+                return self._token
+
+            response = self.session.post(
+                f"{self.api_url}/oauth2/token",
+                auth=(self.client_id, self.client_secret),
+                data={"grant_type": "client_credentials", "scope": "payment-all"},
+                timeout=self.timeout,
+            )
+            if not response.ok:
+                raise GopayError(f"Authentication failed: {response.text}")
+
+            token = response.json()
+            self._token = token["access_token"]
+            self._token_expires_at = (
+                time.monotonic() + token["expires_in"] - self.TOKEN_EXPIRY_MARGIN
+            )
+            return self._token
+
+    def _send(self, method, path, **kwargs) -> requests.Response:
+        for _attempt in range(2):
+            token = self._get_token()
+            response = self.session.request(
+                method,
+                f"{self.api_url}/{path}",
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=self.timeout,
+                **kwargs,
+            )
+            if response.status_code != 401:
+                break
+            # Token was revoked before its expiration, requesting a new one
+            with self._token_lock:
+                if self._token == token:
+                    self._token = None
+
+        if not response.ok:
+            raise GopayError(f"{method} {path} failed: {response.text}")
+        return response
+
+    def _request(self, method, path, **kwargs) -> dict:
+        return self._send(method, path, **kwargs).json()
+
+    def create_payment(self, payment_data: dict) -> dict:
+        return self._request(
+            "POST",
+            "payments/payment",
+            json={"target": {"type": "ACCOUNT", "goid": self.goid}, **payment_data},
+        )
+
+    def get_status(self, payment_id) -> dict:
+        return self._request("GET", f"payments/payment/{payment_id}")
+
+    def get_account_statement(self, date_from, date_to, currency, statement_format="CSV_A"):
+        """
+        Downloads the account statement of the period in a single request.
+
+        :return: Iterator over lines of the statement, read from the connection as they are consumed.
+        """
+        response = self._send(
+            "POST",
+            "accounts/account-statement",
+            json={
+                "date_from": date_from.isoformat(),
+                "date_to": date_to.isoformat(),
+                "goid": self.goid,
+                "currency": currency,
+                "format": statement_format,
+            },
+            stream=True,
+        )
+        response.encoding = response.encoding or "utf-8"
+        return response.iter_lines(decode_unicode=True)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gopay_client() -> GopayClient:
+    """Returns the process-wide GopayClient configured from settings."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GopayClient(
+                settings.GOPAY_URL,
+                settings.GOPAY_GOID,
+                settings.GOPAY_CLIENT_ID,
+                settings.GOPAY_CLIENT_SECRET,
+                timeout=settings.GOPAY_TIMEOUT,
+                pool_size=settings.GOPAY_POLL_CONCURRENCY,
+            )
+        return _client
 
 
 def create_gopay_order(order=None) -> str:
@@ -43,8 +164,6 @@ def create_gopay_order(order=None) -> str:
     :param order: Order instance containing all essential data.
     :return: On success: GoPay gateway URL | on failure: Internal error page URL.
     """
-    api = authenticate_api()
-
     payment_data = {
             "payer": {
                 "contact": {
@@ -72,7 +191,7 @@ def create_gopay_order(order=None) -> str:
                         round(item.total_price.amount * 100), cls=JSONEncoder
                     ),
                 }
-                for item in order.items.all()
+                for item in order.items.select_related("product")
             ],
             "additional_params": [
                 {"name": "invoicenumber", "value": order.order_number}
@@ -84,17 +203,30 @@ def create_gopay_order(order=None) -> str:
             "lang": Language.CZECH,  # if lang is not specified, then default lang is used
         }
 
-    response = api.create_payment(payment_data)
-    if response.has_succeed():
-        return response.json["gw_url"]
+    try:
+        payment = get_gopay_client().create_payment(payment_data)
+    except (GopayError, requests.RequestException) as e:
+        logger.info(f"Failed to create GoPay Payment.\nData sent: {json.dumps(payment_data)}\nResponse: {e}")
+        return reverse_lazy("shop:error")
 
-    logger.info(f"Failed to create GoPay Payment.\nData sent: {json.dumps(payment_data)}\nResponse: {json.dumps(response.json)}")
-    return reverse_lazy("shop:error")
+    from shop.models import GopayPayment, Order
+
+    # Stored right away, so the payment gets polled even if the customer never comes back
+    gopay_payment, _created = GopayPayment.objects.update_or_create(
+        payment_id=payment["id"],
+        defaults={
+            "payment_status": payment["state"],
+            "payment_data": payment,
+            "next_check_at": timezone.now()
+            + timedelta(seconds=settings.GOPAY_POLL_BACKOFF),
+        },
+    )
+    Order.objects.filter(pk=order.pk).update(gopay_payment=gopay_payment)
+    return payment["gw_url"]
 
 
 def get_gopay_payment_details(payment_number) -> dict:
-    api = authenticate_api()
-    return api.get_status(payment_number).json
+    return get_gopay_client().get_status(payment_number)
 
 
 def get_gopay_payment_status(payment_number) -> Union[str, None]:
@@ -105,13 +237,89 @@ def is_gopay_payment_paid(payment_number) -> bool:
     return get_gopay_payment_status(payment_number) == "PAID"
 
 
-def update_gopay_orders():
-    from shop.models import Order
-    two_days_ago = timezone.now() - timedelta(days=2)
-    filters = {
-        "billing_type__name": "card-online",
-        "paid": False,
-        "created_at__gt": two_days_ago,
+def next_check_delay(attempts: int) -> timedelta:
+    """Exponential backoff, doubles the delay with every check without a change."""
+    return backoff_delay(
+        attempts, settings.GOPAY_POLL_BACKOFF, settings.GOPAY_POLL_MAX_BACKOFF
+    )
+
+
+def poll_gopay_payments(fetch=None, max_workers=None) -> dict:
+    """
+    Checks states of unfinished GoPay payments from the last 2 days that are due.
+
+    Statuses are fetched concurrently, at most max_workers at a time. Payments without
+    a change are checked again later with an exponential backoff, saved with one bulk
+    update. Changed states are applied only if the payment still has the state it had
+    when it was loaded, so newer states applied by notifications are never overwritten.
+
+    :param fetch: Function returning payment details for a payment ID,
+        defaults to get_gopay_payment_details.
+    :param max_workers: Concurrent requests limit, defaults to settings.GOPAY_POLL_CONCURRENCY.
+    :return: Dict with numbers of checked, changed and failed payments and the duration in seconds.
+    """
+    from shop.models import GopayPayment
+
+    started_at = time.monotonic()
+    now = timezone.now()
+    payments = list(
+        GopayPayment.objects.filter(
+            created_at__gt=now - timedelta(days=2),
+            is_paid=False,
+        )
+        .exclude(payment_status__in=GopayPayment.FINAL_STATES)
+        .exclude(next_check_at__gt=now)
+    )
+    details = fetch_concurrently(
+        fetch or get_gopay_payment_details,
+        [payment.payment_id for payment in payments],
+        max_workers or settings.GOPAY_POLL_CONCURRENCY,
+    )
+
+    changed, failed = [], 0
+    for payment in payments:
+        payment_details = details[payment.payment_id]
+        if isinstance(payment_details, Exception) or "state" not in payment_details:
+            logger.warning(
+                f"GoPay payment {payment.payment_id} check failed: {payment_details}"
+            )
+            failed += 1
+        elif payment_details["state"] != payment.payment_status:
+            changed.append((payment, payment.payment_status, payment_details))
+            payment.check_attempts = 0
+
+        payment.next_check_at = now + next_check_delay(payment.check_attempts)
+        payment.check_attempts += 1
+        payment.updated_at = now
+
+    # Only the backoff is bulk updated, states are applied one by one below
+    GopayPayment.objects.bulk_update(
+        payments, ["check_attempts", "next_check_at", "updated_at"], batch_size=500
+    )
+
+    applied = 0
+    for payment, previous_status, payment_details in changed:
+        with transaction.atomic():
+            # Compare-and-set, a notification might have applied a newer state meanwhile
+            if not GopayPayment.objects.filter(
+                pk=payment.pk, payment_status=previous_status
+            ).update(
+                payment_status=payment_details["state"],
+                payment_data=payment_details,
+                is_paid=payment_details["state"] == "PAID",
+            ):
+                continue
+            payment.payment_status = payment_details["state"]
+            payment.payment_data = payment_details
+            payment.is_paid = payment.payment_status == "PAID"
+            payment.update_orders()
+            applied += 1
+
+    stats = {
+        "checked": len(payments),
+        "changed": applied,
+        "failed": failed,
+        "duration": round(time.monotonic() - started_at, 3),
     }
-    for order in Order.objects.filter(**filters):
-        order.update_payment_status()
+    logger.info(f"GoPay payments polled: {stats}")
+    return stats
@@ -0,0 +1,159 @@
+"""
+Bulk reconciliation of GoPay payments from the account statement.
+
+The statement of a period is downloaded in a single request, parsed line by line
+while it is being read and matched against payments and orders with set-based
+UPDATEs, instead of asking GoPay about every pending payment. Statements saved
+to files can be replayed with `manage.py reconcile_gopay_statement --file`.
+"""
+import csv
+import logging
+import time
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from shop.gopay_api import get_gopay_client
+from shop.signals import send_after_commit
+
+logger = logging.getLogger("django")
+
+STATEMENT_BATCH_SIZE = 1000
+
+# Marks payments of the statement rows paid, then their orders, matched by
+# the payment or by the order number. Only rows paying at least the order's total
+# in its currency count. Returns orders that became paid.
+RECONCILE_STATEMENT_SQL = """
+    WITH statement (payment_id, order_number, amount, currency) AS (
+        VALUES {values}
+    ),
+    paid_payments AS (
+        UPDATE shop_gopaypayment payment
+        SET is_paid = TRUE, payment_status = 'PAID', updated_at = NOW()
+        FROM statement, shop_order
+        WHERE payment.payment_id = statement.payment_id AND NOT payment.is_paid
+            AND shop_order.gopay_payment_id = payment.id
+            AND shop_order.total_price_currency = statement.currency
+            AND shop_order.total_price <= statement.amount
+    )
+    UPDATE shop_order
+    SET is_paid = TRUE, updated_at = NOW()
+    FROM statement
+    LEFT JOIN shop_gopaypayment payment ON payment.payment_id = statement.payment_id
+    WHERE NOT shop_order.is_paid
+        AND (
+            shop_order.order_number = statement.order_number
+            OR shop_order.gopay_payment_id = payment.id
+        )
+        AND shop_order.total_price_currency = statement.currency
+        AND shop_order.total_price <= statement.amount
+    RETURNING shop_order.id
+"""
+
+
+def parse_statement(lines, currency=None):
+    """
+    Reads the statement CSV and yields (payment ID, order number, amount, currency)
+    of incoming payments. Rows without a payment ID (summaries, fees), outgoing ones
+    (refunds) and ones without a valid amount are skipped.
+
+    :param lines: Iterable of the statement's text lines, read lazily.
+    :param currency: Currency of rows without a currency column, e.g. of a statement
+        downloaded for one currency.
+    """
+    columns = settings.GOPAY_STATEMENT_COLUMNS
+    lines = iter(lines)
+    first_line = next(lines, "").lstrip("\ufeff")
+    reader = csv.DictReader(
+        chain([first_line], lines), delimiter=settings.GOPAY_STATEMENT_DELIMITER
+    )
+    for row in reader:
+        payment_id = (row.get(columns["payment_id"]) or "").strip()
+        if not payment_id.isdigit():
+            continue
+
+        amount = (row.get(columns["amount"]) or "").strip().replace(" ", "")
+        try:
+            amount = Decimal(amount.replace(",", "."))
+        except InvalidOperation:
+            continue
+        if amount <= 0:
+            continue
+
+        yield (
+            payment_id,
+            (row.get(columns["order_number"]) or "").strip() or None,
+            amount,
+            (row.get(columns["currency"]) or "").strip().upper() or currency,
+        )
+
+
+def reconcile_statement(lines, currency=None) -> dict:
+    """
+    Marks payments and orders found in the statement paid, in batches of
+    STATEMENT_BATCH_SIZE rows, all in one transaction. order_paid is sent
+    for every order that became paid.
+
+    :param lines: Iterable of the statement's text lines.
+    :param currency: Currency of rows without a currency column.
+    :return: Dict with numbers of statement rows, paid orders and the duration in seconds.
+    """
+    started_at = time.monotonic()
+    rows = parse_statement(lines, currency)
+    stats = {"rows": 0, "orders": 0}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        while batch := list(islice(rows, STATEMENT_BATCH_SIZE)):
+            cursor.execute(
+                RECONCILE_STATEMENT_SQL.format(
+                    values=", ".join(
+                        ["(%s::varchar, %s::varchar, %s::numeric, %s::varchar)"]
+                        * len(batch)
+                    )
+                ),
+                list(chain.from_iterable(batch)),
+            )
+            order_ids = [row[0] for row in cursor.fetchall()]
+            for order_id in order_ids:
+                send_after_commit("order_paid", order_id)
+
+            stats["rows"] += len(batch)
+            stats["orders"] += len(order_ids)
+
+    stats["duration"] = round(time.monotonic() - started_at, 3)
+    logger.info(f"GoPay statement reconciled: {stats}")
+    return stats
+
+
+def reconcile_gopay_statement(date_from, date_to) -> dict:
+    """
+    Downloads statements of the period for all currencies and reconciles them.
+
+    :return: Dict with numbers of statement rows, paid orders and the duration in seconds.
+    """
+    client = get_gopay_client()
+    stats = {"rows": 0, "orders": 0, "duration": 0}
+    for currency in settings.CURRENCIES:
+        currency_stats = reconcile_statement(
+            client.get_account_statement(
+                date_from,
+                date_to,
+                currency,
+                statement_format=settings.GOPAY_STATEMENT_FORMAT,
+            ),
+            currency,
+        )
+        for key, value in currency_stats.items():
+            stats[key] += value
+
+    return stats
+
+
+def reconcile_recent_statement():
+    """Scheduler job reconciling the statement of yesterday and today."""
+    today = timezone.localdate()
+    return reconcile_gopay_statement(today - timedelta(days=1), today)
@@ -0,0 +1,261 @@
+"""
+Stock ledger and reservations.
+
+Every stock change is an InventoryMovement insert. Checkouts and stock adjustments lock
+the variant rows until they commit, so their stock checks see each other's movements
+(see shop.checkout). Current stock is the variant's InventorySnapshot plus
+the movements not compacted into it yet. compact_inventory() periodically
+folds recent movements into the snapshots and mirrors the result to
+ProductVariant.pcs_in_stock. That column is a cached value, read-only in the admin,
+and tells tracked variants (stock set) from untracked ones. Staff change stock by
+adding adjustment movements (see adjust_stock()).
+
+Adding a variant to a cart or entering the checkout holds the pieces for the cart
+for settings.STOCK_RESERVATION_MINUTES. Pieces held by other carts are not available,
+expired holds are ignored and deleted by release_expired_reservations().
+"""
+import logging
+import time
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from shop.models import InventoryMovement, ProductVariant, StockReservation
+
+logger = logging.getLogger("django")
+
+# Current stock of the variant referenced by {variant}, snapshot plus later movements
+CURRENT_STOCK_SQL = """
+    COALESCE((
+        SELECT snapshot.quantity FROM shop_inventorysnapshot snapshot
+        WHERE snapshot.variant_id = {variant}
+    ), 0) + COALESCE((
+        SELECT SUM(movement.quantity) FROM shop_inventorymovement movement
+        WHERE movement.variant_id = {variant} AND NOT movement.compacted
+    ), 0)
+"""
+
+# Folds movements into the snapshots and marks them compacted in one statement.
+# Rows of still running transactions aren't visible to the UPDATE, they stay
+# uncompacted until a later run, whatever their ID. A concurrent run waits for
+# the row locks and then skips the rows this one marked.
+COMPACT_INVENTORY_SQL = """
+    WITH compacted AS (
+        UPDATE shop_inventorymovement
+        SET compacted = TRUE
+        WHERE NOT compacted AND created_at < %s
+        RETURNING variant_id, quantity
+    )
+    INSERT INTO shop_inventorysnapshot (variant_id, quantity, updated_at)
+    SELECT variant_id, SUM(quantity), NOW()
+    FROM compacted
+    GROUP BY variant_id
+    ON CONFLICT (variant_id) DO UPDATE SET
+        quantity = shop_inventorysnapshot.quantity + EXCLUDED.quantity,
+        updated_at = EXCLUDED.updated_at
+    RETURNING variant_id
+"""
+
+# Refreshes the cached pcs_in_stock of tracked variants
+MIRROR_STOCK_SQL = """
+    UPDATE shop_productvariant variant
+    SET pcs_in_stock = GREATEST({current_stock}, 0)
+    WHERE variant.id = ANY(%s) AND variant.pcs_in_stock IS NOT NULL
+""".format(current_stock=CURRENT_STOCK_SQL.format(variant="variant.id"))
+
+RESERVATION_UPSERT_SQL = """
+    INSERT INTO shop_stockreservation (
+        holder, variant_id, quantity, expires_at, created_at, updated_at
+    )
+    SELECT %s, holds.variant_id, holds.quantity, %s, NOW(), NOW()
+    FROM (VALUES {values}) AS holds (variant_id, quantity)
+    ON CONFLICT (holder, variant_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        expires_at = EXCLUDED.expires_at,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def record_movement(
+    variant, quantity: int, reason: str, order_id: int = None, note: str = ""
+):
+    """Records a stock change of a single variant, see InventoryMovement.Reasons."""
+    return InventoryMovement.objects.create(
+        variant=variant, quantity=quantity, reason=reason, order_id=order_id, note=note
+    )
+
+
+def adjust_stock(variant, quantity: int, note: str = ""):
+    """
+    Records a manual adjustment of the variant's stock by quantity pieces and
+    refreshes its pcs_in_stock. Untracked variants become tracked.
+    The variant row is locked until the adjustment commits, like in checkouts.
+    """
+    with transaction.atomic():
+        # The UPDATE locks the variant row
+        ProductVariant.objects.filter(pk=variant.pk).update(
+            pcs_in_stock=Coalesce("pcs_in_stock", 0)
+        )
+        movement = record_movement(
+            variant, quantity, InventoryMovement.Reasons.ADJUSTMENT, note=note
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(MIRROR_STOCK_SQL, [[variant.pk]])
+    return movement
+
+
+def with_stock(variants):
+    """Annotates the variants queryset with `stock`, computed from the ledger."""
+    recent = (
+        InventoryMovement.objects.filter(variant=OuterRef("pk"), compacted=False)
+        .values("variant")
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    return variants.annotate(
+        stock=Coalesce(F("inventory_snapshot__quantity"), 0)
+        + Coalesce(Subquery(recent), 0)
+    )
+
+
+def stock_levels(variant_pks) -> dict:
+    """Returns {variant pk: pieces in stock} computed from the ledger in one query."""
+    return dict(
+        with_stock(ProductVariant.objects.filter(pk__in=variant_pks)).values_list(
+            "pk", "stock"
+        )
+    )
+
+
+def import_stock_levels(levels: dict, note: str = "") -> int:
+    """
+    Sets stock of {variant pk: pieces} by recording IMPORT movements for the differences.
+    Variants not tracked so far become tracked.
+
+    :return: Number of recorded movements.
+    """
+    current = stock_levels(levels.keys())
+    movements = [
+        InventoryMovement(
+            variant_id=pk,
+            quantity=pieces - current[pk],
+            reason=InventoryMovement.Reasons.IMPORT,
+            note=note,
+        )
+        for pk, pieces in levels.items()
+        if pk in current and pieces != current[pk]
+    ]
+
+    with transaction.atomic():
+        InventoryMovement.objects.bulk_create(movements)
+        variants = list(ProductVariant.objects.filter(pk__in=current))
+        for variant in variants:
+            variant.pcs_in_stock = levels[variant.pk]
+        # bulk_update skips ProductVariant.save(), which would record adjustments
+        ProductVariant.objects.bulk_update(variants, ["pcs_in_stock"])
+
+    return len(movements)
+
+
+def compact_inventory() -> dict:
+    """
+    Folds movements older than settings.INVENTORY_COMPACTION_DELAY seconds into
+    the snapshots and refreshes pcs_in_stock of the affected variants.
+
+    :return: Dict with the number of compacted variants and duration in seconds.
+    """
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(seconds=settings.INVENTORY_COMPACTION_DELAY)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(COMPACT_INVENTORY_SQL, [cutoff])
+        variant_pks = [row[0] for row in cursor.fetchall()]
+        if variant_pks:
+            cursor.execute(MIRROR_STOCK_SQL, [variant_pks])
+
+    stats = {
+        "variants": len(variant_pks),
+        "duration": round(time.monotonic() - started, 3),
+    }
+    logger.info(f"Inventory compacted: {stats}")
+    return stats
+
+
+def reserve_stock(holder: str, quantities: dict):
+    """
+    Sets holds of {variant pk: quantity} for the holder and extends their expiration.
+    Holds are capped at the pieces not held by others, so a cart can't block more
+    pieces than there are. Zero quantities release the hold.
+    """
+    holds = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if holds:
+        available = dict(
+            with_available_pieces(
+                ProductVariant.objects.filter(pk__in=holds), holder
+            ).values_list("pk", "available_pcs")
+        )
+        holds = {
+            pk: min(quantity, max(available.get(pk) or 0, 0))
+            for pk, quantity in holds.items()
+        }
+    released = [pk for pk, quantity in quantities.items() if holds.get(pk, 0) <= 0]
+    holds = {pk: quantity for pk, quantity in holds.items() if quantity > 0}
+    expires_at = timezone.now() + timedelta(
+        minutes=settings.STOCK_RESERVATION_MINUTES
+    )
+
+    with transaction.atomic():
+        if holds:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    RESERVATION_UPSERT_SQL.format(
+                        values=", ".join(["(%s::integer, %s::integer)"] * len(holds))
+                    ),
+                    [holder, expires_at, *chain.from_iterable(holds.items())],
+                )
+        if released:
+            StockReservation.objects.filter(
+                holder=holder, variant__in=released
+            ).delete()
+
+
+def release_stock(holder: str):
+    StockReservation.objects.filter(holder=holder).delete()
+
+
+def active_reservations(exclude_holder: str = None):
+    reservations = StockReservation.objects.filter(expires_at__gt=timezone.now())
+    if exclude_holder:
+        reservations = reservations.exclude(holder=exclude_holder)
+    return reservations
+
+
+def with_available_pieces(variants, exclude_holder: str = None):
+    """
+    Annotates the variants queryset with `available_pcs`, pieces in stock minus
+    pieces held by other holders. Uses the (variant, expires_at) index.
+    """
+    reserved = (
+        active_reservations(exclude_holder)
+        .filter(variant=OuterRef("pk"))
+        .values("variant")
+        .annotate(reserved=Sum("quantity"))
+        .values("reserved")
+    )
+    return with_stock(variants).annotate(
+        available_pcs=F("stock") - Coalesce(Subquery(reserved), 0)
+    )
+
+
+def release_expired_reservations() -> int:
+    """Deletes all expired holds at once, returns the number of deleted holds."""
+    deleted, _deleted_per_model = StockReservation.objects.filter(
+        expires_at__lte=timezone.now()
+    ).delete()
+    logger.info(f"Expired stock reservations released: {deleted}")
+    return deleted
@@ -0,0 +1,132 @@
+import base64
+import io
+import os
+import timeit
+from xml.dom.minidom import parseString
+
+import xmltodict
+from dicttoxml import dicttoxml
+from django.core.management.base import BaseCommand
+
+from shop.api.packeta_transport import (
+    CREATE_PACKET_TEMPLATE,
+    PACKETS_LABELS_PDF_TEMPLATE,
+    decode_result,
+    parse_response,
+    render,
+    render_packet_ids,
+)
+
+PACKET_ATTRIBUTES = {
+    "api_password": "password",
+    "order_number": "221000001",
+    "first_name": "Jan",
+    "last_name": "Novák",
+    "email": "jan.novak@example.com",
+    "packeta_point_id": "1234",
+    "price": "1290.00",
+    "currency": "CZK",
+    "cod_amount": "0",
+    "weight_kg": "1.2",
+    "sender_id": "eshop",
+}
+
+CREATE_PACKET_RESPONSE = (
+    b'<?xml version="1.0" encoding="utf-8"?>\n'
+    b"<response><status>ok</status><result><id>1234567890</id>"
+    b"<barcode>Z1234567890</barcode><barcodeText>Z 123 4567 890</barcodeText>"
+    b"</result></response>"
+)
+
+
+def labels_response(size: int) -> bytes:
+    label = base64.b64encode(os.urandom(size))
+    return b"<response><status>ok</status><result>" + label + b"</result></response>"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the Packeta XML codec with the previous xmltodict/dicttoxml based one, "
+        "without any network requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=2000, help="Runs per case.")
+        parser.add_argument(
+            "--labels-size",
+            type=int,
+            default=500_000,
+            help="Size of the labels PDF in the labels response, in bytes.",
+        )
+        parser.add_argument(
+            "--packets", type=int, default=100, help="Packet IDs in the labels request."
+        )
+
+    def handle(self, *args, **options):
+        number = options["number"]
+        packet_ids = [str(1_000_000_000 + i) for i in range(options["packets"])]
+        labels = labels_response(options["labels_size"])
+
+        def legacy_create_packet_request():
+            # Formerly a multi-line str.format() template without escaping
+            return CREATE_PACKET_TEMPLATE.format(**PACKET_ATTRIBUTES).encode("utf-8")
+
+        def legacy_labels_request():
+            data = {
+                "packetsLabelsPdf": {
+                    "apiPassword": "password",
+                    "packetIds": packet_ids,
+                    "format": "A7 on A4",
+                    "offset": 0,
+                }
+            }
+            xml = dicttoxml(
+                data, attr_type=False, root=False, item_func=lambda parent: "id"
+            )
+            return parseString(xml).toprettyxml().split("\n", 1)[-1]
+
+        # (name, previous, current, runs), parsing the labels PDF is much slower
+        cases = [
+            (
+                "createPacket request",
+                legacy_create_packet_request,
+                lambda: render(CREATE_PACKET_TEMPLATE, **PACKET_ATTRIBUTES),
+                number,
+            ),
+            (
+                "packetsLabelsPdf request",
+                legacy_labels_request,
+                lambda: render(
+                    PACKETS_LABELS_PDF_TEMPLATE,
+                    markup={"packet_ids": render_packet_ids(packet_ids)},
+                    api_password="password",
+                    label_format="A7 on A4",
+                    offset=0,
+                ),
+                number,
+            ),
+            (
+                "createPacket response",
+                lambda: xmltodict.parse(CREATE_PACKET_RESPONSE.decode("utf-8")),
+                lambda: parse_response(io.BytesIO(CREATE_PACKET_RESPONSE)),
+                number,
+            ),
+            (
+                "packetsLabelsPdf response",
+                # Previously parsed, then base64 decoded as a whole
+                lambda: base64.b64decode(
+                    xmltodict.parse(labels.decode("utf-8"))["response"]["result"]
+                ),
+                lambda: decode_result(io.BytesIO(labels), io.BytesIO()),
+                max(number // 100, 10),
+            ),
+        ]
+
+        self.stdout.write(f"{'case':<28}{'previous':>14}{'current':>14}{'speedup':>10}")
+        for name, legacy, current, runs in cases:
+            legacy_time = timeit.timeit(legacy, number=runs) / runs
+            current_time = timeit.timeit(current, number=runs) / runs
+            self.stdout.write(
+                f"{name:<28}{legacy_time * 1e6:>11.1f} µs{current_time * 1e6:>11.1f} µs"
+                f"{legacy_time / current_time:>9.1f}x"
+            )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop.inventory import compact_inventory
+
+
+class Command(BaseCommand):
+    help = "Folds recent inventory movements into stock snapshots."
+
+    def handle(self, *args, **options):
+        stats = compact_inventory()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Compacted stock of {stats['variants']} variants in {stats['duration']}s."
+            )
+        )
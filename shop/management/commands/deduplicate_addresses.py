@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from shop.models import BillingAddress, ShippingAddress
+
+# Points orders from duplicate addresses to the address that is kept
+REPOINT_ORDERS_SQL = """
+    UPDATE shop_order
+    SET {column} = duplicates.kept_id
+    FROM (VALUES {values}) AS duplicates (duplicate_id, kept_id)
+    WHERE shop_order.{column} = duplicates.duplicate_id
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfills address fingerprints and merges duplicate addresses, "
+        "keeping the oldest one of each group."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of addresses written per statement.",
+        )
+
+    def handle(self, *args, **options):
+        for model, order_column in (
+            (BillingAddress, "billing_address_id"),
+            (ShippingAddress, "shipping_address_id"),
+        ):
+            kept, duplicates = self.group_by_fingerprint(model)
+            with transaction.atomic():
+                self.merge(model, order_column, duplicates, options["batch_size"])
+                # Duplicates are gone, fingerprints of the rest can't collide anymore
+                model.objects.bulk_update(
+                    kept, ["fingerprint"], batch_size=options["batch_size"]
+                )
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{model._meta.verbose_name_plural}: {len(kept)} kept, "
+                    f"{len(duplicates)} duplicates merged."
+                )
+            )
+
+    def group_by_fingerprint(self, model):
+        """Returns addresses to keep and a {duplicate pk: kept pk} mapping."""
+        kept = {}
+        duplicates = {}
+        for address in model.objects.order_by("pk").iterator(chunk_size=2000):
+            fingerprint = address.compute_fingerprint()
+            if fingerprint in kept:
+                duplicates[address.pk] = kept[fingerprint].pk
+            else:
+                address.fingerprint = fingerprint
+                kept[fingerprint] = address
+
+        return list(kept.values()), duplicates
+
+    def merge(self, model, order_column, duplicates, batch_size):
+        items = list(duplicates.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), batch_size):
+                batch = items[start : start + batch_size]
+                cursor.execute(
+                    REPOINT_ORDERS_SQL.format(
+                        column=order_column,
+                        values=", ".join(["(%s::integer, %s::integer)"] * len(batch)),
+                    ),
+                    [pk for pair in batch for pk in pair],
+                )
+                model.objects.filter(pk__in=[pk for pk, _kept in batch]).delete()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from shop.utils import delete_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = "Deletes carts that have not been touched for a given number of days."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ttl-days",
+            type=int,
+            help="Idle days after which a cart is deleted. Defaults to settings.ABANDONED_CART_TTL_DAYS.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of carts deleted per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        stats = delete_abandoned_carts(
+            ttl_days=options["ttl_days"], chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {stats['carts']} carts and {stats['items']} cart items "
+                f"in {stats['duration']}s."
+            )
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.packeta_points import import_packeta_points, read_branch_feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports Packeta pick-up points from a branch feed file (JSON or XML), "
+        "points missing in the feed are deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Path to the branch feed, e.g. branch.json or branch.xml.")
+
+    def handle(self, *args, **options):
+        try:
+            stats = import_packeta_points(read_branch_feed(options["file"]))
+        except (OSError, ValueError, SyntaxError) as e:
+            # ElementTree.ParseError is a SyntaxError, json.JSONDecodeError a ValueError
+            raise CommandError(f"Can't read the branch feed: {e}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {stats['imported']} points, skipped {stats['skipped']}, "
+                f"deleted {stats['deleted']}."
+            )
+        )
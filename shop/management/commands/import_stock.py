@@ -0,0 +1,35 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.inventory import import_stock_levels
+
+
+class Command(BaseCommand):
+    help = (
+        "Sets stock of product variants from a CSV file with 'id' (Product Variant PK) "
+        "and 'pcs_in_stock' columns. Differences are recorded as import movements."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Path to the CSV file.")
+        parser.add_argument(
+            "--note", default="", help="Note stored with the import movements."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["file"], newline="") as csv_file:
+                levels = {
+                    int(row["id"]): int(row["pcs_in_stock"])
+                    for row in csv.DictReader(csv_file)
+                }
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f"Can't read stock levels: {e}")
+
+        recorded = import_stock_levels(levels, note=options["note"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recorded {recorded} movements for {len(levels)} variants."
+            )
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shop.gopay_api import poll_gopay_payments
+
+
+class Command(BaseCommand):
+    help = "Checks states of pending GoPay payments and updates their orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            help="Concurrent requests limit. Defaults to settings.GOPAY_POLL_CONCURRENCY.",
+        )
+
+    def handle(self, *args, **options):
+        stats = poll_gopay_payments(max_workers=options["max_workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {stats['checked']} payments, {stats['changed']} changed, "
+                f"{stats['failed']} failed in {stats['duration']}s."
+            )
+        )
@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.gopay_statement import reconcile_gopay_statement, reconcile_statement
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks GoPay payments and their orders paid according to the GoPay account "
+        "statement, downloaded for the period or replayed from a file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            help="Statement CSV file to replay instead of downloading the statement, "
+            "e.g. shop/fixtures/gopay_statement.csv.",
+        )
+        parser.add_argument(
+            "--date-from",
+            type=date.fromisoformat,
+            help="First day of the period (YYYY-MM-DD). Defaults to yesterday.",
+        )
+        parser.add_argument(
+            "--date-to",
+            type=date.fromisoformat,
+            help="Last day of the period (YYYY-MM-DD). Defaults to today.",
+        )
+        parser.add_argument(
+            "--currency",
+            help="Currency of the replayed file's rows if it has no currency column.",
+        )
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            try:
+                with open(options["file"], newline="", encoding="utf-8-sig") as statement:
+                    stats = reconcile_statement(statement, options["currency"])
+            except OSError as e:
+                raise CommandError(f"Can't read the statement: {e}")
+        else:
+            today = timezone.localdate()
+            stats = reconcile_gopay_statement(
+                options["date_from"] or today - timedelta(days=1),
+                options["date_to"] or today,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciled {stats['rows']} statement rows, {stats['orders']} orders "
+                f"marked paid in {stats['duration']}s."
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from shop.utils import reconcile_order_aggregates
+
+
+class Command(BaseCommand):
+    help = "Verifies total price, weight and item count stored on orders against their items."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Overwrite wrong aggregates with the ones computed from the items.",
+        )
+
+    def handle(self, *args, **options):
+        order_numbers = reconcile_order_aggregates(fix=options["fix"])
+        if not order_numbers:
+            self.stdout.write(self.style.SUCCESS("All order aggregates are correct."))
+            return
+
+        for order_number in order_numbers:
+            self.stdout.write(order_number)
+
+        message = f"{len(order_numbers)} orders with wrong aggregates"
+        if options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"{message} fixed."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{message} found, run with --fix to fix them."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from shop.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Releases all expired stock reservations."
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        self.stdout.write(
+            self.style.SUCCESS(f"Released {released} expired stock reservations.")
+        )
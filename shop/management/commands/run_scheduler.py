@@ -0,0 +1,39 @@
+import time
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shop.order_status_updater import schedule_jobs
+
+# Only one scheduler may run the jobs, others wait for this session-level advisory lock
+SCHEDULER_LOCK_ID = 52_170_001
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs periodic shop jobs (payment polling, stock and cart cleanup, "
+        "inventory compaction, packet tracking). Extra instances stand by."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lock-retry",
+            type=float,
+            default=30,
+            help="Seconds a standby instance waits before trying to take over.",
+        )
+
+    def handle(self, *args, **options):
+        while not self.acquire_lock():
+            self.stdout.write("Another scheduler is running, standing by.")
+            time.sleep(options["lock_retry"])
+
+        self.stdout.write(self.style.SUCCESS("Scheduler started."))
+        schedule_jobs(BlockingScheduler()).start()
+
+    @staticmethod
+    def acquire_lock() -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [SCHEDULER_LOCK_ID])
+            return cursor.fetchone()[0]
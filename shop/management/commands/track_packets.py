@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.api.packeta_api import Packeta
+from shop.api.packeta_transport import PacketaTransport
+from shop.packeta_tracking import track_packets
+
+
+class Command(BaseCommand):
+    help = "Refreshes statuses of Packets that are on their way."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            help="Concurrent requests limit. Defaults to settings.PACKETA_TRACKING_CONCURRENCY.",
+        )
+        parser.add_argument(
+            "--base-url",
+            help="Packeta API URL, e.g. of a local fake endpoint. Defaults to settings.PACKETA_BASE_URL.",
+        )
+
+    def handle(self, *args, **options):
+        fetch = None
+        if options["base_url"]:
+            transport = PacketaTransport(
+                options["base_url"],
+                timeout=(settings.PACKETA_CONNECT_TIMEOUT, settings.PACKETA_READ_TIMEOUT),
+            )
+            fetch = Packeta(transport=transport).get_packet_status
+
+        stats = track_packets(fetch=fetch, max_workers=options["max_workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {stats['checked']} packets, {stats['changed']} changed, "
+                f"{stats['failed']} failed in {stats['duration']}s."
+            )
+        )
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+MERGE_DUPLICATE_CART_LINES_SQL = """
+    UPDATE shop_cartitem
+    SET amount = duplicates.total_amount,
+        price = product.price * duplicates.total_amount
+    FROM (
+        SELECT MIN(id) AS keep_id, SUM(amount) AS total_amount
+        FROM shop_cartitem
+        GROUP BY cart_id, product_id, COALESCE(product_variant_id, 0)
+        HAVING COUNT(*) > 1
+    ) duplicates, shop_product product
+    WHERE shop_cartitem.id = duplicates.keep_id
+        AND product.id = shop_cartitem.product_id;
+
+    DELETE FROM shop_cartitem duplicate
+    USING shop_cartitem kept
+    WHERE kept.cart_id = duplicate.cart_id
+        AND kept.product_id = duplicate.product_id
+        AND COALESCE(kept.product_variant_id, 0) = COALESCE(duplicate.product_variant_id, 0)
+        AND kept.id < duplicate.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0039_product_weight_kg'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_CART_LINES_SQL, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(models.F('cart'), models.F('product'), django.db.models.functions.comparison.Coalesce('product_variant', 0, output_field=models.IntegerField()), name='unique_cart_line'),
+        ),
+    ]
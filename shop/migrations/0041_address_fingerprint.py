@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0040_cartitem_unique_cart_line'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='fingerprint',
+            field=models.CharField(editable=False, help_text='Hash of the normalized address, used for deduplication.', max_length=64, null=True, unique=True, verbose_name='Fingerprint'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:20
+
+import re
+
+from django.db import migrations, models
+
+ORDER_NUMBER_RE = re.compile(r"(\d{4})(\d{5,})$")
+
+
+def seed_counters(apps, schema_editor):
+    """Continues numbering after the highest existing order number of every month."""
+    Order = apps.get_model("shop", "Order")
+    OrderNumberCounter = apps.get_model("shop", "OrderNumberCounter")
+
+    last_values = {}
+    for order_number in Order.objects.values_list("order_number", flat=True).iterator():
+        match = ORDER_NUMBER_RE.search(order_number)
+        if match:
+            period, sequence = match.group(1), int(match.group(2))
+            last_values[period] = max(last_values.get(period, 0), sequence)
+
+    OrderNumberCounter.objects.bulk_create(
+        [
+            OrderNumberCounter(period=period, last_value=last_value)
+            for period, last_value in last_values.items()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0041_address_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('period', models.CharField(max_length=4, primary_key=True, serialize=False, verbose_name='Period (YYMM)')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='Last Value')),
+            ],
+            options={
+                'verbose_name': 'Order Number Counter',
+                'verbose_name_plural': 'Order Number Counters',
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
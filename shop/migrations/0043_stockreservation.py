@@ -0,0 +1,42 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0042_ordernumbercounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(help_text='Identifies the cart holding the pieces.', max_length=64, verbose_name='Holder')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+                ('expires_at', models.DateTimeField(verbose_name='Expires At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.productvariant', verbose_name='Product Variant')),
+            ],
+            options={
+                'verbose_name': 'Stock Reservation',
+                'verbose_name_plural': 'Stock Reservations',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['variant', 'expires_at'], name='reservation_variant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockreservation',
+            constraint=models.UniqueConstraint(fields=('holder', 'variant'), name='unique_stock_reservation'),
+        ),
+    ]
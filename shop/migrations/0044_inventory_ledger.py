@@ -0,0 +1,64 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_snapshots(apps, schema_editor):
+    """Current stock of tracked variants becomes their first snapshot."""
+    ProductVariant = apps.get_model("shop", "ProductVariant")
+    InventorySnapshot = apps.get_model("shop", "InventorySnapshot")
+
+    InventorySnapshot.objects.bulk_create(
+        [
+            InventorySnapshot(variant_id=pk, quantity=pcs_in_stock)
+            for pk, pcs_in_stock in ProductVariant.objects.filter(
+                pcs_in_stock__isnull=False
+            ).values_list("pk", "pcs_in_stock")
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0043_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(help_text='Pieces added to (positive) or taken off the stock.', verbose_name='Quantity')),
+                ('reason', models.CharField(choices=[('order', 'Order'), ('cancellation', 'Cancellation'), ('adjustment', 'Manual Adjustment'), ('import', 'Import')], max_length=16, verbose_name='Reason')),
+                ('note', models.CharField(blank=True, max_length=255, verbose_name='Note')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('order', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.order', verbose_name='Order')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='shop.productvariant', verbose_name='Product Variant')),
+            ],
+            options={
+                'verbose_name': 'Inventory Movement',
+                'verbose_name_plural': 'Inventory Movements',
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inventory_snapshot', serialize=False, to='shop.productvariant', verbose_name='Product Variant')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Quantity')),
+                ('last_movement_id', models.BigIntegerField(default=0, verbose_name='Last Movement ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Inventory Snapshot',
+                'verbose_name_plural': 'Inventory Snapshots',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventorymovement',
+            index=models.Index(fields=['variant', 'id'], name='movement_variant_idx'),
+        ),
+        migrations.RunPython(seed_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+POPULATE_AGGREGATES_SQL = """
+    UPDATE shop_order
+    SET total_weight_kg = computed.total_weight_kg,
+        item_count = computed.item_count
+    FROM (
+        SELECT item.order_id,
+            SUM(item.quantity * product.weight_kg) AS total_weight_kg,
+            SUM(item.quantity) AS item_count
+        FROM shop_orderitem item
+        JOIN shop_product product ON product.id = item.product_id
+        GROUP BY item.order_id
+    ) AS computed
+    WHERE computed.order_id = shop_order.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0044_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Item Count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_weight_kg',
+            field=models.FloatField(default=0, editable=False, verbose_name='Weight in KG'),
+        ),
+        migrations.RunSQL(POPULATE_AGGREGATES_SQL, migrations.RunSQL.noop),
+    ]
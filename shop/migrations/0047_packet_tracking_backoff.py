@@ -0,0 +1,23 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0046_gopaypayment_polling_backoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packet',
+            name='check_attempts',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Status Check Attempts'),
+        ),
+        migrations.AddField(
+            model_name='packet',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='Next Status Check'),
+        ),
+    ]
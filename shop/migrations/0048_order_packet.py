@@ -0,0 +1,19 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0047_packet_tracking_backoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='packet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='shop.packet', verbose_name='Packet'),
+        ),
+    ]
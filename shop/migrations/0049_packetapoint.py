@@ -0,0 +1,32 @@
+# Generated by Django 4.1.3 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0048_order_packet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PacketaPoint',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='Point ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('street', models.CharField(blank=True, default='', max_length=255, verbose_name='Street')),
+                ('city', models.CharField(blank=True, default='', max_length=128, verbose_name='City')),
+                ('zip_code', models.CharField(help_text='Without spaces.', max_length=16, verbose_name='ZIP Code')),
+                ('country', models.CharField(max_length=2, verbose_name='Country')),
+                ('latitude', models.FloatField(verbose_name='Latitude')),
+                ('longitude', models.FloatField(verbose_name='Longitude')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Packeta Point',
+                'verbose_name_plural': 'Packeta Points',
+                'indexes': [models.Index(fields=['zip_code'], name='packeta_point_zip_idx', opclasses=['varchar_pattern_ops'])],
+            },
+        ),
+    ]
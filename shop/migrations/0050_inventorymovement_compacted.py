@@ -0,0 +1,40 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0049_packetapoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventorymovement',
+            name='compacted',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Compacted'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE shop_inventorymovement movement
+            SET compacted = TRUE
+            FROM shop_inventorysnapshot snapshot
+            WHERE movement.variant_id = snapshot.variant_id
+                AND movement.id <= snapshot.last_movement_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='inventorysnapshot',
+            name='last_movement_id',
+        ),
+        migrations.RemoveIndex(
+            model_name='inventorymovement',
+            name='movement_variant_idx',
+        ),
+        migrations.AddIndex(
+            model_name='inventorymovement',
+            index=models.Index(condition=models.Q(('compacted', False)), fields=['variant'], name='movement_uncompacted_idx'),
+        ),
+    ]
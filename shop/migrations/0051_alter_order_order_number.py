@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0050_inventorymovement_compacted'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.CharField(max_length=25, unique=True, verbose_name='Order Number'),
+        ),
+    ]
@@ -5,6 +5,7 @@ from .models import (
     Category,
     ProductType,
     Product,
+    ProductVariant,
     Address,
     ShippingAddress,
     BillingAddress,
@@ -14,4 +15,6 @@ from .models import (
     Invoice,
 )
 
-from .packeta_models import Packet
+from .packeta_models import Packet, PacketaPoint
+
+from .inventory_models import StockReservation, InventoryMovement, InventorySnapshot
@@ -0,0 +1,124 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class StockReservation(models.Model):
+    """
+    Time-limited hold of variant pieces for a cart, so they can't be sold to
+    someone else while the customer is checking out. For usage see `shop/inventory.py`.
+    """
+
+    variant = models.ForeignKey(
+        "ProductVariant",
+        on_delete=models.CASCADE,
+        related_name="reservations",
+        verbose_name=_("Product Variant"),
+    )
+    holder = models.CharField(
+        _("Holder"),
+        max_length=64,
+        help_text=_("Identifies the cart holding the pieces."),
+    )
+    quantity = models.PositiveIntegerField(_("Quantity"))
+    expires_at = models.DateTimeField(_("Expires At"))
+
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    def __str__(self):
+        return f"{self.quantity}x {self.variant} ({self.holder})"
+
+    class Meta:
+        verbose_name = _("Stock Reservation")
+        verbose_name_plural = _("Stock Reservations")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["holder", "variant"], name="unique_stock_reservation"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["variant", "expires_at"],
+                name="reservation_variant_idx",
+            ),
+            models.Index(fields=["expires_at"], name="reservation_expiry_idx"),
+        ]
+
+
+class InventoryMovement(models.Model):
+    """
+    Append-only record of a stock change of a variant. Movements are never deleted
+    and their quantity never changes, current stock is the InventorySnapshot plus
+    all movements not compacted into it yet.
+    """
+
+    class Reasons(models.TextChoices):
+        ORDER = "order", _("Order")
+        CANCELLATION = "cancellation", _("Cancellation")
+        ADJUSTMENT = "adjustment", _("Manual Adjustment")
+        IMPORT = "import", _("Import")
+
+    variant = models.ForeignKey(
+        "ProductVariant",
+        on_delete=models.CASCADE,
+        related_name="movements",
+        verbose_name=_("Product Variant"),
+    )
+    quantity = models.IntegerField(
+        _("Quantity"), help_text=_("Pieces added to (positive) or taken off the stock.")
+    )
+    reason = models.CharField(_("Reason"), max_length=16, choices=Reasons.choices)
+    # No database constraint, the history stays even if the order gets deleted
+    order = models.ForeignKey(
+        "Order",
+        null=True,
+        blank=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        verbose_name=_("Order"),
+    )
+    note = models.CharField(_("Note"), max_length=255, blank=True)
+    # Set when the movement is folded into the InventorySnapshot
+    compacted = models.BooleanField(_("Compacted"), default=False, editable=False)
+
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.quantity:+} {self.variant} ({self.get_reason_display()})"
+
+    class Meta:
+        verbose_name = _("Inventory Movement")
+        verbose_name_plural = _("Inventory Movements")
+        indexes = [
+            models.Index(
+                fields=["variant"],
+                condition=models.Q(compacted=False),
+                name="movement_uncompacted_idx",
+            ),
+        ]
+
+
+class InventorySnapshot(models.Model):
+    """
+    Stock of a variant after all its compacted movements,
+    periodically compacted by shop.inventory.compact_inventory().
+    """
+
+    variant = models.OneToOneField(
+        "ProductVariant",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="inventory_snapshot",
+        verbose_name=_("Product Variant"),
+    )
+    quantity = models.IntegerField(_("Quantity"), default=0)
+
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    def __str__(self):
+        return f"{self.variant}: {self.quantity}"
+
+    class Meta:
+        verbose_name = _("Inventory Snapshot")
+        verbose_name_plural = _("Inventory Snapshots")
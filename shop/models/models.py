@@ -1,11 +1,14 @@
+import hashlib
 import logging
+from collections import defaultdict
 from datetime import timedelta
+from itertools import chain
 
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.db import models, IntegrityError, transaction
-from django.db.models.signals import post_save
+from django.db import models, transaction, connection
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -28,13 +31,21 @@ from wagtail.models import TranslatableMixin, Site, Orderable
 from wagtailautocomplete.edit_handlers import AutocompletePanel
 
 from core.panels import ReadOnlyPanel
-from shop.gopay_api import is_gopay_payment_paid
+from shop.models.inventory_models import InventoryMovement
 from shop.utils import generate_order_number
 from users.models import ShopUser
 
 logger = logging.getLogger("django")
 
 
+# Sets the paid flag of orders of a payment, returning the orders whose flag changed
+ORDER_PAID_SQL = """
+    UPDATE shop_order SET is_paid = %s, updated_at = NOW()
+    WHERE gopay_payment_id = %s AND is_paid IS DISTINCT FROM %s
+    RETURNING id
+"""
+
+
 class GopayPayment(models.Model):
     payment_id = models.CharField(
         _("Payment ID"), max_length=128, editable=False, unique=True
@@ -45,19 +56,42 @@ class GopayPayment(models.Model):
     payment_data = models.JSONField(_("Payment Data"), editable=False)
     is_paid = models.BooleanField(_("Paid"), default=False)
 
+    # Status polling backoff, see shop.gopay_api.poll_gopay_payments()
+    check_attempts = models.PositiveIntegerField(
+        _("Status Check Attempts"), default=0, editable=False
+    )
+    next_check_at = models.DateTimeField(
+        _("Next Status Check"), null=True, blank=True, editable=False, db_index=True
+    )
+
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
     def __str__(self):
         return self.payment_id
 
+    # Payments in these states never change again and are not polled anymore
+    FINAL_STATES = ("PAID", "CANCELED", "TIMEOUTED", "REFUNDED", "PARTIALLY_REFUNDED")
+
     def save(self, *args, **kwargs):
         self.is_paid = self.payment_status == "PAID"
-        super(GopayPayment, self).save()
-        order = self.order_set.first()
-        if order:
-            order.is_paid = self.is_paid
-            order.save()
+        with transaction.atomic():
+            super(GopayPayment, self).save()
+            self.update_orders()
+
+    def update_orders(self):
+        """
+        Propagates is_paid to the orders of the payment without Order.save(),
+        only orders actually changing get updated and send order_paid.
+        """
+        from shop.signals import send_after_commit
+
+        with connection.cursor() as cursor:
+            cursor.execute(ORDER_PAID_SQL, [self.is_paid, self.pk, self.is_paid])
+            changed_order_ids = [row[0] for row in cursor.fetchall()]
+        if self.is_paid:
+            for order_id in changed_order_ids:
+                send_after_commit("order_paid", order_id)
 
     class Meta:
         verbose_name = _("GoPay Payment")
@@ -106,6 +140,91 @@ class CartItem(models.Model):
 
     class Meta:
         ordering = ("created_at",)
+        constraints = [
+            # Lines without a variant are unique too, hence the Coalesce
+            models.UniqueConstraint(
+                "cart",
+                "product",
+                Coalesce(
+                    "product_variant", 0, output_field=models.IntegerField()
+                ),
+                name="unique_cart_line",
+            )
+        ]
+
+
+# Adds positive amounts to cart lines in a single statement, creating the lines if needed.
+# Line prices are recomputed from the current product price on every change.
+# Lines of products or variants deleted since they were added (e.g. in a session cart)
+# are skipped, as are variants that don't belong to the product.
+CART_LINES_UPSERT_SQL = """
+    INSERT INTO shop_cartitem (
+        cart_id, product_id, product_variant_id, amount,
+        price, price_currency, created_at, updated_at
+    )
+    SELECT %s, product.id, lines.variant_id, lines.amount,
+        product.price * lines.amount, product.price_currency, NOW(), NOW()
+    FROM (VALUES {values}) AS lines (product_id, variant_id, amount)
+    JOIN shop_product product ON product.id = lines.product_id
+    LEFT JOIN shop_productvariant variant ON variant.id = lines.variant_id
+    WHERE lines.variant_id IS NULL OR variant.product_id = product.id
+    ON CONFLICT (cart_id, product_id, COALESCE(product_variant_id, 0))
+    DO UPDATE SET
+        amount = shop_cartitem.amount + EXCLUDED.amount,
+        price = (
+            SELECT price FROM shop_product WHERE id = EXCLUDED.product_id
+        ) * (shop_cartitem.amount + EXCLUDED.amount),
+        updated_at = EXCLUDED.updated_at
+"""
+
+# Subtracts amounts from existing cart lines, never going below zero
+CART_LINES_DECREMENT_SQL = """
+    UPDATE shop_cartitem
+    SET amount = GREATEST(shop_cartitem.amount + lines.amount, 0),
+        price = product.price * GREATEST(shop_cartitem.amount + lines.amount, 0),
+        updated_at = NOW()
+    FROM (VALUES {values}) AS lines (product_id, variant_id, amount),
+        shop_product product
+    WHERE shop_cartitem.cart_id = %s
+        AND shop_cartitem.product_id = lines.product_id
+        AND COALESCE(shop_cartitem.product_variant_id, 0) = COALESCE(lines.variant_id, 0)
+        AND product.id = lines.product_id
+"""
+
+# Removes emptied lines and the cart itself once it has no lines left
+CART_CLEANUP_SQL = """
+    DELETE FROM shop_cartitem WHERE cart_id = %s AND amount = 0;
+    DELETE FROM shop_cart WHERE id = %s
+        AND NOT EXISTS (SELECT 1 FROM shop_cartitem WHERE cart_id = %s);
+"""
+
+CART_LINE_VALUES_SQL = "(%s::integer, %s::integer, %s::integer)"
+
+# Moves all lines of the source carts into the target cart, summing up amounts
+# of the same lines, then deletes the source carts
+CART_MERGE_SQL = """
+    INSERT INTO shop_cartitem (
+        cart_id, product_id, product_variant_id, amount,
+        price, price_currency, created_at, updated_at
+    )
+    SELECT %(target)s, item.product_id, item.product_variant_id, SUM(item.amount),
+        product.price * SUM(item.amount), product.price_currency,
+        MIN(item.created_at), NOW()
+    FROM shop_cartitem item
+    JOIN shop_product product ON product.id = item.product_id
+    WHERE item.cart_id = ANY(%(sources)s)
+    GROUP BY item.product_id, item.product_variant_id,
+        product.price, product.price_currency
+    ON CONFLICT (cart_id, product_id, COALESCE(product_variant_id, 0))
+    DO UPDATE SET
+        amount = shop_cartitem.amount + EXCLUDED.amount,
+        price = (
+            SELECT price FROM shop_product WHERE id = EXCLUDED.product_id
+        ) * (shop_cartitem.amount + EXCLUDED.amount),
+        updated_at = EXCLUDED.updated_at;
+    DELETE FROM shop_cartitem WHERE cart_id = ANY(%(sources)s);
+    DELETE FROM shop_cart WHERE id = ANY(%(sources)s);
+"""
 
 
 class Cart(models.Model):
@@ -116,41 +235,194 @@ class Cart(models.Model):
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
+    @classmethod
+    def from_request(cls, request, create=False):
+        """Returns the Cart stored in session, optionally creating a new one."""
+        cart = cls.objects.filter(pk=request.session.get("cart")).first()
+        if not cart and create:
+            user = request.user if request.user.is_authenticated else None
+            cart = cls.objects.create(created_by=user)
+            request.session["cart"] = cart.pk
+
+        return cart
+
+    @property
+    def reservation_holder(self):
+        """Identifies the cart's stock reservations, see shop.inventory."""
+        return f"cart:{self.pk}"
+
+    def hold_stock(self, variant_pks=None):
+        """
+        Sets stock reservations of the cart to the amounts of its lines,
+        only for the given variants if variant_pks is passed.
+        """
+        from shop.inventory import reserve_stock
+
+        lines = self.cartitem_set.filter(product_variant__pcs_in_stock__isnull=False)
+        if variant_pks is not None:
+            lines = lines.filter(product_variant__in=variant_pks)
+        amounts = dict(lines.values_list("product_variant", "amount"))
+        if variant_pks is not None:
+            # Variants no longer in the cart are released
+            amounts = {pk: amounts.get(pk, 0) for pk in variant_pks}
+
+        reserve_stock(self.reservation_holder, amounts)
+
+    def clear(self):
+        from shop.inventory import release_stock
+
+        release_stock(self.reservation_holder)
+        self.delete()
+
     def add(self, item, variant, amount=1) -> bool:
-        if (variant and not variant.available()) or (
-            not variant and item.variants.exists()
-        ):
+        """Adds amount pieces if the line's new amount is available, see add_many()."""
+        if amount > 0 and variant:
+            line_amount = self.line_amounts().get((item.pk, variant.pk), 0)
+            if not variant.available(
+                holder=self.reservation_holder, pieces=line_amount + amount
+            ):
+                return False
+        elif not variant and item.variants.exists():
             return False
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart=self, product=item, product_variant=variant
-            )
-            new_amount = cart_item.amount + amount
-            if new_amount <= 0:
-                cart_item.delete()
-                if not self.items.exists():
-                    self.delete()
-            else:
-                cart_item.amount = new_amount
-                cart_item.save()
-        except CartItem.DoesNotExist:
-            CartItem.objects.create(
-                cart=self, product=item, product_variant=variant, amount=amount
+        self.add_many([(item, variant, amount)])
+        return True
+
+    def line_amounts(self):
+        """Returns the cart lines as {(product pk, variant pk): amount}."""
+        return {
+            (product_pk, variant_pk): amount
+            for product_pk, variant_pk, amount in self.cartitem_set.values_list(
+                "product", "product_variant", "amount"
             )
+        }
+
+    def add_many(self, lines):
+        """
+        Applies (Product, ProductVariant, amount) lines to the cart in one transaction.
+        Amounts for the same line are summed up first, so every line is written once.
+        Lines are expected to be validated already, see shop.cart.load_cart_lines().
+        """
+        deltas = defaultdict(int)
+        for product, variant, amount in lines:
+            deltas[(product.pk, variant.pk if variant else None)] += amount
+
+        self.apply_deltas(deltas)
+
+    def apply_deltas(self, deltas):
+        """
+        Writes {(product pk, variant pk): amount} changes to the cart lines,
+        one statement for increments and one for decrements.
+        Stock reservations of the changed variants follow the new amounts.
+        """
+        increments = [
+            (product_pk, variant_pk, amount)
+            for (product_pk, variant_pk), amount in deltas.items()
+            if amount > 0
+        ]
+        decrements = [
+            (product_pk, variant_pk, amount)
+            for (product_pk, variant_pk), amount in deltas.items()
+            if amount < 0
+        ]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Atomic upsert, concurrent clicks can't lose increments
+            if increments:
+                cursor.execute(
+                    CART_LINES_UPSERT_SQL.format(
+                        values=", ".join([CART_LINE_VALUES_SQL] * len(increments))
+                    ),
+                    [self.pk, *chain.from_iterable(increments)],
+                )
+            if decrements:
+                cursor.execute(
+                    CART_LINES_DECREMENT_SQL.format(
+                        values=", ".join([CART_LINE_VALUES_SQL] * len(decrements))
+                    ),
+                    [*chain.from_iterable(decrements), self.pk],
+                )
+                cursor.execute(CART_CLEANUP_SQL, [self.pk] * 3)
 
-        return True
+        self.hold_stock(
+            {variant_pk for _product_pk, variant_pk in deltas if variant_pk}
+        )
+        self._summary = None
+
+    @classmethod
+    def merge_user_carts(
+        cls, user, guest_cart_pk=None, session_lines=None, session_holder=None
+    ):
+        """
+        Merges all carts of a user, the guest cart of their session and lines of
+        a session cart into a single cart, using set-based statements only.
+
+        The oldest cart of the user is kept, if there is none, the guest cart
+        is assigned to the user. Stock held by the merged carts is held by
+        the kept cart afterwards.
+
+        :param user: User who just logged in.
+        :param guest_cart_pk: PK of the anonymous Cart stored in session, if any.
+        :param session_lines: {(product pk, variant pk): amount} of a SessionCart.
+        :param session_holder: Reservation holder of the SessionCart.
+        :return: The merged Cart or None if there is nothing to merge.
+        """
+        carts = list(
+            cls.objects.filter(
+                models.Q(created_by=user)
+                | models.Q(pk=guest_cart_pk, created_by=None)
+            ).order_by(models.F("created_by").asc(nulls_last=True), "pk")
+        )
+        if not carts and not session_lines:
+            return None
+
+        target = carts[0] if carts else cls.objects.create(created_by=user)
+        if target.created_by_id is None:
+            cls.objects.filter(pk=target.pk).update(created_by=user)
+
+        from shop.inventory import release_stock
+
+        sources = carts[1:]
+        with transaction.atomic():
+            # Released before the kept cart holds the merged lines,
+            # otherwise they would count as held by others and cap its holds
+            for holder in [cart.reservation_holder for cart in sources] + [
+                session_holder
+            ]:
+                if holder:
+                    release_stock(holder)
+            if sources:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        CART_MERGE_SQL,
+                        {"target": target.pk, "sources": [cart.pk for cart in sources]},
+                    )
+            if session_lines:
+                target.apply_deltas(session_lines)
+            target.hold_stock()
+
+        return target
+
+    def summary(self):
+        """
+        Loads all cart lines with products, variants and images in a fixed number
+        of queries and returns them wrapped in a CartSummary.
+        The summary is kept until the cart changes, see apply_deltas().
+        """
+        from shop.cart import CartSummary, prefetch_product_images
+
+        if getattr(self, "_summary", None) is None:
+            self._summary = CartSummary(
+                self.items.select_related(
+                    "product", "product_variant"
+                ).prefetch_related(prefetch_product_images("product__images")),
+                holder=self.reservation_holder,
+            )
+        return self._summary
 
     @property
     def total_price(self):
-        items = self.items.all()
-        if items:
-            return Money(
-                sum([item.price.amount for item in items]),
-                currency=items.first().price.currency,
-            )
-
-        return Money(0, currency=settings.CURRENCIES[0])
+        return self.summary().total_price
 
     @property
     def items(self):
@@ -158,15 +430,15 @@ class Cart(models.Model):
 
     @property
     def must_be_paid_online(self):
-        return self.items.filter(product__must_be_paid_online=True).exists()
+        return self.summary().must_be_paid_online
 
     @property
     def is_digital(self):
-        return self.items.filter(product__is_digital=True).exists()
+        return self.summary().is_digital
 
     @property
     def needs_shipping(self):
-        return self.items.filter(product__is_digital=False).exists()
+        return self.summary().needs_shipping
 
     def __str__(self):
         return (
@@ -227,8 +499,62 @@ class ProductVariant(Orderable, TranslatableMixin):
         blank=True,
     )
 
-    def available(self):
-        return self.pcs_in_stock > 0
+    def available(self, holder=None, pieces=1):
+        """
+        Returns True if at least the given number of pieces are neither sold
+        nor held by other carts.
+
+        Variants loaded with shop.inventory.with_available_pieces() (e.g. prefetched for
+        product listings) use their `available_pcs`, computed for the holder they were
+        loaded for, and don't query the database.
+
+        :param holder: Reservation holder whose own holds don't count, see shop.inventory.
+        """
+        if self.pcs_in_stock is None:
+            return False
+
+        if hasattr(self, "available_pcs"):
+            available_pcs = self.available_pcs
+        else:
+            from shop.inventory import with_available_pieces
+
+            available_pcs = (
+                with_available_pieces(ProductVariant.objects.filter(pk=self.pk), holder)
+                .values_list("available_pcs", flat=True)
+                .first()
+            )
+        return bool(available_pcs and available_pcs >= max(pieces, 1))
+
+    def save(self, *args, **kwargs):
+        """
+        pcs_in_stock is only a cached value maintained by shop.inventory, so saves of
+        existing variants (e.g. re-saved with their product in the admin) never write it.
+        Stock is changed by recording movements, see shop.inventory.adjust_stock().
+        Stock set on a new variant is recorded as its initial adjustment.
+        """
+        if not self._state.adding:
+            if kwargs.get("update_fields") is None:
+                kwargs["update_fields"] = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name != "pcs_in_stock"
+                ]
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.pcs_in_stock:
+                from shop.inventory import record_movement
+
+                record_movement(
+                    self, self.pcs_in_stock, InventoryMovement.Reasons.ADJUSTMENT
+                )
+
+    panels = [
+        FieldPanel("name"),
+        FieldPanel("variant_id"),
+        ReadOnlyPanel(content="pcs_in_stock", heading=_("Pieces In Stock")),
+    ]
 
     class Meta:
         unique_together = [("translation_key", "locale")]
@@ -350,8 +676,22 @@ class Product(TranslatableMixin, ClusterableModel):
         return self.name
 
     def available(self):
+        """
+        Returns True if the product has no variants or any of them is available.
+        Uses variants prefetched with shop.cart.prefetch_available_variants() if present.
+        """
+        if "variants" in getattr(self, "_prefetched_objects_cache", {}):
+            variants = self.variants.all()
+            return not variants or any(variant.available() for variant in variants)
+
         if self.variants.exists():
-            return self.variants.filter(pcs_in_stock__gt=0).exists()
+            from shop.inventory import with_available_pieces
+
+            return (
+                with_available_pieces(self.variants.all())
+                .filter(available_pcs__gt=0)
+                .exists()
+            )
 
         return True
 
@@ -427,7 +767,26 @@ class ProductImage(Orderable):
     ]
 
 
+class AddressManager(models.Manager):
+    def get_or_create_by_fingerprint(self, **fields):
+        """get_or_create() matching existing addresses by their fingerprint only."""
+        fingerprint = self.model(**fields).compute_fingerprint()
+        return self.get_or_create(fingerprint=fingerprint, defaults=fields)
+
+
 class Address(models.Model):
+    FINGERPRINT_FIELDS = (
+        "first_name",
+        "last_name",
+        "email",
+        "phone",
+        "company",
+        "address1",
+        "zip_code",
+        "city",
+        "country",
+    )
+
     created_by = models.ForeignKey(
         ShopUser,
         null=True,
@@ -470,31 +829,48 @@ class Address(models.Model):
 
     country = CountryField(_("Country"))
 
+    fingerprint = models.CharField(
+        _("Fingerprint"),
+        max_length=64,
+        unique=True,
+        null=True,
+        editable=False,
+        help_text=_("Hash of the normalized address, used for deduplication."),
+    )
+
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
+    objects = AddressManager()
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
+    def compute_fingerprint(self):
+        """
+        SHA-256 of the case-folded, whitespace-normalized address fields.
+        The model name is included, so a billing and a shipping address
+        with the same data don't collide.
+        """
+        values = [self._meta.model_name] + [
+            " ".join(str(getattr(self, field) or "").split()).casefold()
+            for field in self.FINGERPRINT_FIELDS
+        ]
+        return hashlib.sha256("\x1f".join(values).encode()).hexdigest()
+
     def find_duplicate(self):
         return (
             type(self)
-            .objects.filter(
-                first_name__iexact=self.first_name,
-                last_name__iexact=self.last_name,
-                email__iexact=self.email,
-                phone__exact=self.phone,
-                company__iexact=self.company,
-                address1__iexact=self.address1,
-                zip_code__exact=self.zip_code,
-                city__iexact=self.city,
-                country__exact=self.country,
-            )
+            .objects.filter(fingerprint=self.compute_fingerprint())
             .exclude(pk=self.pk)
             .first()
         )
 
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.compute_fingerprint()
+        super(Address, self).save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.full_name} ({self.email}) - {self.address1}, {self.zip_code} {self.city}"
 
@@ -559,6 +935,16 @@ class BillingAddressBlock(blocks.StructBlock):
         icon = "address"
 
 
+# Adds a change of order lines to the denormalized order aggregates
+ORDER_AGGREGATES_DELTA_SQL = """
+    UPDATE shop_order
+    SET total_price = COALESCE(total_price, 0) + %s,
+        total_weight_kg = total_weight_kg + %s,
+        item_count = item_count + %s
+    WHERE id = %s
+"""
+
+
 class Order(ClusterableModel):
     created_by = models.ForeignKey(
         ShopUser,
@@ -597,7 +983,6 @@ class Order(ClusterableModel):
         _("Order Number"),
         max_length=25,
         unique=True,
-        default=generate_order_number,
     )
 
     internal_notification_sent = models.BooleanField(
@@ -633,9 +1018,21 @@ class Order(ClusterableModel):
     packeta_point_id = models.CharField(
         _("Packeta Point ID"), max_length=64, blank=True, null=True
     )
+    packet = models.ForeignKey(
+        "shop.Packet",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="orders",
+        verbose_name=_("Packet"),
+    )
 
     post_save_triggered = models.BooleanField(default=False)
 
+    # Aggregates of the order items, kept up to date by OrderItem, see add_to_aggregates()
+    total_weight_kg = models.FloatField(_("Weight in KG"), default=0, editable=False)
+    item_count = models.PositiveIntegerField(_("Item Count"), default=0, editable=False)
+
     panels = [
         MultiFieldPanel(
             [
@@ -671,37 +1068,43 @@ class Order(ClusterableModel):
                 FieldPanel("shipping_type"),
                 FieldPanel("packeta_point_name"),
                 FieldPanel("packeta_point_id"),
+                ReadOnlyPanel(content="packet", heading=_("Packet")),
             ],
             heading=_("Contact"),
         ),
         InlinePanel("items", heading=_("Items")),
     ]
 
-    def update_total_price(self):
-        instance_qs = Order.objects.filter(pk=self.pk)
-
-        # Using qs.update() to avoid calling save()
-        if self.items.exists():
-            instance_qs.update(
-                total_price=Money(
-                    sum(
-                        [item.total_price.amount for item in self.items.all()]
-                    ),
-                    currency=self.items.first().total_price.currency,
-                )
+    @staticmethod
+    def add_to_aggregates(order_id, total_price=0, weight_kg=0, item_count=0):
+        """
+        Applies a change of order lines to total price, weight and item count
+        of the order with a single UPDATE, without calling save().
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                ORDER_AGGREGATES_DELTA_SQL,
+                [total_price, weight_kg, item_count, order_id],
             )
-        else:
-            instance_qs.update(
-                total_price=Money(0, currency=settings.CURRENCIES[0])
-            )
-
-        self.refresh_from_db()
 
     def save(self, *args, **kwargs):
+        from shop.signals import send_after_commit
+
         if self.gopay_payment:
             self.is_paid = self.gopay_payment.is_paid
 
-        super(Order, self).save()
+        was_paid = (
+            self.pk is not None
+            and Order.objects.filter(pk=self.pk, is_paid=True).exists()
+        )
+        if self.pk is None and not self.order_number:
+            # Allocated only for new orders, never for instances that are just built
+            self.order_number = generate_order_number()
+
+        with transaction.atomic():
+            super(Order, self).save()
+            if self.is_paid and not was_paid:
+                send_after_commit("order_paid", self.pk)
 
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
@@ -714,17 +1117,9 @@ class Order(ClusterableModel):
     def invoice(self):
         return self.invoice_set.first()
 
-    @property
-    def total_weight_kg(self):
-        return sum(self.items.values_list("product__weight_kg", flat=True))
-
     def update_gopay_payment(self):
         pass
 
-    def update_payment_status(self):
-        self.paid = is_gopay_payment_paid(self.gopay_payment_id)
-        self.save()
-
     def get_admin_url(self):
         content_type = ContentType.objects.get_for_model(self.__class__)
         return reverse(
@@ -744,6 +1139,20 @@ class Order(ClusterableModel):
         verbose_name_plural = _("Orders")
 
 
+class OrderNumberCounter(models.Model):
+    """Last order number handed out in a month, see shop.utils.generate_order_number()."""
+
+    period = models.CharField(_("Period (YYMM)"), max_length=4, primary_key=True)
+    last_value = models.PositiveIntegerField(_("Last Value"), default=0)
+
+    def __str__(self):
+        return f"{self.period}: {self.last_value}"
+
+    class Meta:
+        verbose_name = _("Order Number Counter")
+        verbose_name_plural = _("Order Number Counters")
+
+
 class OrderItem(models.Model):
     quantity = models.IntegerField(_("Quantity"))
     total_price = MoneyField(
@@ -772,22 +1181,12 @@ class OrderItem(models.Model):
 
     def save(self, *args, **kwargs):
         if self.pk is not None:
-            current_obj = OrderItem.objects.get(pk=self.pk)
+            current_obj = OrderItem.objects.select_related("product").get(pk=self.pk)
             current_quantity = current_obj.quantity
+            current_total = current_obj.total_price.amount if current_obj.total_price else 0
+            current_weight = current_obj.product.weight_kg * current_quantity
         else:
-            current_quantity = 0
-
-        if current_quantity != self.quantity and self.product_variant:
-            quantity_delta = current_quantity - self.quantity
-            self.product_variant.pcs_in_stock += quantity_delta
-            try:
-                # Preventing TransactionManagementError: You can't execute queries until the end of the 'atomic' block
-                with transaction.atomic():
-                    self.product_variant.save()
-            except IntegrityError:
-                self.quantity += self.product_variant.pcs_in_stock
-                self.product_variant.pcs_in_stock = 0
-                self.product_variant.save()
+            current_quantity = current_total = current_weight = 0
 
         self.total_price = Money(
             self.product.price.amount * self.quantity,
@@ -796,6 +1195,30 @@ class OrderItem(models.Model):
 
         super(OrderItem, self).save(*args, **kwargs)
 
+        Order.add_to_aggregates(
+            self.order_id,
+            total_price=self.total_price.amount - current_total,
+            weight_kg=self.product.weight_kg * self.quantity - current_weight,
+            item_count=self.quantity - current_quantity,
+        )
+
+        if (
+            current_quantity != self.quantity
+            and self.product_variant
+            and self.product_variant.pcs_in_stock is not None
+        ):
+            from shop.inventory import record_movement
+
+            quantity_delta = current_quantity - self.quantity
+            record_movement(
+                self.product_variant,
+                quantity_delta,
+                InventoryMovement.Reasons.ORDER
+                if quantity_delta < 0
+                else InventoryMovement.Reasons.CANCELLATION,
+                order_id=self.order_id,
+            )
+
     def __str__(self):
         return self.product.name
 
@@ -804,9 +1227,31 @@ class OrderItem(models.Model):
         verbose_name_plural = _("Order Items")
 
 
-@receiver(post_save, sender=OrderItem)
-def order_item_post_save(sender, instance, **kwargs):
-    instance.order.update_total_price()
+@receiver(post_delete, sender=OrderItem)
+def order_item_post_delete(sender, instance, origin=None, **kwargs):
+    """
+    Items removed from an order are subtracted from the order aggregates
+    and their pieces go back to stock, unless the whole order is deleted.
+    """
+    if isinstance(origin, Order):
+        return
+
+    Order.add_to_aggregates(
+        instance.order_id,
+        total_price=-instance.total_price.amount if instance.total_price else 0,
+        weight_kg=-instance.product.weight_kg * instance.quantity,
+        item_count=-instance.quantity,
+    )
+
+    if instance.product_variant and instance.product_variant.pcs_in_stock is not None:
+        from shop.inventory import record_movement
+
+        record_movement(
+            instance.product_variant,
+            instance.quantity,
+            InventoryMovement.Reasons.CANCELLATION,
+            order_id=instance.order_id,
+        )
 
 
 class Invoice(models.Model):
@@ -5,6 +5,9 @@ from shop.api.packeta_api import Packeta
 
 
 class Packet(models.Model):
+    # Delivered, returned to the sender and cancelled packets aren't tracked anymore
+    FINAL_STATUS_CODES = (7, 10, 11)
+
     packet_id = models.CharField(_("Packet ID"), max_length=25)
     barcode = models.CharField(_("Barcode"), max_length=25)
     barcode_text = models.CharField(
@@ -28,6 +31,13 @@ class Packet(models.Model):
         default="",
     )
 
+    check_attempts = models.PositiveIntegerField(
+        _("Status Check Attempts"), default=0, editable=False
+    )
+    next_check_at = models.DateTimeField(
+        _("Next Status Check"), blank=True, null=True, editable=False, db_index=True
+    )
+
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
@@ -41,3 +51,50 @@ class Packet(models.Model):
     class Meta:
         verbose_name = _("Packet")
         verbose_name_plural = _("Packets")
+
+
+class PacketaPoint(models.Model):
+    """
+    Local copy of a Packeta pick-up point, imported from the Packeta branch feed
+    with the import_packeta_points command. For lookups see `shop/packeta_points.py`.
+    """
+
+    id = models.PositiveIntegerField(_("Point ID"), primary_key=True)
+    name = models.CharField(_("Name"), max_length=255)
+    street = models.CharField(_("Street"), max_length=255, blank=True, default="")
+    city = models.CharField(_("City"), max_length=128, blank=True, default="")
+    zip_code = models.CharField(
+        _("ZIP Code"), max_length=16, help_text=_("Without spaces.")
+    )
+    country = models.CharField(_("Country"), max_length=2)
+    latitude = models.FloatField(_("Latitude"))
+    longitude = models.FloatField(_("Longitude"))
+
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "street": self.street,
+            "city": self.city,
+            "zip": self.zip_code,
+            "country": self.country,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+        }
+
+    class Meta:
+        verbose_name = _("Packeta Point")
+        verbose_name_plural = _("Packeta Points")
+        indexes = [
+            # varchar_pattern_ops serves the LIKE 'prefix%' of ZIP code lookups
+            models.Index(
+                fields=["zip_code"],
+                name="packeta_point_zip_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
@@ -1,12 +1,57 @@
+from functools import wraps
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from django.db import close_old_connections
 
-from shop import gopay_api
+from shop import gopay_api, gopay_statement, inventory, packeta_tracking, utils
 
 
-def start():
+def with_fresh_connection(job):
+    """Jobs run in long-lived scheduler threads, their database connections are recycled like requests'."""
+
+    @wraps(job)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return job(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return run
+
+
+def schedule_jobs(scheduler):
     """
-    The Order status updater calls the update_gopay_orders function every 5 minutes to keep the orders up-to-date.
+    The Order status updater polls states of pending GoPay payments every minute to keep the orders up-to-date
+    and reconciles them with the GoPay account statement once a day.
+    Abandoned carts are cleaned up once a day, expired stock reservations every minute
+    and the inventory ledger is compacted every 5 minutes. Packets on their way are tracked every 5 minutes.
+
+    Run by `manage.py run_scheduler`, the scheduler process of the Procfile.
     """
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(gopay_api.update_gopay_orders, 'interval', minutes=1)
+    jobs = [
+        (gopay_api.poll_gopay_payments, {"minutes": 1}),
+        (gopay_statement.reconcile_recent_statement, {"days": 1}),
+        (utils.delete_abandoned_carts, {"days": 1}),
+        (inventory.release_expired_reservations, {"minutes": 1}),
+        (inventory.compact_inventory, {"minutes": 5}),
+        (packeta_tracking.track_packets, {"minutes": 5}),
+    ]
+    for job, interval in jobs:
+        # A run that is late or still running is not repeated, the next one catches up
+        scheduler.add_job(
+            with_fresh_connection(job),
+            'interval',
+            id=job.__name__,
+            coalesce=True,
+            max_instances=1,
+            **interval,
+        )
+    return scheduler
+
+
+def start():
+    """Runs the jobs in a background thread of the current process, see schedule_jobs()."""
+    scheduler = schedule_jobs(BackgroundScheduler())
     scheduler.start()
+    return scheduler
@@ -0,0 +1,40 @@
+import hashlib
+import logging
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from shop.api.packeta_api import Packeta
+
+logger = logging.getLogger("django")
+
+LABELS_DIRECTORY = "packeta/labels"
+
+
+def packet_labels_name(packet_ids) -> str:
+    """Storage name of the labels PDF of a set of packets, the same for any order of the IDs."""
+    digest = hashlib.sha256(",".join(sorted(packet_ids)).encode("utf-8")).hexdigest()
+    return f"{LABELS_DIRECTORY}/{digest}.pdf"
+
+
+def get_packet_labels(packet_ids) -> str:
+    """
+    Returns the storage name of the labels PDF of the packets.
+
+    The PDF is downloaded only once per set of packets. It's decoded into a temporary
+    file while it's being downloaded and uploaded to the default storage from there,
+    so it's never held in memory.
+    """
+    packet_ids = sorted({str(packet_id) for packet_id in packet_ids})
+    name = packet_labels_name(packet_ids)
+    if default_storage.exists(name):
+        return name
+
+    with tempfile.TemporaryFile() as pdf:
+        Packeta().write_packet_labels_pdf(packet_ids, pdf)
+        pdf.seek(0)
+        name = default_storage.save(name, File(pdf))
+
+    logger.info(f"Labels of {len(packet_ids)} packets saved to {name}.")
+    return name
@@ -0,0 +1,246 @@
+"""
+Local catalogue of Packeta pick-up points.
+
+Points are imported from the Packeta branch feed (JSON or XML) into PacketaPoint.
+Nearest points are looked up in a k-d tree of the points' positions on the unit sphere
+that every process builds from the table and rebuilds after settings.PACKETA_POINTS_INDEX_TTL
+seconds, so lookups don't query the database except for loading the found points.
+"""
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+from xml.etree.ElementTree import iterparse
+
+from django.conf import settings
+
+from shop.models import PacketaPoint
+
+logger = logging.getLogger("django")
+
+EARTH_RADIUS_KM = 6371.0088
+IMPORT_BATCH_SIZE = 1000
+
+
+def normalize_zip_code(zip_code) -> str:
+    return "".join(str(zip_code or "").split()).upper()
+
+
+def _point_from_branch(branch: dict):
+    """Returns an unsaved PacketaPoint of a feed branch or None if it can't be used."""
+    try:
+        return PacketaPoint(
+            id=int(branch["id"]),
+            name=str(branch["name"])[:255],
+            street=str(branch.get("street") or "")[:255],
+            city=str(branch.get("city") or "")[:128],
+            zip_code=normalize_zip_code(branch.get("zip"))[:16],
+            country=str(branch.get("country") or "")[:2].upper(),
+            latitude=float(branch["latitude"]),
+            longitude=float(branch["longitude"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def read_branch_feed(path):
+    """
+    Yields branches of a Packeta branch feed file as dicts.
+
+    JSON feeds have the branches in "data" (a list or a dict by ID), XML feeds
+    in <branch> elements, which are parsed incrementally.
+    """
+    if str(path).lower().endswith(".json"):
+        with open(path, encoding="utf-8") as feed:
+            data = json.load(feed)
+        if isinstance(data, dict):
+            data = data.get("data", data)
+        yield from data.values() if isinstance(data, dict) else data
+        return
+
+    for _event, element in iterparse(path):
+        if element.tag == "branch":
+            yield {child.tag: (child.text or "").strip() for child in element}
+            element.clear()
+
+
+def import_packeta_points(branches) -> dict:
+    """
+    Replaces the catalogue with the branches, upserting them in batches
+    and deleting points that are no longer in the feed.
+
+    :return: Dict with numbers of imported, skipped and deleted points.
+    """
+    imported, skipped = set(), 0
+    batch = []
+
+    def flush():
+        PacketaPoint.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=[
+                "name",
+                "street",
+                "city",
+                "zip_code",
+                "country",
+                "latitude",
+                "longitude",
+                "updated_at",
+            ],
+        )
+        batch.clear()
+
+    for branch in branches:
+        point = _point_from_branch(branch)
+        if point is None or point.id in imported:
+            skipped += 1
+            continue
+        imported.add(point.id)
+        batch.append(point)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    deleted = 0
+    if imported:
+        deleted, _deleted_per_model = PacketaPoint.objects.exclude(
+            pk__in=imported
+        ).delete()
+
+    stats = {"imported": len(imported), "skipped": skipped, "deleted": deleted}
+    logger.info(f"Packeta points imported: {stats}")
+    return stats
+
+
+def _to_unit_vector(latitude, longitude):
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+class PointIndex:
+    """
+    K-d tree of points on the unit sphere. The straight-line (chord) distance of two
+    unit vectors grows with their great-circle distance, so the nearest points by chord
+    are the nearest points on the Earth.
+    """
+
+    def __init__(self, points):
+        """:param points: Iterable of (pk, latitude, longitude)."""
+        self.size = 0
+        self.root = self._build(
+            [(_to_unit_vector(lat, lng), pk) for pk, lat, lng in points], 0
+        )
+
+    def _build(self, points, axis):
+        if not points:
+            return None
+
+        self.size += 1
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        next_axis = (axis + 1) % 3
+        return (
+            points[median][0],
+            points[median][1],
+            axis,
+            self._build(points[:median], next_axis),
+            self._build(points[median + 1:], next_axis),
+        )
+
+    def nearest(self, latitude, longitude, count):
+        """Returns [(pk, distance in km)] of the count nearest points, nearest first."""
+        target = _to_unit_vector(latitude, longitude)
+        heap = []  # (-squared chord distance, pk) of the best points found so far
+
+        def search(node):
+            if node is None:
+                return
+            vector, pk, axis, lower, higher = node
+            distance = sum((a - b) ** 2 for a, b in zip(vector, target))
+            if len(heap) < count:
+                heapq.heappush(heap, (-distance, pk))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, pk))
+
+            difference = target[axis] - vector[axis]
+            near, far = (lower, higher) if difference < 0 else (higher, lower)
+            search(near)
+            if len(heap) < count or difference**2 < -heap[0][0]:
+                search(far)
+
+        if count > 0:
+            search(self.root)
+        return [
+            (pk, round(2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(-distance) / 2, 1)), 3))
+            for distance, pk in sorted(heap, reverse=True)
+        ]
+
+
+_index = None
+_index_built_at = None
+_index_lock = threading.Lock()
+
+
+def get_point_index() -> PointIndex:
+    """Returns the process-wide PointIndex, rebuilt after settings.PACKETA_POINTS_INDEX_TTL seconds."""
+    global _index, _index_built_at
+    with _index_lock:
+        if (
+            _index is None
+            or time.monotonic() - _index_built_at > settings.PACKETA_POINTS_INDEX_TTL
+        ):
+            _index = PointIndex(
+                PacketaPoint.objects.values_list("pk", "latitude", "longitude").iterator()
+            )
+            _index_built_at = time.monotonic()
+        return _index
+
+
+def nearest_points(latitude, longitude, count):
+    """Returns the count nearest PacketaPoints with `distance_km` set, nearest first."""
+    found = get_point_index().nearest(latitude, longitude, count)
+    points = PacketaPoint.objects.in_bulk([pk for pk, _distance in found])
+    nearest = []
+    for pk, distance in found:
+        if pk in points:  # Deleted since the index was built
+            points[pk].distance_km = distance
+            nearest.append(points[pk])
+    return nearest
+
+
+def points_by_zip_code(zip_code, count):
+    """Returns at most count PacketaPoints whose ZIP code starts with zip_code."""
+    zip_code = normalize_zip_code(zip_code)
+    if not zip_code:
+        return []
+    return list(
+        PacketaPoint.objects.filter(zip_code__startswith=zip_code).order_by(
+            "zip_code", "name"
+        )[:count]
+    )
+
+
+def get_valid_point(point_id):
+    """
+    Returns the PacketaPoint of a submitted point ID or None if there is no such point.
+    While the catalogue is empty (not imported yet) points can't be validated,
+    a placeholder with the ID is returned for any ID then.
+    """
+    try:
+        point_id = int(point_id)
+    except (TypeError, ValueError):
+        return None
+
+    point = PacketaPoint.objects.filter(pk=point_id).first()
+    if point is None and not PacketaPoint.objects.exists():
+        return PacketaPoint(id=point_id, name="")
+    return point
@@ -0,0 +1,84 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from shop.api.packeta_api import Packeta
+from shop.utils import backoff_delay, fetch_concurrently
+
+logger = logging.getLogger("django")
+
+
+def track_packets(fetch=None, max_workers=None) -> dict:
+    """
+    Refreshes statuses of Packets that aren't delivered, returned or cancelled yet.
+
+    Only packets created in the last settings.PACKETA_TRACKING_DAYS days that are due
+    are checked. Statuses are fetched concurrently, at most max_workers at a time, and
+    packets without a change are checked again later with an exponential backoff.
+    All packets are saved with one bulk update.
+
+    :param fetch: Function returning (status code, code text, status text) for a packet ID,
+        defaults to Packeta.get_packet_status.
+    :param max_workers: Concurrent requests limit, defaults to settings.PACKETA_TRACKING_CONCURRENCY.
+    :return: Dict with numbers of checked, changed and failed packets and the duration in seconds.
+    """
+    from shop.models import Packet
+
+    started_at = time.monotonic()
+    now = timezone.now()
+    packets = list(
+        Packet.objects.filter(
+            created_at__gt=now - timedelta(days=settings.PACKETA_TRACKING_DAYS)
+        )
+        .exclude(status_code__in=Packet.FINAL_STATUS_CODES)
+        .exclude(next_check_at__gt=now)
+    )
+    statuses = fetch_concurrently(
+        fetch or Packeta().get_packet_status,
+        [packet.packet_id for packet in packets],
+        max_workers or settings.PACKETA_TRACKING_CONCURRENCY,
+    )
+
+    changed, failed = 0, 0
+    for packet in packets:
+        status = statuses[packet.packet_id]
+        if isinstance(status, Exception) or status[0] is None:
+            logger.warning(f"Packet {packet.packet_id} status check failed: {status}")
+            failed += 1
+        elif (packet.status_code, packet.status_name, packet.status_display_name) != status:
+            packet.status_code, packet.status_name, packet.status_display_name = status
+            packet.check_attempts = 0
+            changed += 1
+
+        packet.next_check_at = now + backoff_delay(
+            packet.check_attempts,
+            settings.PACKETA_TRACKING_BACKOFF,
+            settings.PACKETA_TRACKING_MAX_BACKOFF,
+        )
+        packet.check_attempts += 1
+        packet.updated_at = now
+
+    Packet.objects.bulk_update(
+        packets,
+        [
+            "status_code",
+            "status_name",
+            "status_display_name",
+            "check_attempts",
+            "next_check_at",
+            "updated_at",
+        ],
+        batch_size=500,
+    )
+
+    stats = {
+        "checked": len(packets),
+        "changed": changed,
+        "failed": failed,
+        "duration": round(time.monotonic() - started_at, 3),
+    }
+    logger.info(f"Packets tracked: {stats}")
+    return stats
@@ -0,0 +1,35 @@
+"""
+Order lifecycle signals.
+
+Every signal is sent once per transition of an order, after the transition is
+committed. The transition enqueues an outbox job in its own transaction and the
+outbox worker sends the signal with the order already loaded: addresses, billing
+type and items with their products and variants. Receivers get the order as the
+`order` keyword argument:
+
+    @receiver(checkout_completed)
+    def send_order_to_warehouse(sender, order, **kwargs):
+        for item in order.items.all():
+            ...
+
+A failing receiver makes the outbox retry the job, so receivers should be idempotent.
+"""
+from django.dispatch import Signal
+
+from core import outbox
+
+# Sent when a customer places an order
+checkout_completed = Signal()
+
+# Sent when an order becomes paid
+order_paid = Signal()
+
+SIGNALS = {
+    "checkout_completed": checkout_completed,
+    "order_paid": order_paid,
+}
+
+
+def send_after_commit(signal_name: str, order_id: int):
+    """Schedules sending of the signal, call it inside the transaction making the transition."""
+    outbox.enqueue("shop.send_order_signal", signal_name=signal_name, order_id=order_id)
@@ -0,0 +1,44 @@
+from core import outbox
+from shop.api.packeta_api import Packeta
+from shop.gopay_api import get_gopay_payment_details
+from shop.models import GopayPayment, Order
+from shop.signals import SIGNALS
+
+
+@outbox.task("shop.create_packet")
+def create_packet(order_id):
+    order = Order.objects.select_related("shipping_address").get(pk=order_id)
+    if order.packet_id:  # Already created from the admin
+        return
+    Packeta().create_packet_from_order(order)
+
+
+@outbox.task("shop.send_order_signal")
+def send_order_signal(signal_name, order_id):
+    order = (
+        Order.objects.select_related(
+            "billing_address", "shipping_address", "billing_type", "created_by"
+        )
+        .prefetch_related("items__product", "items__product_variant")
+        .get(pk=order_id)
+    )
+    SIGNALS[signal_name].send(sender=Order, order=order)
+
+
+@outbox.task("shop.apply_gopay_notification")
+def apply_gopay_notification(payment_id):
+    """
+    Fetches the payment state once for all notifications coalesced into the job.
+
+    The state is fetched only after the payment is locked, so a state fetched earlier
+    by another worker or the poll can't be saved over it afterwards.
+    """
+    GopayPayment.objects.bulk_create(
+        [GopayPayment(payment_id=payment_id, payment_data={})], ignore_conflicts=True
+    )
+    # Locked, so the payment callback and other workers wait for this update
+    payment = GopayPayment.objects.select_for_update().get(payment_id=payment_id)
+    payment_details = get_gopay_payment_details(payment_id)
+    payment.payment_status = payment_details["state"]
+    payment.payment_data = payment_details
+    payment.save()
@@ -1,3 +1,678 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import DatabaseError, connection, transaction
+from django.forms import modelform_factory
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from djmoney.money import Money
+
+from core.templatetags.storengine import with_availability
+from shop.api import packeta_transport
+from shop.cart import SESSION_HOLDER_KEY, SessionCart, load_cart_lines
+from shop.checkout import OutOfStockError, decrement_stock
+from shop.forms import AddressAdminForm
+from shop import gopay_api
+from shop.gopay_api import GopayClient, poll_gopay_payments
+from shop.gopay_statement import reconcile_statement
+from shop.inventory import (
+    adjust_stock,
+    compact_inventory,
+    record_movement,
+    reserve_stock,
+    stock_levels,
+)
+from shop.models import (
+    BillingAddress,
+    Cart,
+    CartItem,
+    GopayPayment,
+    InventoryMovement,
+    Order,
+    OrderItem,
+    Packet,
+    Product,
+    ProductVariant,
+    StockReservation,
+)
+from shop.packeta_tracking import track_packets
+from shop.tasks import apply_gopay_notification
+from shop.utils import reconcile_order_aggregates
+from shop.views import PaymentStatusCheckView
+from shop.wagtail_hooks import BillingAddressAdmin
+from users.models import ShopUser
+from users.views import set_session_cart
+
+
+class FakeServer:
+    """
+    HTTP server on localhost answering requests with respond(method, path, body),
+    which returns (status, body). Requests are recorded as (method, path, body).
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def __enter__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                server.requests.append((self.command, self.path, body))
+                status, content = server.respond(self.command, self.path, body)
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ShopTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="T-Shirt", price=Money(250, "CZK"), weight_kg=0.2
+        )
+        self.variant = ProductVariant.objects.create(
+            product=self.product, name="M", pcs_in_stock=3
+        )
+
+    def create_order(self, **kwargs):
+        return Order.objects.create(total_price=Money(0, "CZK"), **kwargs)
+
+
+class InventoryLedgerTests(ShopTestCase):
+    def test_stock_is_adjusted_by_movements(self):
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 3})
+
+        adjust_stock(self.variant, 2, "Restock")
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.pcs_in_stock, 5)
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 5})
+        self.assertEqual(
+            self.variant.movements.filter(
+                reason=InventoryMovement.Reasons.ADJUSTMENT
+            ).count(),
+            2,
+        )
+
+    def test_adjusting_untracked_variant_tracks_it(self):
+        variant = ProductVariant.objects.create(product=self.product, name="L")
+
+        adjust_stock(variant, 4)
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.pcs_in_stock, 4)
+
+    def test_resaving_stale_variant_keeps_stock(self):
+        stale = ProductVariant.objects.get(pk=self.variant.pk)
+        decrement_stock(self.create_order(), {self.variant.pk: 1})
+        with self.settings(INVENTORY_COMPACTION_DELAY=-60):
+            compact_inventory()
+
+        stale.name = "Medium"
+        stale.save()
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.name, "Medium")
+        self.assertEqual(self.variant.pcs_in_stock, 2)
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 2})
+
+    def test_order_within_stock_is_recorded(self):
+        order = self.create_order()
+
+        decrement_stock(order, {self.variant.pk: 3})
+
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 0})
+        self.assertTrue(
+            InventoryMovement.objects.filter(
+                order=order, variant=self.variant, quantity=-3
+            ).exists()
+        )
+
+    def test_oversell_is_rejected(self):
+        with self.assertRaises(OutOfStockError):
+            decrement_stock(self.create_order(), {self.variant.pk: 4})
+
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 3})
+
+    def test_pieces_held_by_other_carts_are_not_sold(self):
+        reserve_stock("cart:other", {self.variant.pk: 2})
+
+        with self.assertRaises(OutOfStockError):
+            decrement_stock(self.create_order(), {self.variant.pk: 2}, "cart:mine")
+        decrement_stock(self.create_order(), {self.variant.pk: 2}, "cart:other")
+
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 1})
+
+    def test_compaction_keeps_stock(self):
+        decrement_stock(self.create_order(), {self.variant.pk: 1})
+
+        with self.settings(INVENTORY_COMPACTION_DELAY=-60):
+            compact_inventory()
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.inventory_snapshot.quantity, 2)
+        self.assertEqual(self.variant.pcs_in_stock, 2)
+        self.assertEqual(stock_levels([self.variant.pk]), {self.variant.pk: 2})
+
+
+
+class StockReservationTests(ShopTestCase):
+    def test_holds_are_capped_at_available_pieces(self):
+        reserve_stock("cart:greedy", {self.variant.pk: 50})
+
+        self.assertEqual(self.variant.reservations.get().quantity, 3)
+
+    def test_add_counts_pieces_already_in_the_cart(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        for cart in (Cart.objects.create(), SessionCart(session)):
+            with self.subTest(cart=cart):
+                self.assertTrue(cart.add(self.product, self.variant, 2))
+                self.assertFalse(cart.add(self.product, self.variant, 2))
+                self.assertTrue(cart.add(self.product, self.variant, 1))
+                self.assertEqual(
+                    cart.line_amounts(), {(self.product.pk, self.variant.pk): 3}
+                )
+                cart.clear()
+
+    def test_batch_additions_are_summed_per_variant(self):
+        operation = {"item": self.product.pk, "variant": self.variant.pk, "amount": 2}
+
+        lines, rejected = load_cart_lines([operation, operation])
+        self.assertEqual((len(lines), rejected), (1, 1))
+
+        line_amounts = {(self.product.pk, self.variant.pk): 2}
+        lines, rejected = load_cart_lines([operation], line_amounts=line_amounts)
+        self.assertEqual((len(lines), rejected), (0, 1))
+
+        lines, rejected = load_cart_lines(
+            [{**operation, "amount": -1}, operation], line_amounts=line_amounts
+        )
+        self.assertEqual((len(lines), rejected), (2, 0))
+
+    def test_listings_show_availability_to_the_visitor_without_queries(self):
+        ProductVariant.objects.create(product=self.product, name="L")  # Not tracked
+        holding, other = RequestFactory().get("/"), RequestFactory().get("/")
+        for request in (holding, other):
+            request.user = AnonymousUser()
+            request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        self.assertTrue(
+            SessionCart(holding.session).add(self.product, self.variant, 3)
+        )
+
+        for request, available in ((holding, True), (other, False)):
+            with self.subTest(available=available):
+                product = with_availability(Product.objects.all(), request)[0]
+                with self.assertNumQueries(0):
+                    self.assertEqual(product.available(), available)
+                    self.assertEqual(
+                        {
+                            variant.name: variant.available()
+                            for variant in product.variants.all()
+                        },
+                        {"M": available, "L": False},
+                    )
+
+class InventoryCompactionConcurrencyTests(TransactionTestCase):
+    # Restores the default Wagtail locale that the flush after each test deletes
+    serialized_rollback = True
+
+    def test_movements_committed_after_compaction_are_kept(self):
+        product = Product.objects.create(name="Mug", price=Money(100, "CZK"))
+        variant = ProductVariant.objects.create(
+            product=product, name="White", pcs_in_stock=3
+        )
+        inserted, compacted = threading.Event(), threading.Event()
+
+        def checkout_committing_late():
+            try:
+                with transaction.atomic():
+                    record_movement(variant, -1, InventoryMovement.Reasons.ORDER)
+                    inserted.set()
+                    compacted.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=checkout_committing_late)
+        thread.start()
+        inserted.wait(10)
+        # Gets a higher ID than the uncommitted movement
+        record_movement(variant, 2, InventoryMovement.Reasons.ADJUSTMENT)
+        with self.settings(INVENTORY_COMPACTION_DELAY=-60):
+            compact_inventory()
+        compacted.set()
+        thread.join()
+
+        self.assertEqual(stock_levels([variant.pk]), {variant.pk: 4})
+        with self.settings(INVENTORY_COMPACTION_DELAY=-60):
+            compact_inventory()
+        variant.refresh_from_db()
+        self.assertEqual(variant.pcs_in_stock, 4)
+        self.assertEqual(stock_levels([variant.pk]), {variant.pk: 4})
+
+
+class CartMergeTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = ShopUser.objects.create_user(email="customer@example.com", password="foo")
+
+    def test_carts_are_merged_into_the_oldest_one(self):
+        user_cart = Cart.objects.create(created_by=self.user)
+        CartItem.objects.create(
+            cart=user_cart, product=self.product, product_variant=self.variant, amount=1
+        )
+        guest_cart = Cart.objects.create()
+        CartItem.objects.create(
+            cart=guest_cart, product=self.product, product_variant=self.variant, amount=2
+        )
+
+        merged = Cart.merge_user_carts(self.user, guest_cart_pk=guest_cart.pk)
+
+        self.assertEqual(merged, user_cart)
+        self.assertFalse(Cart.objects.filter(pk=guest_cart.pk).exists())
+        line = merged.cartitem_set.get()
+        self.assertEqual(line.amount, 3)
+        self.assertEqual(line.price, Money(750, "CZK"))
+
+    def test_session_lines_of_deleted_variants_are_skipped(self):
+        deleted_variant = ProductVariant.objects.create(
+            product=self.product, name="L", pcs_in_stock=1
+        )
+        deleted_pk = deleted_variant.pk
+        deleted_variant.delete()
+
+        merged = Cart.merge_user_carts(
+            self.user,
+            session_lines={
+                (self.product.pk, self.variant.pk): 2,
+                (self.product.pk, deleted_pk): 1,
+            },
+        )
+
+        self.assertEqual(
+            list(merged.cartitem_set.values_list("product_variant", "amount")),
+            [(self.variant.pk, 2)],
+        )
+        self.assertEqual(self.variant.reservations.get().quantity, 2)
+
+
+    def test_session_holds_move_to_the_merged_cart(self):
+        request = RequestFactory().get("/")
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session_cart = SessionCart(request.session)
+        self.assertTrue(session_cart.add(self.product, self.variant, 3))
+
+        set_session_cart(request, self.user)
+
+        cart = Cart.objects.get(pk=request.session["cart"])
+        self.assertEqual(
+            list(StockReservation.objects.values_list("holder", "quantity")),
+            [(cart.reservation_holder, 3)],
+        )
+
+
+class SessionCartTests(ShopTestCase):
+    def test_lines_are_kept_in_the_shared_cache(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+
+        self.assertTrue(SessionCart(session).add(self.product, self.variant, 2))
+
+        self.assertEqual(list(session.keys()), [SESSION_HOLDER_KEY])
+        cart = SessionCart(session)
+        self.assertEqual(cart.line_amounts(), {(self.product.pk, self.variant.pk): 2})
+        self.assertEqual(cart.summary().total_price, Money(500, "CZK"))
+
+        cart.clear()
+        self.assertEqual(SessionCart(session).line_amounts(), {})
+        self.assertFalse(StockReservation.objects.exists())
+
+class AddressAdminFormTests(TestCase):
+    address = {
+        "first_name": "Jan",
+        "last_name": "Novák",
+        "email": "jan@example.com",
+        "phone": "+420777123456",
+        "address1": "Dlouhá 1",
+        "zip_code": "11000",
+        "city": "Praha",
+        "country": "CZ",
+    }
+
+    def test_duplicate_address_is_a_form_error(self):
+        existing = BillingAddress.objects.create(**self.address)
+        other = BillingAddress.objects.create(**{**self.address, "city": "Brno"})
+        form_classes = [
+            modelform_factory(
+                BillingAddress, form=AddressAdminForm, fields=list(self.address)
+            ),
+            BillingAddressAdmin()
+            .get_edit_handler()
+            .bind_to_model(BillingAddress)
+            .get_form_class(),
+        ]
+
+        for form_class in form_classes:
+            form = form_class(
+                data={**self.address, "city": " praha "}, instance=other
+            )
+            self.assertFalse(form.is_valid())
+            self.assertIn("The same address already exists.", form.non_field_errors())
+
+            form = form_class(data=self.address, instance=existing)
+            self.assertTrue(form.is_valid(), form.errors)
+
+
+class OrderNumberTests(ShopTestCase):
+    def test_numbers_are_allocated_on_insert_only(self):
+        unsaved = Order(total_price=Money(0, "CZK"))
+        self.assertEqual(unsaved.order_number, "")
+
+        first, second = self.create_order(), self.create_order()
+        self.assertEqual(int(second.order_number[-5:]), int(first.order_number[-5:]) + 1)
+
+        number = first.order_number
+        first.save()
+        self.assertEqual(first.order_number, number)
+        self.assertEqual(self.create_order(order_number="X1").order_number, "X1")
+
+
+class OrderAggregatesTests(ShopTestCase):
+    def test_item_changes_update_aggregates(self):
+        order = self.create_order()
+
+        item = OrderItem.objects.create(
+            order=order, product=self.product, product_variant=self.variant, quantity=2
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Money(500, "CZK"))
+        self.assertAlmostEqual(order.total_weight_kg, 0.4)
+        self.assertEqual(order.item_count, 2)
+
+        item.quantity = 3
+        item.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Money(750, "CZK"))
+        self.assertEqual(order.item_count, 3)
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Money(0, "CZK"))
+        self.assertAlmostEqual(order.total_weight_kg, 0)
+        self.assertEqual(order.item_count, 0)
+        self.assertEqual(reconcile_order_aggregates(), [])
+
+    def test_reconcile_fixes_wrong_aggregates(self):
+        order = self.create_order()
+        OrderItem.objects.create(order=order, product=self.product, quantity=1)
+        Order.objects.filter(pk=order.pk).update(item_count=7)
+
+        self.assertEqual(reconcile_order_aggregates(fix=True), [order.order_number])
+
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 1)
+        self.assertEqual(reconcile_order_aggregates(), [])
+
+
+class GopayStatementTests(ShopTestCase):
+    def test_incoming_payments_mark_orders_paid(self):
+        paid = self.create_order(order_number="261000001")
+        underpaid = self.create_order(order_number="261000002")
+        refunded = self.create_order(order_number="261000003")
+        Order.objects.filter(pk=paid.pk).update(total_price=1290)
+        Order.objects.filter(pk=underpaid.pk).update(total_price=500)
+
+        fixture = Path(__file__).parent / "fixtures" / "gopay_statement.csv"
+        with open(fixture, encoding="utf-8") as statement:
+            stats = reconcile_statement(statement)
+
+        paid.refresh_from_db()
+        underpaid.refresh_from_db()
+        refunded.refresh_from_db()
+        self.assertTrue(paid.is_paid)
+        self.assertFalse(underpaid.is_paid)
+        self.assertFalse(refunded.is_paid)
+        self.assertEqual(stats["orders"], 1)
+
+    def test_payments_in_another_currency_are_ignored(self):
+        order = self.create_order(order_number="261000001")
+        Order.objects.filter(pk=order.pk).update(total_price=50)
+
+        reconcile_statement(
+            [
+                "Payment ID;Order number;Amount;Currency",
+                "3201451123;261000001;50,00;EUR",
+            ]
+        )
+        order.refresh_from_db()
+        self.assertFalse(order.is_paid)
+
+        reconcile_statement(
+            ["Payment ID;Order number;Amount", "3201451123;261000001;50,00"], "CZK"
+        )
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+
+
+class GopayClientTests(SimpleTestCase):
+    def test_api_url_is_normalized(self):
+        for gateway_url in (
+            "https://gw.sandbox.gopay.com",
+            "https://gw.sandbox.gopay.com/",
+            "https://gw.sandbox.gopay.com/api",
+            "https://gw.sandbox.gopay.com/api/",
+        ):
+            client = GopayClient(gateway_url, 1, "client", "secret", timeout=1)
+            self.assertEqual(client.api_url, "https://gw.sandbox.gopay.com/api")
+
+
+class GopayPollTests(ShopTestCase):
+    STATES = {"3201451001": "PAID", "3201451002": "CREATED"}
+
+    def respond(self, method, path, body):
+        if path == "/api/oauth2/token":
+            token = {"access_token": "token", "expires_in": 1800}
+            return 200, json.dumps(token).encode()
+        payment_id = path.rsplit("/", 1)[-1]
+        if payment_id not in self.STATES:
+            return 500, b'{"errors": []}'
+        payment = {"id": payment_id, "state": self.STATES[payment_id]}
+        return 200, json.dumps(payment).encode()
+
+    def test_pending_payments_are_polled(self):
+        payments = {
+            payment_id: GopayPayment.objects.create(
+                payment_id=payment_id, payment_status="CREATED", payment_data={}
+            )
+            for payment_id in ("3201451001", "3201451002", "3201451003")
+        }
+        order = self.create_order(gopay_payment=payments["3201451001"])
+
+        with FakeServer(self.respond) as server, mock.patch.object(
+            gopay_api, "_client", None
+        ), self.settings(
+            GOPAY_URL=server.url,
+            GOPAY_GOID=1,
+            GOPAY_CLIENT_ID="client",
+            GOPAY_CLIENT_SECRET="secret",
+        ):
+            stats = poll_gopay_payments()
+
+        self.assertEqual(
+            (stats["checked"], stats["changed"], stats["failed"]), (3, 1, 1)
+        )
+        # The token is requested once and reused by all the checks
+        paths = [path for _method, path, _body in server.requests]
+        self.assertEqual(paths.count("/api/oauth2/token"), 1)
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+        for payment in payments.values():
+            payment.refresh_from_db()
+        self.assertTrue(payments["3201451001"].is_paid)
+        self.assertEqual(payments["3201451002"].payment_status, "CREATED")
+        self.assertEqual(payments["3201451002"].check_attempts, 1)
+        self.assertGreater(payments["3201451002"].next_check_at, timezone.now())
+
+        # Not due until the backoff passes
+        self.assertEqual(poll_gopay_payments(fetch=self.fail)["checked"], 0)
+
+
+class GopayNotificationTests(TransactionTestCase):
+    serialized_rollback = True
+
+    def test_state_is_fetched_while_the_payment_is_locked(self):
+        GopayPayment.objects.create(
+            payment_id="3201451123", payment_status="CREATED", payment_data={}
+        )
+        locked = []
+
+        def fetch(payment_id):
+            def try_lock():
+                try:
+                    with transaction.atomic():
+                        GopayPayment.objects.select_for_update(nowait=True).get(
+                            payment_id=payment_id
+                        )
+                    locked.append(False)
+                except DatabaseError:
+                    locked.append(True)
+                finally:
+                    connection.close()
+
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return {"id": payment_id, "state": "PAID"}
+
+        with mock.patch("shop.tasks.get_gopay_payment_details", fetch):
+            with transaction.atomic():
+                apply_gopay_notification("3201451123")
+
+        self.assertEqual(locked, [True])
+        payment = GopayPayment.objects.get(payment_id="3201451123")
+        self.assertEqual(payment.payment_status, "PAID")
+        self.assertTrue(payment.is_paid)
+
+
+class PacketTrackingTests(TestCase):
+    STATUSES = {"101": ("3", "ready for pickup"), "102": ("2", "arrived")}
+
+    def respond(self, method, path, body):
+        packet_id = body.decode().split("<packetId>")[1].split("</packetId>")[0]
+        if packet_id not in self.STATUSES:
+            return 200, (
+                b"<response><status>fault</status><fault>PacketIdFault</fault>"
+                b"<string>Unknown packet</string></response>"
+            )
+        code, text = self.STATUSES[packet_id]
+        return 200, (
+            f"<response><status>ok</status><result><statusCode>{code}</statusCode>"
+            f"<codeText>{text}</codeText><statusText>{text.capitalize()}</statusText>"
+            f"</result></response>"
+        ).encode()
+
+    def test_unfinished_packets_are_tracked(self):
+        packets = {
+            packet_id: Packet.objects.create(packet_id=packet_id, **fields)
+            for packet_id, fields in {
+                "101": {},
+                "102": {
+                    "status_code": 2,
+                    "status_name": "arrived",
+                    "status_display_name": "Arrived",
+                },
+                "103": {},
+                "104": {"status_code": 7},
+                "105": {"next_check_at": timezone.now() + timedelta(hours=1)},
+            }.items()
+        }
+
+        with FakeServer(self.respond) as server, mock.patch.object(
+            packeta_transport, "_transport", None
+        ), self.settings(PACKETA_BASE_URL=f"{server.url}/api/rest/"):
+            stats = track_packets()
+
+        self.assertEqual(
+            (stats["checked"], stats["changed"], stats["failed"]), (3, 1, 1)
+        )
+        self.assertEqual(len(server.requests), 3)
+        for packet in packets.values():
+            packet.refresh_from_db()
+        self.assertEqual(
+            (packets["101"].status_code, packets["101"].status_display_name),
+            (3, "Ready for pickup"),
+        )
+        self.assertEqual(packets["102"].check_attempts, 1)
+        self.assertGreater(packets["102"].next_check_at, timezone.now())
+        self.assertIsNone(packets["103"].status_code)
+        self.assertEqual(packets["104"].check_attempts, 0)
+
+
+class PaymentStatusCheckTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = GopayPayment.objects.create(
+            payment_id="3201451123", payment_status="CREATED", payment_data={}
+        )
+        self.order = self.create_order(
+            order_number="261000001", gopay_payment=self.payment
+        )
+        self.url = reverse("shop:payment_status_check", args=["261000001"])
+
+    def check(self, attempt="0", url=None):
+        return self.client.get(
+            url or self.url, {"attempt": attempt}, secure=True, HTTP_HX_REQUEST="true"
+        )
+
+    def test_unresolved_payment_is_polled_again(self):
+        with mock.patch("shop.gopay_api.get_gopay_client") as get_gopay_client:
+            response = self.check("3")
+
+        get_gopay_client.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '{"attempt": 4}')
+        self.assertContains(self.check("not a number"), '{"attempt": 1}')
+
+    def test_resolved_payment_redirects(self):
+        self.payment.payment_status = "CANCELED"
+        self.payment.save()
+        self.assertEqual(
+            self.check()["HX-Redirect"], reverse("shop:thank_you_not_paid")
+        )
+
+        Order.objects.filter(pk=self.order.pk).update(is_paid=True)
+        self.assertEqual(self.check()["HX-Redirect"], reverse("shop:thank_you_paid"))
+
+    def test_polling_gives_up(self):
+        response = self.check(str(PaymentStatusCheckView.MAX_ATTEMPTS - 1))
+        self.assertEqual(response["HX-Redirect"], reverse("shop:thank_you_not_paid"))
+
+    def test_only_htmx_requests_and_known_orders(self):
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 403)
+        unknown = reverse("shop:payment_status_check", args=["261000002"])
+        self.assertEqual(self.check(url=unknown).status_code, 404)
@@ -7,8 +7,12 @@ app_name = "shop"
 
 urlpatterns = [
     path("add-to-cart/", views.AddToCartView.as_view(), name="add_to_cart"),
+    path("update-cart/", views.UpdateCartView.as_view(), name="update_cart"),
     path("checkout/", views.CheckoutView.as_view(), name="checkout"),
     path("order/<str:order_number>/callback/", views.PaymentCallbackView.as_view(), name="order_payment_callback"),
+    path("order/<str:order_number>/payment/", views.PaymentStatusView.as_view(), name="payment_status"),
+    path("order/<str:order_number>/payment/check/", views.PaymentStatusCheckView.as_view(),
+         name="payment_status_check"),
     path("thank-you/", views.ThankYouView.as_view(), name="thank_you"),
     path("thank-you/paid/",
          views.ThankYouView.as_view(extra_context={"description": _("Thank You for your order! It is paid.")}),
@@ -18,8 +22,10 @@ urlpatterns = [
          name="thank_you_not_paid"),
     path("error/", views.ErrorView.as_view(), name="error"),
     path("gopay-notify/", views.GopayNotifyView.as_view(), name="gopay_notify"),
+    path("packeta-points/", views.PacketaPointsView.as_view(), name="packeta_points"),
     path("invoice/<str:order_number>/", views.InvoiceDetailView.as_view(), name="invoice_detail"),
     path("load-order-summary/", views.LoadOrderSummary.as_view(), name="load_order_summary"),
     path("load-cart/", views.LoadCart.as_view(), name="load_cart"),
     path("load-cart-icon/", views.LoadCartIcon.as_view(), name="load_cart_icon"),
+    path("refresh-cart/", views.RefreshCart.as_view(), name="refresh_cart"),
 ]
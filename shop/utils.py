@@ -1,20 +1,82 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 
+logger = logging.getLogger("django")
+
+
+# Hands out the next number of the period, creating the counter on first use.
+# The row lock taken by the upsert makes concurrent allocations wait for each other.
+ALLOCATE_ORDER_NUMBER_SQL = """
+    INSERT INTO shop_ordernumbercounter (period, last_value) VALUES (%s, 1)
+    ON CONFLICT (period) DO UPDATE
+        SET last_value = shop_ordernumbercounter.last_value + 1
+    RETURNING last_value
+"""
+
+
+# Orders whose stored aggregates differ from the aggregates computed from their items
+ORDER_AGGREGATES_MISMATCH_SQL = """
+    WITH computed AS (
+        SELECT shop_order.id,
+            COALESCE(SUM(item.total_price), 0) AS total_price,
+            COALESCE(SUM(item.quantity * product.weight_kg), 0) AS total_weight_kg,
+            COALESCE(SUM(item.quantity), 0) AS item_count
+        FROM shop_order
+        LEFT JOIN shop_orderitem item ON item.order_id = shop_order.id
+        LEFT JOIN shop_product product ON product.id = item.product_id
+        GROUP BY shop_order.id
+    )
+    {statement}
+"""
+
+SELECT_ORDER_AGGREGATES_MISMATCH_SQL = ORDER_AGGREGATES_MISMATCH_SQL.format(
+    statement="""
+    SELECT shop_order.order_number
+    FROM shop_order JOIN computed ON computed.id = shop_order.id
+    WHERE shop_order.total_price IS DISTINCT FROM computed.total_price
+        OR ABS(shop_order.total_weight_kg - computed.total_weight_kg) > 0.0005
+        OR shop_order.item_count <> computed.item_count
+    ORDER BY shop_order.id
+"""
+)
+
+FIX_ORDER_AGGREGATES_SQL = ORDER_AGGREGATES_MISMATCH_SQL.format(
+    statement="""
+    UPDATE shop_order
+    SET total_price = computed.total_price,
+        total_weight_kg = computed.total_weight_kg,
+        item_count = computed.item_count
+    FROM computed
+    WHERE computed.id = shop_order.id
+        AND (
+            shop_order.total_price IS DISTINCT FROM computed.total_price
+            OR ABS(shop_order.total_weight_kg - computed.total_weight_kg) > 0.0005
+            OR shop_order.item_count <> computed.item_count
+        )
+    RETURNING shop_order.order_number
+"""
+)
+
 
 def generate_order_number():
     """
     Function to generate a new order number with format 'YYMM00000',
-    where 00000 is number of orders in the month
+    where 00000 is a sequence number of the order in the month,
+    allocated from a per-month OrderNumberCounter row.
     """
-    from shop.models import Order
-
-    year = str(timezone.now().strftime("%y"))
-    month = str(timezone.now().strftime("%m"))
-    num_orders = Order.objects.filter(created_at__month=timezone.now().month).count()
-    orders_this_month = str.zfill(str(num_orders + 1), 5)
+    period = timezone.localtime().strftime("%y%m")
+    with connection.cursor() as cursor:
+        cursor.execute(ALLOCATE_ORDER_NUMBER_SQL, [period])
+        (sequence,) = cursor.fetchone()
 
-    order_number = year + month + orders_this_month
+    order_number = period + str.zfill(str(sequence), 5)
 
     if settings.ENV == "PROD":
         return order_number
@@ -25,3 +87,99 @@ def generate_order_number():
 def clear_service_order_session(request):
     del request.session["service_order"]
     del request.session["billing_address"]
+
+
+def delete_abandoned_carts(ttl_days=None, chunk_size=1000) -> dict:
+    """
+    Deletes carts (and their items) that haven't been touched for ttl_days.
+
+    Carts are walked in primary key order in chunks of chunk_size, every chunk
+    is deleted in its own short transaction, so the cart tables are never locked
+    for long.
+
+    :param ttl_days: Idle time after which a cart is abandoned, defaults to settings.ABANDONED_CART_TTL_DAYS.
+    :param chunk_size: Number of carts deleted per transaction.
+    :return: Dict with number of deleted carts, cart items and the duration in seconds.
+    """
+    from shop.models import Cart, CartItem
+
+    started_at = time.monotonic()
+    cutoff = timezone.now() - timedelta(
+        days=ttl_days or settings.ABANDONED_CART_TTL_DAYS
+    )
+    # Cart.add() only touches the items, so recent items keep the cart alive as well
+    abandoned_carts = Cart.objects.filter(updated_at__lt=cutoff).filter(
+        ~Exists(
+            CartItem.objects.filter(
+                cart=OuterRef("pk"), updated_at__gte=cutoff
+            )
+        )
+    )
+
+    stats = {"carts": 0, "items": 0}
+    last_pk = 0
+    while True:
+        pks = list(
+            abandoned_carts.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+
+        with transaction.atomic():
+            # Filtering the abandoned queryset again skips carts updated in the meantime
+            _deleted, deleted_per_model = abandoned_carts.filter(
+                pk__in=pks
+            ).delete()
+
+        stats["carts"] += deleted_per_model.get("shop.Cart", 0)
+        stats["items"] += deleted_per_model.get("shop.CartItem", 0)
+        last_pk = pks[-1]
+
+    stats["duration"] = round(time.monotonic() - started_at, 3)
+    logger.info(f"Abandoned carts deleted: {stats}")
+    return stats
+
+
+def reconcile_order_aggregates(fix=False) -> list:
+    """
+    Compares the denormalized total price, weight and item count of all orders
+    with aggregates of their items, in a single statement.
+
+    :param fix: Overwrite the wrong aggregates with the computed ones.
+    :return: Order numbers of the orders with wrong aggregates.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            FIX_ORDER_AGGREGATES_SQL if fix else SELECT_ORDER_AGGREGATES_MISMATCH_SQL
+        )
+        order_numbers = [row[0] for row in cursor.fetchall()]
+
+    if order_numbers:
+        logger.warning(
+            f"Orders with wrong aggregates{' fixed' if fix else ''}: {order_numbers}"
+        )
+    return order_numbers
+
+
+def fetch_concurrently(fetch, keys, max_workers: int) -> dict:
+    """
+    Calls fetch(key) for all keys in a thread pool of max_workers threads.
+
+    :return: {key: result}, exceptions raised by fetch are returned as results.
+    """
+
+    def safe_fetch(key):
+        try:
+            return fetch(key)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(keys, executor.map(safe_fetch, keys)))
+
+
+def backoff_delay(attempts: int, backoff: int, max_backoff: int) -> timedelta:
+    """Exponential backoff of backoff seconds doubled with every attempt, up to max_backoff."""
+    return timedelta(seconds=min(backoff * 2**attempts, max_backoff))
@@ -1,8 +1,12 @@
+import json
 import logging
+from datetime import timedelta
 from gettext import gettext as _
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.forms import model_to_dict
 from django.http import (
     JsonResponse,
@@ -10,31 +14,30 @@ from django.http import (
     Http404,
     HttpResponseNotAllowed,
     HttpResponseForbidden,
+    HttpResponseBadRequest,
 )
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import TemplateView, CreateView, DetailView
-from django_htmx.http import trigger_client_event
+from django_htmx.http import HttpResponseClientRedirect, trigger_client_event
 
+from core import outbox
 from core.models import ControlCenter
-from shop.api.packeta_api import Packeta
+from shop.cart import get_cart, load_cart_lines
+from shop.checkout import place_order, OutOfStockError
 from shop.forms import AddressMultiForm
-from shop.gopay_api import (
-    create_gopay_order,
-    get_gopay_payment_details,
-)
+from shop.gopay_api import create_gopay_order
 from shop.models import (
     Product,
     BillingAddress,
-    Cart,
     BillingType,
     GopayPayment,
     Invoice,
     Order,
-    OrderItem,
 )
 from shop.models.models import ProductVariant, ShippingAddress
+from shop.packeta_points import get_valid_point, nearest_points, points_by_zip_code
 
 logger = logging.getLogger("django")
 
@@ -76,19 +79,21 @@ class ProductsView(TemplateView):
 
 
 class GopayNotifyView(View):
-    """View listening for GoPay notifications and updating appropriate GopayPayment objects."""
+    """
+    View listening for GoPay notifications. Notifications are only recorded and
+    acknowledged right away, the payment state is fetched and applied by the outbox
+    worker, once for all notifications of a payment within GOPAY_NOTIFICATION_WINDOW.
+    """
 
     def get(self, request):
         logger.info(f"Gopay notification received: {str(request.GET)}")
         payment_id = request.GET.get("id")
-        if payment_id:
-            payment_details = get_gopay_payment_details(payment_id)
-            GopayPayment.objects.update_or_create(
+        if payment_id and payment_id.isdigit():
+            outbox.enqueue(
+                "shop.apply_gopay_notification",
+                delay=timedelta(seconds=settings.GOPAY_NOTIFICATION_WINDOW),
+                dedupe_key=f"gopay-notification:{payment_id}",
                 payment_id=payment_id,
-                defaults={
-                    "payment_status": payment_details["state"],
-                    "payment_data": payment_details,
-                },
             )
             return JsonResponse({"success": True})
 
@@ -97,6 +102,41 @@ class GopayNotifyView(View):
         )
 
 
+class PacketaPointsView(View):
+    """
+    Looks up Packeta pick-up points in the local catalogue, either the nearest
+    to ?lat=&lng= or those with a ZIP code starting with ?zip=, at most ?limit= of them.
+    """
+
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        try:
+            limit = min(int(request.GET.get("limit", 10)), self.MAX_LIMIT)
+            if "lat" in request.GET and "lng" in request.GET:
+                latitude = float(request.GET["lat"])
+                longitude = float(request.GET["lng"])
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    raise ValueError
+                points = [
+                    {**point.as_dict(), "distance_km": point.distance_km}
+                    for point in nearest_points(latitude, longitude, limit)
+                ]
+            elif request.GET.get("zip"):
+                points = [
+                    point.as_dict()
+                    for point in points_by_zip_code(request.GET["zip"], limit)
+                ]
+            else:
+                raise ValueError
+        except ValueError:
+            return JsonResponse(
+                {"success": False, "message": "Pass lat and lng or zip."}, status=400
+            )
+
+        return JsonResponse({"success": True, "points": points})
+
+
 class CheckoutView(ShopRequiredMixin, CreateView):
     template_name = "shop/checkout.html"
     form_class = AddressMultiForm
@@ -105,91 +145,107 @@ class CheckoutView(ShopRequiredMixin, CreateView):
         """Returns the initial data to use for forms on this view."""
         initial = super().get_initial()
 
-        existing_billing_address = self.request.session.get("billing_address")
+        existing_billing_address = BillingAddress.objects.filter(
+            pk=self.request.session.get("billing_address")
+        ).first()
         if existing_billing_address:
-            existing_billing_address = BillingAddress.objects.get(
-                pk=existing_billing_address
-            )
             initial.update(existing_billing_address.__dict__)
         else:
             initial["country"] = "CZ"
 
         return initial
 
+    def get(self, request, *args, **kwargs):
+        cart = get_cart(request)
+        if cart:
+            # Entering the checkout holds the cart's pieces for a while again
+            cart.hold_stock()
+
+        return super().get(request, *args, **kwargs)
+
     def get_success_url(self):
-        try:
-            Cart.objects.get(pk=self.request.session.get("cart")).delete()
-        except Cart.DoesNotExist:
-            pass
+        self.cart.clear()
         if self.order.billing_type.name == "card-online":
             return create_gopay_order(self.order)
 
         return reverse_lazy("shop:thank_you")
 
     def form_valid(self, form):
-        cart = Cart.objects.get(
-            pk=self.request.session.get(
-                "cart",
-            )
-        )
+        cart = get_cart(self.request)
+        if not cart:
+            return HttpResponseRedirect(self.request.path)
 
-        if cart.must_be_paid_online and self.request.POST.get("pay_later"):
+        summary = cart.summary()
+        if summary.must_be_paid_online and self.request.POST.get("pay_later"):
             return HttpResponseRedirect(self.request.path)
 
         user = (
             self.request.user if self.request.user.is_authenticated else None
         )
-        billing_address, _created = BillingAddress.objects.get_or_create(
-            **form["billing_address"].cleaned_data
+        billing_address, _created = (
+            BillingAddress.objects.get_or_create_by_fingerprint(
+                **form["billing_address"].cleaned_data
+            )
         )
         if not form["shipping_address"].cleaned_data["address1"]:
             billing_address_dict = model_to_dict(billing_address)
             billing_address_dict.pop("id")
             billing_address_dict.pop("address_ptr")
-            billing_address_dict["created_at"] = billing_address.created_at
-            shipping_address, _created = ShippingAddress.objects.get_or_create(
-                **billing_address_dict
+            shipping_address, _created = (
+                ShippingAddress.objects.get_or_create_by_fingerprint(
+                    **billing_address_dict
+                )
             )
         else:
-            shipping_address, _created = ShippingAddress.objects.get_or_create(
-                **form["shipping_address"].cleaned_data
+            shipping_address, _created = (
+                ShippingAddress.objects.get_or_create_by_fingerprint(
+                    **form["shipping_address"].cleaned_data
+                )
             )
         logger.info("SHIPPING ADDRESS HERE")
         logger.info(billing_address)
         logger.info(shipping_address)
-        new_order = Order.objects.create(
-            created_by=user,
-            billing_address=billing_address,
-            shipping_address=shipping_address,
-            packeta_point_id=self.request.POST.get("packeta_point_id", None),
-            packeta_point_name=self.request.POST.get(
-                "packeta_point_name", None
-            ),
-        )
 
-        for item in cart.cartitem_set.all():
-            OrderItem.objects.create(
-                quantity=item.amount,
-                product=item.product,
-                product_variant=item.product_variant,
-                order=new_order,
-                total_price=item.price,
-            )
-        self.order = new_order
+        packeta_point = None
+        if self.request.POST.get("packeta_point_id"):
+            packeta_point = get_valid_point(self.request.POST["packeta_point_id"])
+            if packeta_point is None:
+                messages.error(
+                    self.request, _("The selected pick-up point doesn't exist.")
+                )
+                return HttpResponseRedirect(self.request.path)
 
+        billing_type = None
         if self.request.POST.get("pay_now"):
-            new_order.billing_type = BillingType.objects.get(
-                name="card-online"
-            )
+            billing_type = BillingType.objects.get(name="card-online")
         elif self.request.POST.get("pay_later"):
-            new_order.billing_type = BillingType.objects.get(name="cash")
+            billing_type = BillingType.objects.get(name="cash")
 
-        new_order.save()
+        try:
+            new_order = place_order(
+                summary,
+                holder=cart.reservation_holder,
+                created_by=user,
+                billing_address=billing_address,
+                shipping_address=shipping_address,
+                billing_type=billing_type,
+                packeta_point_id=packeta_point.pk if packeta_point else None,
+                packeta_point_name=(
+                    packeta_point.name
+                    or self.request.POST.get("packeta_point_name", None)
+                    if packeta_point
+                    else None
+                ),
+            )
+        except OutOfStockError:
+            messages.error(
+                self.request,
+                _("Some of the items in your cart are no longer in stock."),
+            )
+            return HttpResponseRedirect(self.request.path)
 
-        # TODO: Move somewhere else. Maybe introduce checkout_complete signal?
-        if new_order.packeta_point_id:
-            packeta = Packeta()
-            packeta.create_packet_from_order(new_order)
+        self.order = new_order
+        self.cart = cart
 
         return HttpResponseRedirect(self.get_success_url())
 
@@ -198,33 +254,38 @@ class PaymentCallbackView(View):
     """
     This view's URL is passed to GoPay payments as a callback url.
     This is the View that users come back to after GoPay payments.
-    GoPay includes payment ID in the URL. Using the ID we can check
-    the payment status and redirect to appropriate View.
+    GoPay includes payment ID in the URL. The customer is redirected right away
+    using the latest known payment state, the state is fetched in the background
+    and PaymentStatusView waits for it.
     """
 
     def get(self, request, *args, **kwargs):
         order_number = self.kwargs["order_number"]
-        order = Order.objects.get(order_number=order_number)
+        order = Order.objects.filter(order_number=order_number).first()
         payment_id = request.GET.get("id")
-        if order and payment_id:
-            payment_details = get_gopay_payment_details(payment_id)
-            gopay_payment, _created = GopayPayment.objects.update_or_create(
-                payment_id=payment_id,
-                defaults={
-                    "payment_status": payment_details["state"],
-                    "payment_data": payment_details,
-                },
-            )
-            order.gopay_payment = gopay_payment
-            order.save()
+        if order and payment_id and payment_id.isdigit():
             if order.is_paid:
                 return HttpResponseRedirect(
                     reverse_lazy("shop:thank_you_paid")
                 )
-            else:
-                return HttpResponseRedirect(
-                    reverse_lazy("shop:thank_you_not_paid")
+
+            with transaction.atomic():
+                GopayPayment.objects.bulk_create(
+                    [GopayPayment(payment_id=payment_id, payment_data={})],
+                    ignore_conflicts=True,
+                )
+                Order.objects.filter(pk=order.pk, gopay_payment=None).update(
+                    gopay_payment=GopayPayment.objects.get(payment_id=payment_id)
+                )
+                # Coalesced with GoPay's own notification of the payment
+                outbox.enqueue(
+                    "shop.apply_gopay_notification",
+                    dedupe_key=f"gopay-notification:{payment_id}",
+                    payment_id=payment_id,
                 )
+            return HttpResponseRedirect(
+                reverse_lazy("shop:payment_status", args=[order_number])
+            )
 
         logger.info(
             f"Payment failed - Order: {order_number}, Payment ID: {payment_id if payment_id else None}"
@@ -232,6 +293,61 @@ class PaymentCallbackView(View):
         return HttpResponseRedirect(reverse_lazy("shop:error"))
 
 
+class PaymentStatusView(TemplateView):
+    """Page the customer waits on until the payment of the order is resolved."""
+
+    template_name = "shop/payment_status.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["order_number"] = self.kwargs["order_number"]
+        context["attempt"] = 0
+        return context
+
+
+class PaymentStatusCheckView(HtmxRequiredMixin, View):
+    """
+    Cheap HTMX endpoint polled by PaymentStatusView. Reads the state recorded
+    by GoPay notifications from the database, never calls GoPay itself.
+
+    Redirects to the thank you page once the payment is paid or finished unpaid,
+    otherwise responds with the polling fragment again.
+    """
+
+    # Polling gives up after this many checks, the payment may still be resolved later
+    MAX_ATTEMPTS = 30
+
+    def get(self, request, *args, **kwargs):
+        order_number = self.kwargs["order_number"]
+        order = (
+            Order.objects.filter(order_number=order_number)
+            .values("is_paid", "gopay_payment__payment_status")
+            .first()
+        )
+        if not order:
+            raise Http404
+
+        try:
+            attempt = int(request.GET.get("attempt", 0)) + 1
+        except (TypeError, ValueError):
+            attempt = 1
+        if order["is_paid"]:
+            return HttpResponseClientRedirect(reverse_lazy("shop:thank_you_paid"))
+        if (
+            order["gopay_payment__payment_status"] in GopayPayment.FINAL_STATES
+            or attempt >= self.MAX_ATTEMPTS
+        ):
+            return HttpResponseClientRedirect(
+                reverse_lazy("shop:thank_you_not_paid")
+            )
+
+        return render(
+            request,
+            "shop/includes/_payment_status.html",
+            {"order_number": order_number, "attempt": attempt},
+        )
+
+
 class ThankYouView(TemplateView):
     template_name = "shop/thank_you.html"
 
@@ -243,7 +359,8 @@ class ErrorView(TemplateView):
 class AddToCartView(ShopRequiredMixin, View):
     """
     View accepting POST requests with Product PK and amount in body,
-    adds the items to session's cart instance and returns rendered HTML cart.
+    adds the items to session's cart instance and returns a check mark
+    along with out-of-band swaps of all cart fragments.
 
     Amount defaults to 1 if not specified.
 
@@ -251,16 +368,11 @@ class AddToCartView(ShopRequiredMixin, View):
     """
 
     def post(self, request, *args, **kwargs):
-        user = request.user if request.user.is_authenticated else None
-        cart_pk = request.session.get("cart")
         item_pk = int(request.POST.get("item"))
         variant_pk = int(request.POST.get("variant", 0)) or None
         amount = int(request.POST.get("amount", 1))
 
-        cart = Cart.objects.filter(pk=cart_pk).first()
-        if not cart:  # Create a new cart if there is no cart in session
-            cart = Cart.objects.create(created_by=user)
-            request.session["cart"] = cart.pk
+        cart = get_cart(request, create=True)
 
         item = Product.objects.get(pk=item_pk)
         if variant_pk:
@@ -268,9 +380,47 @@ class AddToCartView(ShopRequiredMixin, View):
         else:
             variant = None
         item_added = cart.add(item, variant, amount)
-        response = render(request, "storengine/includes/_check_mark.html")
-        if not item_added:
-            response = render(request, "storengine/includes/_cross_mark.html")
+        response = render(
+            request,
+            "shop/includes/_cart_update.html",
+            {"item_added": item_added},
+        )
+        return trigger_client_event(
+            response,
+            "cartUpdated",
+            {},
+        )
+
+
+class UpdateCartView(ShopRequiredMixin, View):
+    """
+    Batch version of AddToCartView. Accepts POST requests with "operations",
+    a JSON list of {"item": <Product PK>, "variant": <Variant PK>, "amount": <delta>},
+    and applies all of them to the cart in a single transaction.
+
+    Responds like AddToCartView, with a single cartUpdated event.
+    """
+
+    def post(self, request, *args, **kwargs):
+        cart = get_cart(request)
+        try:
+            operations = json.loads(request.POST.get("operations", "[]"))
+            lines, rejected = load_cart_lines(
+                operations,
+                holder=cart.reservation_holder if cart else None,
+                line_amounts=cart.line_amounts() if cart else None,
+            )
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return HttpResponseBadRequest()
+
+        if lines:
+            (cart or get_cart(request, create=True)).add_many(lines)
+
+        response = render(
+            request,
+            "shop/includes/_cart_update.html",
+            {"item_added": bool(lines) and not rejected},
+        )
         return trigger_client_event(
             response,
             "cartUpdated",
@@ -282,6 +432,12 @@ class LoadCart(ShopRequiredMixin, HtmxRequiredMixin, TemplateView):
     template_name = "storengine/includes/_cart.html"
 
 
+class RefreshCart(ShopRequiredMixin, HtmxRequiredMixin, TemplateView):
+    """Returns cart, cart icon and order summary as out-of-band swaps in one response."""
+
+    template_name = "shop/includes/_cart_fragments.html"
+
+
 class InvoiceDetailView(ShopRequiredMixin, LoginRequiredMixin, DetailView):
     model = Invoice
     slug_url_kwarg = "order_number"
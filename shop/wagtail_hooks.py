@@ -1,4 +1,5 @@
 from django.utils.html import format_html
+from wagtail.admin.panels import FieldPanel, ObjectList
 from wagtail.contrib.modeladmin.options import (
     ModelAdmin,
     modeladmin_register,
@@ -7,6 +8,7 @@ from wagtail.contrib.modeladmin.options import (
 from wagtail_localize.modeladmin.options import TranslatableModelAdmin
 
 from shop import admin
+from shop.forms import AddressWagtailAdminForm
 from shop.models import (
     Product,
     Order,
@@ -90,6 +92,23 @@ class GopayPaymentAdmin(ModelAdmin):
         return instance.payment_data["order_number"]
 
 
+# Validated by the form, a duplicate address would violate the unique fingerprint
+address_edit_handler = ObjectList(
+    [
+        FieldPanel("first_name"),
+        FieldPanel("last_name"),
+        FieldPanel("email"),
+        FieldPanel("phone"),
+        FieldPanel("company"),
+        FieldPanel("address1"),
+        FieldPanel("zip_code"),
+        FieldPanel("city"),
+        FieldPanel("country"),
+    ],
+    base_form_class=AddressWagtailAdminForm,
+)
+
+
 class BillingAddressAdmin(ModelAdmin):
     model = BillingAddress
     menu_icon = "fa-address-book"
@@ -98,6 +117,7 @@ class BillingAddressAdmin(ModelAdmin):
     exclude_from_explorer = False
     list_display = admin.BillingAddressAdmin.list_display
     search_fields = admin.BillingAddressAdmin.search_fields
+    edit_handler = address_edit_handler
 
 
 class ShippingAddressAdmin(ModelAdmin):
@@ -108,6 +128,7 @@ class ShippingAddressAdmin(ModelAdmin):
     exclude_from_explorer = False
     list_display = admin.ShippingAddressAdmin.list_display
     search_fields = admin.ShippingAddressAdmin.search_fields
+    edit_handler = address_edit_handler
 
 
 class BillingTypeAdmin(TranslatableModelAdmin):
@@ -14,6 +14,9 @@ else
     exit 1
 fi
 
+# Table of the shared database cache.
+./manage.py createcachetable
+
 # Fixtures.
 #if ./manage.py loaddata fixtures; then
 #    echo -e "${GREEN}Fixtures loaded.${NC}"
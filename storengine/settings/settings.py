@@ -173,6 +173,23 @@ DATABASES = {
 db_from_env = dj_database_url.config()
 DATABASES["default"].update(db_from_env)
 
+# Caches
+# "default" is local to every process. "shared" is seen by all processes (web,
+# outbox worker, scheduler), use it for values that are invalidated on changes
+# and for anonymous carts (see shop.cart.SessionCart).
+# The database cache table is created by `manage.py createcachetable`.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": os.environ.get(
+            "SHARED_CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"
+        ),
+        "LOCATION": os.environ.get("SHARED_CACHE_LOCATION", "shared_cache"),
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -317,6 +334,27 @@ WAGTAILADMIN_RICH_TEXT_EDITORS = {
     },
 }
 
+# SHOP
+# Cart storage for anonymous visitors, use "shop.models.Cart" to keep them in the database.
+# shop.cart.SessionCart keeps them in the "shared" cache, point SHARED_CACHE_BACKEND
+# to Redis or Memcached to keep cart changes off the database completely.
+ANONYMOUS_CART_STORAGE = os.environ.get(
+    "ANONYMOUS_CART_STORAGE", "shop.cart.SessionCart"
+)
+# Carts not touched for this many days are deleted by delete_abandoned_carts
+ABANDONED_CART_TTL_DAYS = int(os.environ.get("ABANDONED_CART_TTL_DAYS", 30))
+# Adding to cart or entering the checkout holds the pieces for this many minutes
+STOCK_RESERVATION_MINUTES = int(os.environ.get("STOCK_RESERVATION_MINUTES", 15))
+# Inventory movements are folded into snapshots once they are this many seconds old
+INVENTORY_COMPACTION_DELAY = int(os.environ.get("INVENTORY_COMPACTION_DELAY", 60))
+
+# OUTBOX
+# Failed outbox jobs are retried after OUTBOX_RETRY_DELAY seconds, doubled with every attempt
+OUTBOX_RETRY_DELAY = int(os.environ.get("OUTBOX_RETRY_DELAY", 30))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+# Jobs running longer than OUTBOX_RUNNING_TIMEOUT seconds are considered abandoned and run again
+OUTBOX_RUNNING_TIMEOUT = int(os.environ.get("OUTBOX_RUNNING_TIMEOUT", 600))
+
 LOGIN_URL = "/login/"
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/"
@@ -342,6 +380,25 @@ GOPAY_GOID = os.environ.get("GOPAY_GOID")
 GOPAY_CLIENT_ID = os.environ.get("GOPAY_CLIENT_ID")
 GOPAY_CLIENT_SECRET = os.environ.get("GOPAY_CLIENT_SECRET")
 GOPAY_IS_PRODUCTION = ENV == "PROD"
+# Connect and read timeout of GoPay API requests in seconds
+GOPAY_TIMEOUT = float(os.environ.get("GOPAY_TIMEOUT", 10))
+# Notifications of the same payment received within this many seconds are processed once
+GOPAY_NOTIFICATION_WINDOW = int(os.environ.get("GOPAY_NOTIFICATION_WINDOW", 5))
+# Account statement used for bulk reconciliation, see shop/gopay_statement.py
+GOPAY_STATEMENT_FORMAT = os.environ.get("GOPAY_STATEMENT_FORMAT", "CSV_A")
+GOPAY_STATEMENT_DELIMITER = os.environ.get("GOPAY_STATEMENT_DELIMITER", ";")
+GOPAY_STATEMENT_COLUMNS = {
+    "payment_id": os.environ.get("GOPAY_STATEMENT_PAYMENT_ID_COLUMN", "Payment ID"),
+    "order_number": os.environ.get("GOPAY_STATEMENT_ORDER_NUMBER_COLUMN", "Order number"),
+    "amount": os.environ.get("GOPAY_STATEMENT_AMOUNT_COLUMN", "Amount"),
+    "currency": os.environ.get("GOPAY_STATEMENT_CURRENCY_COLUMN", "Currency"),
+}
+# Pending payments are polled with at most GOPAY_POLL_CONCURRENCY requests at a time.
+# A payment without a change is checked again after GOPAY_POLL_BACKOFF seconds,
+# doubled with every check, up to GOPAY_POLL_MAX_BACKOFF seconds.
+GOPAY_POLL_CONCURRENCY = int(os.environ.get("GOPAY_POLL_CONCURRENCY", 8))
+GOPAY_POLL_BACKOFF = int(os.environ.get("GOPAY_POLL_BACKOFF", 60))
+GOPAY_POLL_MAX_BACKOFF = int(os.environ.get("GOPAY_POLL_MAX_BACKOFF", 3600))
 
 # PACKETA CONFIG
 PACKETA_BASE_URL = os.environ.get(
@@ -349,6 +406,22 @@ PACKETA_BASE_URL = os.environ.get(
 )
 PACKETA_API_PASSWORD = os.environ.get("PACKETA_API_PASSWORD")
 PACKETA_SENDER_ID = os.environ.get("PACKETA_SENDER_ID")
+# Timeouts of Packeta API requests in seconds, labels of many packets take a while
+PACKETA_CONNECT_TIMEOUT = float(os.environ.get("PACKETA_CONNECT_TIMEOUT", 3.05))
+PACKETA_READ_TIMEOUT = float(os.environ.get("PACKETA_READ_TIMEOUT", 30))
+PACKETA_POOL_SIZE = int(os.environ.get("PACKETA_POOL_SIZE", 10))
+# Concurrent requests when creating packets of many orders at once from the admin
+PACKETA_CREATE_CONCURRENCY = int(os.environ.get("PACKETA_CREATE_CONCURRENCY", 4))
+# Every process rebuilds its index of pick-up points after PACKETA_POINTS_INDEX_TTL seconds
+PACKETA_POINTS_INDEX_TTL = int(os.environ.get("PACKETA_POINTS_INDEX_TTL", 3600))
+# Packets from the last PACKETA_TRACKING_DAYS days are tracked with at most
+# PACKETA_TRACKING_CONCURRENCY requests at a time. A packet without a change is checked
+# again after PACKETA_TRACKING_BACKOFF seconds, doubled with every check,
+# up to PACKETA_TRACKING_MAX_BACKOFF seconds.
+PACKETA_TRACKING_DAYS = int(os.environ.get("PACKETA_TRACKING_DAYS", 60))
+PACKETA_TRACKING_CONCURRENCY = int(os.environ.get("PACKETA_TRACKING_CONCURRENCY", 8))
+PACKETA_TRACKING_BACKOFF = int(os.environ.get("PACKETA_TRACKING_BACKOFF", 900))
+PACKETA_TRACKING_MAX_BACKOFF = int(os.environ.get("PACKETA_TRACKING_MAX_BACKOFF", 21600))
 
 # EMAIL
 EMAIL_HOST = os.environ.get("EMAIL_HOST", "smtp.titan.email")
@@ -362,6 +435,11 @@ ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL")
 SUPPORT_EMAIL = os.environ.get("SUPPORT_EMAIL")
 DEFAULT_FROM_EMAIL = ADMIN_EMAIL
 SERVER_EMAIL = ADMIN_EMAIL
+# Staff emails of internal notifications are cached in the shared cache for at most
+# this many seconds, the cache is cleared on every ShopUser change
+INTERNAL_MAILING_LIST_CACHE_TIMEOUT = int(
+    os.environ.get("INTERNAL_MAILING_LIST_CACHE_TIMEOUT", 300)
+)
 
 TINYMCE_API_KEY = os.environ.get("TINYMCE_API_KEY")
 DJRICHTEXTFIELD_CONFIG = {
@@ -3,12 +3,12 @@ import logging
 from django.contrib.auth import login, user_logged_in
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView
-from django.core.exceptions import MultipleObjectsReturned
 from django.dispatch import receiver
 from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy
 from django.views.generic import FormView, UpdateView, DeleteView, TemplateView
 
+from shop.cart import SessionCart
 from shop.models import Order, Cart
 from users.forms import ShopUserCreationForm
 from users.models import ShopUser
@@ -35,18 +35,19 @@ def set_session_cookies_preferences(request, user):
 
 
 def set_session_cart(request, user):
-    try:
-        cart = Cart.objects.get(created_by=user)
+    """Merges the session's guest cart and all carts of the user into one."""
+    session_cart = SessionCart(request.session)
+    session_lines = session_cart.line_amounts()
+    cart = Cart.merge_user_carts(
+        user,
+        guest_cart_pk=request.session.get("cart"),
+        session_lines=session_lines,
+        session_holder=session_cart.reservation_holder if session_lines else None,
+    )
+    session_cart.clear()
+    if cart:
         request.session["cart"] = cart.pk
         logger.info(f"Cart set for session. {request.session}")
-    except MultipleObjectsReturned:
-        Cart.objects.filter(created_by=user).delete()
-        logger.info(
-            f"Too many carts for user - deleted all cart instances. "
-            f"{request.session}"
-        )
-    except Cart.DoesNotExist:
-        pass
 
 
 @receiver(user_logged_in)